@@ -0,0 +1,253 @@
+import sys
+import os
+import argparse
+import random
+import time
+import shutil
+import tempfile
+import contextlib
+import io
+import itertools
+from datetime import datetime
+from dateutil.parser import parse as dateparse
+import sayari_mapper
+import sayari_generator
+
+#--sayari_mapper.py rebinds its mapper class name to the mapper it creates, so keep the class to make new ones from
+mapper_class = sayari_mapper.mapper
+codes_file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sayari_codes.csv')
+throughput_benchmarks = ['map_row', 'map', 'load', 'lookup', 'files']
+
+#----------------------------------------
+def make_date_samples(sample_count, distinct_count):
+    #--shaped like the date_of_birth and relationship date columns, mostly years and full dates that repeat a lot
+    distinct_dates = []
+    for i in range(distinct_count):
+        year = random.randint(1920, 2023)
+        month = random.randint(1, 12)
+        day = random.randint(1, 28)
+        shape = random.random()
+        if shape < 0.45:
+            distinct_dates.append(f'{year}')
+        elif shape < 0.85:
+            distinct_dates.append(f'{year}-{month:02d}-{day:02d}')
+        elif shape < 0.95:
+            distinct_dates.append(f'{year}-{month:02d}')
+        elif shape < 0.98:
+            distinct_dates.append(f'{day:02d}/{month:02d}/{year}')
+        else:
+            distinct_dates.append(random.choice(['unknown', 'n/a', f'circa {year}']))
+
+    #--a few values account for most of the rows
+    weights = [1.0 / (i + 1) for i in range(distinct_count)]
+    return random.choices(distinct_dates, weights=weights, k=sample_count)
+
+#----------------------------------------
+def time_calls(parse_function, date_list):
+    timer_start = time.perf_counter()
+    for raw_date in date_list:
+        try: parse_function(raw_date)
+        except: pass
+    return time.perf_counter() - timer_start
+
+#----------------------------------------
+def benchmark_dates(sample_count, distinct_count):
+    date_list = make_date_samples(sample_count, distinct_count)
+    print(f'\n{sample_count} dates, {len(set(date_list))} distinct\n')
+
+    #--dateutil fills a missing month or day in from today, the fast path uses the first of the period, so only the parts the raw date has are compared
+    mismatch_count = 0
+    for raw_date in set(date_list):
+        try: expected_date = dateparse(raw_date)
+        except: expected_date = None
+        parsed_date = sayari_mapper.parse_date(raw_date)
+        if parsed_date and expected_date and len(raw_date) in (4, 7):
+            date_format = '%Y' if len(raw_date) == 4 else '%Y-%m'
+            parsed_date, expected_date = parsed_date.strftime(date_format), expected_date.strftime(date_format)
+        if parsed_date != expected_date:
+            mismatch_count += 1
+    if mismatch_count:
+        print(f'WARNING: {mismatch_count} dates parsed differently than dateutil!\n')
+
+    dateutil_secs = time_calls(dateparse, date_list)
+    uncached_secs = time_calls(sayari_mapper.parse_date.__wrapped__, date_list)
+    sayari_mapper.parse_date.cache_clear()
+    cached_secs = time_calls(sayari_mapper.parse_date, date_list)
+
+    print(f'{"parser":<25} {"seconds":>10} {"dates/sec":>12} {"speedup":>8}')
+    for label, elapsed_secs in [('dateutil', dateutil_secs), ('parse_date (no cache)', uncached_secs), ('parse_date', cached_secs)]:
+        print(f'{label:<25} {round(elapsed_secs, 3):>10} {int(sample_count / elapsed_secs):>12} {round(dateutil_secs / elapsed_secs, 1):>7}x')
+    print(f'\n{sayari_mapper.parse_date.cache_info()}\n')
+
+#----------------------------------------
+def setup_mapper(output_path, relationdb_name=None, stats_level='off', raw_utf8=False, mapper_args=None):
+    #--the mapper module keeps its arguments and its mapper in globals, they are set up the same as a run of sayari_mapper.py would,
+    #--the code table is only read, new codes found in the synthetic data are never saved back to it
+    mapper_args = ['-o', output_path, '-U', '--stats', stats_level] + (['--raw_utf8'] if raw_utf8 else []) + (mapper_args or [])
+    sayari_mapper.args = sayari_mapper.get_argument_parser().parse_args(mapper_args)
+    sayari_mapper.shut_down = False
+    sayari_mapper.mapper = mapper_class(codes_file_name)
+    sayari_mapper.mapper.open_relation_db(relationdb_name)
+    return sayari_mapper.mapper
+
+#----------------------------------------
+def get_entity_batches(generator, batch_size=10000):
+    #--fresh copies of the rows a batch at a time as the mapper changes the rows it maps, so memory stays flat at any scale
+    entity_rows_iterator = generator.get_entity_rows()
+    while True:
+        entity_list = list(itertools.islice(entity_rows_iterator, batch_size))
+        if not entity_list:
+            break
+        yield entity_list
+
+#----------------------------------------
+def new_json_data(record_id):
+    #--the working record mapper.map starts every entity with
+    return {'DATA_SOURCE': 'SAYARI', 'RECORD_ID': record_id, 'ATTRIBUTE_LIST': [], 'CONTACT_METHODS': [], 'IDENTIFIER_LIST': [],
+            'distinct_name_list': [], 'distinct_address_list': [], 'status_list': [], 'company_type_list': []}
+
+#----------------------------------------
+def benchmark_map_row(scale_data):
+    mapper = setup_mapper(scale_data['output_path'], None, scale_data['stats_level'], scale_data['raw_utf8'])
+    elapsed_secs = 0
+    row_count = 0
+    for entity_list in get_entity_batches(scale_data['generator']):
+        json_list = [new_json_data(input_rows[0]['entity_id']) for input_rows in entity_list]
+        timer_start = time.perf_counter()
+        for input_rows, json_data in zip(entity_list, json_list):
+            for input_row in input_rows:
+                mapper.map_row(input_row, json_data)
+        elapsed_secs += time.perf_counter() - timer_start
+        row_count += sum(len(input_rows) for input_rows in entity_list)
+    return [('map_row', row_count, elapsed_secs)]
+
+#----------------------------------------
+def benchmark_map(scale_data):
+    #--whole entities without relationships, so the combining of rows and the record layout on top of map_row
+    mapper = setup_mapper(scale_data['output_path'], None, scale_data['stats_level'], scale_data['raw_utf8'])
+    elapsed_secs = 0
+    row_count = 0
+    for entity_list in get_entity_batches(scale_data['generator']):
+        timer_start = time.perf_counter()
+        for input_rows in entity_list:
+            mapper.map(input_rows)
+        elapsed_secs += time.perf_counter() - timer_start
+        row_count += sum(len(input_rows) for input_rows in entity_list)
+    return [('map', row_count, elapsed_secs)]
+
+#----------------------------------------
+def load_relation_db(scale_data, backend):
+    #--loaded once per backend and scale, the lookup and files benchmarks use the same database
+    relationdb_name = os.path.join(scale_data['work_path'], f'relationships-{backend}.db')
+    if relationdb_name not in scale_data['relation_db_list']:
+        setup_mapper(scale_data['output_path'], None, scale_data['stats_level'], scale_data['raw_utf8'])
+        timer_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sayari_mapper.load_relationships(relationdb_name, scale_data['relationship_file_list'], datetime.combine(datetime.now().date(), datetime.min.time()), 1, 1, backend)
+        scale_data['load_secs'][backend] = time.perf_counter() - timer_start
+        scale_data['relation_db_list'].append(relationdb_name)
+    return relationdb_name
+
+#----------------------------------------
+def benchmark_load(scale_data):
+    benchmark_results = []
+    for backend in sayari_mapper.relation_backend_list:
+        load_relation_db(scale_data, backend)
+        benchmark_results.append((f'load ({backend})', scale_data['relationship_row_count'], scale_data['load_secs'][backend]))
+    return benchmark_results
+
+#----------------------------------------
+def benchmark_lookup(scale_data):
+    #--the relationships of every entity with any, a batch at a time as map_batch asks for them and one at a time, the rows are entities
+    benchmark_results = []
+    for backend in sayari_mapper.relation_backend_list:
+        mapper = setup_mapper(scale_data['output_path'], load_relation_db(scale_data, backend), scale_data['stats_level'], scale_data['raw_utf8'])
+        batch_secs = 0
+        single_secs = 0
+        lookup_count = 0
+        for entity_list in get_entity_batches(scale_data['generator'], sayari_mapper.args.relation_batch_size):
+            timer_start = time.perf_counter()
+            mapper.prefetch_rel_pointers(entity_list)
+            batch_secs += time.perf_counter() - timer_start
+            mapper.rel_pointer_cache = None
+
+            record_id_list = [input_rows[0]['entity_id'] for input_rows in entity_list if mapper.has_relationships(input_rows)]
+            timer_start = time.perf_counter()
+            for record_id in record_id_list:
+                mapper.get_rel_pointers(record_id)
+            single_secs += time.perf_counter() - timer_start
+            lookup_count += len(record_id_list)
+        mapper.close_relation_db()
+        benchmark_results.append((f'lookup ({backend}, batch)', lookup_count, batch_secs))
+        benchmark_results.append((f'lookup ({backend}, single)', lookup_count, single_secs))
+    return benchmark_results
+
+#----------------------------------------
+def benchmark_files(scale_data):
+    #--each entity file read, mapped with its relationships and written as a run of sayari_mapper.py would with one process
+    benchmark_results = []
+    for backend in sayari_mapper.relation_backend_list:
+        relationdb_name = load_relation_db(scale_data, backend)
+        setup_mapper(scale_data['output_path'], relationdb_name, scale_data['stats_level'], scale_data['raw_utf8'])
+        row_count = 0
+        timer_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for input_file_name in scale_data['entity_file_list']:
+                row_count += sayari_mapper.process_entity_file(input_file_name)['input_row_count']
+        benchmark_results.append((f'files ({backend})', row_count, time.perf_counter() - timer_start))
+        sayari_mapper.mapper.close_relation_db()
+    return benchmark_results
+
+#----------------------------------------
+def benchmark_throughput(benchmark_list, scale_list, work_path, seed=1, stats_level='off', raw_utf8=False):
+    #--synthetic data is generated for each scale and every benchmark is run against it with the mapper set up the same way
+    print(f'\n{"benchmark":<28} {"entities":>10} {"rows":>10} {"seconds":>10} {"rows/sec":>12}')
+    for entity_count in scale_list:
+        scale_path = os.path.join(work_path, f'scale-{entity_count}')
+        os.makedirs(os.path.join(scale_path, 'output'), exist_ok=True)
+        generator = sayari_generator.sayari_generator(entity_count, seed, codes_file_name)
+        file_results = generator.write_files(scale_path, max(1, entity_count // 250000))
+        scale_data = {'work_path': scale_path,
+                      'output_path': os.path.join(scale_path, 'output') + os.path.sep,
+                      'generator': generator,
+                      'relation_db_list': [],
+                      'load_secs': {},
+                      'stats_level': stats_level,
+                      'raw_utf8': raw_utf8}
+        scale_data.update(file_results)
+
+        for benchmark in benchmark_list:
+            for label, row_count, elapsed_secs in globals()['benchmark_' + benchmark](scale_data):
+                print(f'{label:<28} {entity_count:>10} {row_count:>10} {round(elapsed_secs, 3):>10} {int(row_count / elapsed_secs) if elapsed_secs else 0:>12}')
+    print()
+
+#----------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=['dates'] + throughput_benchmarks + ['all'], help='the benchmark to run, all runs every one but dates')
+    parser.add_argument('-n', '--sample_count', type=int, default=200000, help='number of values to run through, defaults to 200000')
+    parser.add_argument('-d', '--distinct_count', type=int, default=20000, help='number of distinct values among them, defaults to 20000')
+    parser.add_argument('-s', '--seed', type=int, default=1, help='random seed so runs can be compared')
+    parser.add_argument('--scales', default='1000,10000,100000', help='comma separated numbers of synthetic entities to run the throughput benchmarks at, defaults to 1000,10000,100000')
+    parser.add_argument('--work_path', help='directory to generate the synthetic files in and keep them, defaults to a temporary directory that is removed')
+    parser.add_argument('--stats', choices=['off', 'basic', 'full'], default='off', help='statistics for the mapper to collect while it is timed, defaults to off')
+    parser.add_argument('--raw_utf8', action='store_true', default=False, help='have the mapper write compact utf-8 json as with its --raw_utf8 flag')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.benchmark == 'dates':
+        benchmark_dates(args.sample_count, args.distinct_count)
+    else:
+        try: scale_list = [int(scale) for scale in args.scales.split(',')]
+        except ValueError:
+            print('\nPlease supply the scales as comma separated numbers of entities\n')
+            sys.exit(1)
+        work_path = args.work_path or tempfile.mkdtemp(prefix='sayari_benchmark-')
+        try:
+            benchmark_throughput(throughput_benchmarks if args.benchmark == 'all' else [args.benchmark], scale_list, work_path, args.seed, args.stats, args.raw_utf8)
+        finally:
+            if not args.work_path:
+                shutil.rmtree(work_path)
+
+    sys.exit(0)
@@ -0,0 +1,324 @@
+import sys
+import os
+import argparse
+import csv
+import json
+import gzip
+import random
+import array
+import bisect
+import itertools
+import string
+import time
+
+#--the shapes and skew below follow the column profiles in the map_row comments of sayari_mapper.py
+entity_columns = ['entity_id', 'i', 'type', 'label', 'label_en', 'num_documents', 'sanctioned', 'pep', 'degree', 'source_counts', 'edge_counts', 'shares',
+                  'name', 'address', 'date_of_birth', 'gender', 'contact', 'identifier', 'weak_identifier', 'status', 'company_type', 'country',
+                  'additional_information', 'finances']
+relationship_columns = ['src', 'dst', 'type', 'attributes', 'from_date', 'to_date', 'former', 'acquisition_date', 'shares']
+
+#--rows per entity from the counts of the i column, the rest tail off geometrically
+rows_per_entity_weights = [(1, 0.620), (2, 0.359), (3, 0.0132), (4, 0.0039)]
+entity_type_weights = [('company', 1380456), ('person', 862138), ('tradename', 101304), ('vessel', 1449), ('aircraft', 1267)]
+num_documents_weights = [('1', 1938523), ('2', 297124), ('4', 33314), ('3', 20940), ('5', 15002)]
+source_counts_weights = [('{"CYP/companies":1.0}', 1843993), ('{"MLT/malta_companies_register":2.0}', 253695), ('{"MLT/malta_companies_register":1.0}', 79660),
+                         ('{"MLT/malta_companies_register":4.0}', 29292), ('{"USA/consolidated_screening_list":1.0,"USA/ofac_sdn":1.0}', 20094)]
+
+#--degree, the remaining 5.9% are hubs on a power law tail, a few nominee directors and service companies with thousands of edges
+degree_weights = [(0, 155049), (1, 1322510), (2, 473755), (3, 191237), (4, 81311)]
+hub_share = 0.059
+relationship_type_weights = [('director_of', 45), ('officer_of', 35), ('shareholder_of', 12), ('partner_of', 4), ('linked_to', 4)]
+
+#--percent of rows populated for the columns that can be on any row
+column_populated = {'name': 71.87, 'address': 33.35, 'date_of_birth': 0.28, 'gender': 0.1, 'contact': 0.06, 'identifier': 26.92, 'weak_identifier': 5.07,
+                    'status': 47.44, 'company_type': 18.07, 'country': 10.84, 'additional_information': 21.65, 'finances': 7.97}
+
+status_values = [({'value': 'closed', 'text': 'Διαγραμμένη'}, 177297), ({'value': 'active', 'text': 'Εγγεγραμμένη'}, 171304),
+                 ({'value': 'active', 'text': 'Στάληκε επιστολή Υπενθύμισης'}, 98201), ({'value': 'closed', 'text': 'Struck Off'}, 24452),
+                 ({'value': 'closed', 'text': 'Διάλυση λόγω Ολοκλήρωσης Εκούσιας Εκκαθάρισης'}, 18259)]
+company_type_values = [({'extra': {'Code': 'C', 'SubType': 'Ιδιωτική'}, 'value': 'Εταιρεία'}, 408959), ({'extra': {'Code': 'P', 'SubType': 'Ομόρρυθμος'}, 'value': 'Συνεταιρισμός'}, 8614),
+                       ({'extra': {'Code': 'O'}, 'value': 'Αλλοδαπή Εταιρεία'}, 3332), ({'extra': {'Code': 'P', 'SubType': 'Ετερόρρυθμος'}, 'value': 'Συνεταιρισμός'}, 1096),
+                       ({'extra': {'Code': 'C', 'SubType': 'Δι΄ Εγγυήσεως Χωρίς Κεφάλαιο'}, 'value': 'Εταιρεία'}, 1012)]
+additional_information_values = [({'extra': {'Name Status': 'Τελευταίο Όνομα', 'Name Status Code': 'ACR'}, 'type': 'Cyprus Additional Information'}, 474722),
+                                 ({'extra': {'Programs': 'SDNTK', 'Source List': 'Specially Designated Nationals (SDN) - Treasury Department'}, 'type': 'Sanction Information'}, 1794),
+                                 ({'extra': {'Additional Sanctions Information -': 'Subject to Secondary Sanctions'}, 'type': 'Other OFAC Sanctions Information'}, 1719),
+                                 ({'extra': {'Programs': 'SDGT', 'Source List': 'Specially Designated Nationals (SDN) - Treasury Department'}, 'type': 'Sanction Information'}, 1144)]
+country_context_weights = [('address', 60), ('nationality', 35), ('residence', 5)]
+finance_context_weights = [('registered_capital', 55), ('authorized_capital', 45)]
+
+company_words = ['CYPRO', 'TOTAL', 'MONTRAGO', 'MEDITERRANEAN', 'OLYMPIC', 'APHRODITE', 'LIMASSOL', 'NICOSIA', 'TRADING', 'HOLDINGS', 'SHIPPING', 'MARINE',
+                 'CAPITAL', 'INVESTMENTS', 'PROPERTIES', 'VENTURES', 'GLOBAL', 'NORTHERN', 'ATLAS', 'HELIOS', 'KOSMOS', 'DELTA', 'ORION', 'ZENON']
+company_suffixes = ['LIMITED', 'LTD', 'CO. LIMITED', 'SERVICES LIMITED', 'MANAGEMENT LIMITED', 'HOLDINGS LTD']
+first_names = ['ANDREAS', 'MARIA', 'GEORGIOS', 'ELENI', 'CHRISTOS', 'SOPHIA', 'NIKOS', 'ANNA', 'MICHAEL', 'JOHN', 'IVAN', 'OLGA', 'DMITRY', 'ELENA',
+               'JOSEPH', 'CARMEN', 'PAUL', 'ANNA MARIA', 'KONSTANTINOS', 'DESPINA']
+last_names = ['GEORGIOU', 'IOANNOU', 'CHARALAMBOUS', 'CONSTANTINOU', 'PAPADOPOULOS', 'NICOLAOU', 'BORG', 'CAMILLERI', 'VELLA', 'FARRUGIA', 'IVANOV',
+              'PETROV', 'SMIRNOVA', 'SMITH', 'ZAMMIT', 'GALEA', 'ANTONIOU', 'HADJI', 'PAVLOU', 'SAVVA']
+street_names = ['Αρχ. Μακαρίου ΙΙΙ', 'Αγίου Παύλου', 'Θεμιστοκλή Δέρβη', 'Γρ. Ξενοπούλου', 'Λεωφόρος Σπύρου Κυπριανού', 'Triq il-Kbira', 'Triq San Pawl', 'Republic Street']
+city_names = [('Λεμεσός', 'Κύπρος', '3'), ('Λευκωσία', 'Κύπρος', '1'), ('Λάρνακα', 'Κύπρος', '6'), ('Πάφος', 'Κύπρος', '8'), ('Valletta', 'Malta', 'VLT'), ('Sliema', 'Malta', 'SLM')]
+building_names = ['FORTUNA COURT BLOCK B', 'LEDRA HOUSE', 'PROTEAS HOUSE', 'JULIA HOUSE', 'OMEGA TOWER', 'CITY HOUSE', '']
+
+#--identifier, weak identifier and contact types with their counts, used when there is no sayari_codes.csv to take them from
+default_code_weights = {'IDENTIFIER_TYPE': [('cyp_reg_no', 474727, 'HE 35016'), ('malta_national_id', 37813, '463182M'), ('uk_company_number', 134378, '03067840'),
+                                            ('malta_accountancy_registration_id', 133, 'AB/26/84/28')],
+                        'WEAK_IDENTIFIER_TYPE': [('unknown', 2435, 'OS/1094/NT')],
+                        'CONTACT_TYPE': [('email', 402, 'office@gpsm.ru'), ('url', 770, 'http://nitcshipping.com'), ('phone_number', 116, '+963 112318875')],
+                        'COUNTRY_CODE': [('MLT', 101496, ''), ('CYP', 90000, ''), ('ITA', 10543, ''), ('GBR', 8188, ''), ('RUS', 5000, '')]}
+
+#----------------------------------------
+def weighted_chooser(value_weights):
+    #--returns a function that picks values in proportion to their weights in constant time per pick
+    value_list = [value for value, weight in value_weights]
+    cumulative_weights = list(itertools.accumulate(weight for value, weight in value_weights))
+    total_weight = cumulative_weights[-1]
+    def choose(rng):
+        return value_list[bisect.bisect_right(cumulative_weights, rng.random() * total_weight)]
+    return choose
+
+#----------------------------------------
+def load_code_weights(codes_file_name):
+    #--the reviewed codes and how often they were seen, with an example value to copy the shape of
+    code_weights = {code_type: list(code_list) for code_type, code_list in default_code_weights.items()}
+    if not codes_file_name or not os.path.exists(codes_file_name):
+        return code_weights
+    file_code_weights = {}
+    with open(codes_file_name, 'r') as f:
+        for row in csv.DictReader(f):
+            if row['CODE_TYPE'] in code_weights and row['REVIEWED'].upper() == 'Y' and row['ATTRIBUTE'] != '<unknown>' and int(row['COUNT'] or 0) > 0:
+                example_value = (row['EXAMPLES'] or '').split(' | ')[0]
+                code = row['CODE'] if row['CODE_TYPE'] == 'COUNTRY_CODE' else row['CODE'].lower()
+                file_code_weights.setdefault(row['CODE_TYPE'], []).append((code, int(row['COUNT']), example_value))
+    code_weights.update(file_code_weights)
+    return code_weights
+
+#----------------------------------------
+def make_entity_id(rng):
+    return ''.join(rng.choice(string.ascii_letters + string.digits + '-_') for i in range(22))
+
+#----------------------------------------
+def make_like(rng, example_value):
+    #--a new value with the same shape as the example, digits for digits and letters for letters
+    if not example_value:
+        return ''.join(rng.choice(string.digits) for i in range(8))
+    return ''.join(rng.choice(string.digits) if c.isdigit() else rng.choice(string.ascii_uppercase) if c.isalpha() else c for c in example_value)
+
+#----------------------------------------
+def make_date(rng):
+    #--mostly years and full dates like the date_of_birth and relationship date columns
+    year = rng.randint(1920, 2023)
+    shape = rng.random()
+    if shape < 0.45:
+        return f'{year}'
+    elif shape < 0.85:
+        return f'{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+    return f'{year}-{rng.randint(1, 12):02d}'
+
+#----------------------------------------
+def dump_json(json_data):
+    return json.dumps(json_data, ensure_ascii=False, separators=(',', ':'))
+
+#=========================
+class sayari_generator():
+    #--synthetic entities and relationships shaped like the sayari files, the same seed and entity count always make the same data
+
+    #----------------------------------------
+    def __init__(self, entity_count, seed=1, codes_file_name='sayari_codes.csv'):
+        self.entity_count = entity_count
+        self.seed = seed
+        rng = random.Random(seed)
+
+        #--sorted like the sayari files
+        self.entity_id_list = sorted(set(make_entity_id(rng) for i in range(entity_count)))
+        while len(self.entity_id_list) < entity_count:
+            self.entity_id_list = sorted(set(self.entity_id_list + [make_entity_id(rng)]))
+        self.entity_type_list = [weighted_chooser(entity_type_weights)(rng) for i in range(entity_count)]
+
+        #--labels repeat, 39.78% are unique and the rest come from a pool where a few names account for most of the rows
+        self.common_label_list = [self.make_label(rng, rng.random() < 0.37) for i in range(max(entity_count // 20, 10))]
+        self.choose_common_label = weighted_chooser([(label, 1.0 / (i + 1)) for i, label in enumerate(self.common_label_list)])
+
+        code_weights = load_code_weights(codes_file_name)
+        self.choose_code = {code_type: weighted_chooser([((code, example_value), count) for code, count, example_value in code_list]) for code_type, code_list in code_weights.items()}
+        self.choose_status = weighted_chooser(status_values)
+        self.choose_company_type = weighted_chooser(company_type_values)
+        self.choose_additional_information = weighted_chooser(additional_information_values)
+        self.choose_country_context = weighted_chooser(country_context_weights)
+        self.choose_finance_context = weighted_chooser(finance_context_weights)
+        self.choose_num_documents = weighted_chooser(num_documents_weights)
+        self.choose_source_counts = weighted_chooser(source_counts_weights)
+        self.choose_relationship_type = weighted_chooser(relationship_type_weights)
+        self.choose_rows_per_entity = weighted_chooser(rows_per_entity_weights + [(0, 1.0 - sum(weight for value, weight in rows_per_entity_weights))])
+
+        #--out degrees are decided up front and the in degrees counted as the relationships are made, so the degree column adds up
+        self.choose_degree = weighted_chooser(degree_weights)
+        self.out_degree_list = array.array('i', (self.make_out_degree(rng) for i in range(entity_count)))
+        self.in_degree_list = None
+
+    #----------------------------------------
+    def make_label(self, rng, is_person):
+        if is_person:
+            return f'{rng.choice(first_names)} {rng.choice(last_names)}'
+        return f'{rng.choice(company_words)} {rng.choice(company_words)} {rng.choice(company_suffixes)}'
+
+    #----------------------------------------
+    def make_out_degree(self, rng):
+        if rng.random() < hub_share:
+            #--pareto tail from 5 up, capped so one hub can't be most of a small data set
+            return min(int(5 * rng.paretovariate(1.2)), max(self.entity_count // 10, 5))
+        return self.choose_degree(rng)
+
+    #----------------------------------------
+    def get_relationship_rows(self):
+        #--yields the relationship rows in src order, the destinations favor entities with big out degrees as hubs tend to be linked both ways
+        rng = random.Random(self.seed + 1)
+        self.in_degree_list = array.array('i', bytes(4 * self.entity_count))
+        for src_index, entity_id in enumerate(self.entity_id_list):
+            for i in range(self.out_degree_list[src_index]):
+                dst_index = rng.randrange(self.entity_count)
+                if rng.random() < 0.2:
+                    dst_index = int(self.entity_count * rng.random() ** 3) #--skewed to the front of the list
+                self.in_degree_list[dst_index] += 1
+                relationship_type = self.choose_relationship_type(rng)
+                shares = ''
+                if relationship_type == 'shareholder_of' and rng.random() < 0.6:
+                    shares = dump_json([{'percentage': round(rng.choice([100, 50, 33.33, 25, rng.uniform(0.1, 99)]), 2)}]) if rng.random() < 0.7 else dump_json([{'num_shares': rng.randint(1, 5000)}])
+                to_date = make_date(rng) if rng.random() < 0.25 else ''
+                yield [entity_id, self.entity_id_list[dst_index], relationship_type, '', make_date(rng) if rng.random() < 0.6 else '', to_date,
+                       'true' if to_date else 'false', '', shares]
+
+    #----------------------------------------
+    def get_entity_rows(self):
+        #--yields the rows of each entity together in entity_id order, the relationships must be made first to know the degrees
+        if self.in_degree_list is None:
+            for relationship_row in self.get_relationship_rows():
+                pass
+        rng = random.Random(self.seed + 2)
+        for entity_index, entity_id in enumerate(self.entity_id_list):
+            row_count = self.choose_rows_per_entity(rng) or min(5 + int(rng.expovariate(0.3)), 60)
+            yield [self.make_entity_row(rng, entity_index, entity_id, i) for i in range(row_count)]
+
+    #----------------------------------------
+    def make_entity_row(self, rng, entity_index, entity_id, i):
+        entity_type = self.entity_type_list[entity_index]
+        row = dict.fromkeys(entity_columns, '')
+        row['entity_id'] = entity_id
+        row['i'] = str(i)
+
+        #--the zero row holds the values that are the same for the whole entity
+        if i == 0:
+            row['type'] = entity_type
+            row['label'] = self.choose_common_label(rng) if rng.random() < 0.6 else self.make_label(rng, entity_type == 'person')
+            if rng.random() < 0.0007:
+                row['label_en'] = row['label'].title()
+            row['num_documents'] = self.choose_num_documents(rng)
+            row['sanctioned'] = 'true' if rng.random() < 0.031 else 'false'
+            row['pep'] = 'false'
+            out_degree, in_degree = self.out_degree_list[entity_index], self.in_degree_list[entity_index]
+            row['degree'] = str(out_degree + in_degree)
+            row['source_counts'] = self.choose_source_counts(rng)
+            if out_degree + in_degree:
+                edge_count_data = {}
+                for direction, edge_count in (('out', out_degree), ('in', in_degree)):
+                    if edge_count:
+                        edge_type = self.choose_relationship_type(rng)
+                        edge_count_data.setdefault(edge_type, {'out': 0, 'in': 0, 'total': 0})
+                        edge_count_data[edge_type][direction] += edge_count
+                        edge_count_data[edge_type]['total'] += edge_count
+                row['edge_counts'] = dump_json(edge_count_data)
+            if entity_type == 'company' and rng.random() < 0.0449 / 0.59:
+                issued_shares = rng.choice([1200.0, 1.0, 500.0, 1500.0, 1199.0, 1000.0])
+                row['shares'] = dump_json({'extra': {'IssuedShares': str(issued_shares), 'PerShareValue': '1.0'}, 'num_shares': issued_shares, 'monetary_value': issued_shares,
+                                           'currency': 'EUR', 'type': rng.choice(['Ordinary', 'Ordinary A', 'Ordinary B'])})
+
+        #--the rest can be on any row
+        if rng.random() * 100 < column_populated['name']:
+            row['name'] = dump_json({'value': row['label'] if i == 0 and row['label'] and rng.random() < 0.6 else self.make_label(rng, entity_type == 'person')})
+        if rng.random() * 100 < column_populated['address']:
+            city, country, postcode_prefix = rng.choice(city_names)
+            street, house_number, building = rng.choice(street_names), str(rng.randint(1, 300)), rng.choice(building_names)
+            postcode = f'{postcode_prefix}{rng.randint(0, 999):03d}'
+            address_data = {'value': ', '.join(value for value in [street, house_number, building, postcode, city, country] if value),
+                            'house_number': house_number, 'road': street, 'city': city, 'postcode': postcode, 'country': country}
+            if building:
+                address_data['house'] = building.title()
+            row['address'] = dump_json(address_data)
+        if rng.random() * 100 < column_populated['date_of_birth'] * (2.5 if entity_type == 'person' else 0.2):
+            row['date_of_birth'] = dump_json({'value': make_date(rng)})
+        if entity_type == 'person' and rng.random() * 100 < column_populated['gender'] * 2.5:
+            row['gender'] = dump_json({'value': 'male' if rng.random() < 0.91 else 'female'})
+        if rng.random() * 100 < column_populated['contact']:
+            contact_type, example_value = self.choose_code['CONTACT_TYPE'](rng)
+            row['contact'] = dump_json({'value': make_like(rng, example_value), 'type': contact_type})
+        if rng.random() * 100 < column_populated['identifier']:
+            identifier_type, example_value = self.choose_code['IDENTIFIER_TYPE'](rng)
+            row['identifier'] = dump_json({'value': make_like(rng, example_value), 'type': identifier_type})
+        if rng.random() * 100 < column_populated['weak_identifier']:
+            identifier_type, example_value = self.choose_code['WEAK_IDENTIFIER_TYPE'](rng)
+            row['weak_identifier'] = dump_json({'value': make_like(rng, example_value), 'type': identifier_type})
+        if rng.random() * 100 < column_populated['status']:
+            row['status'] = dump_json(self.choose_status(rng))
+        if entity_type == 'company' and rng.random() * 100 < column_populated['company_type'] / 0.59:
+            row['company_type'] = dump_json(self.choose_company_type(rng))
+        if rng.random() * 100 < column_populated['country']:
+            row['country'] = dump_json({'value': self.choose_code['COUNTRY_CODE'](rng)[0], 'context': self.choose_country_context(rng)})
+        if rng.random() * 100 < column_populated['additional_information']:
+            row['additional_information'] = dump_json(self.choose_additional_information(rng))
+        if rng.random() * 100 < column_populated['finances']:
+            row['finances'] = dump_json({'value': rng.choice([1200.0, 0.0, 1164.69, 5000.0]), 'context': self.choose_finance_context(rng), 'currency': 'EUR'})
+        return row
+
+    #----------------------------------------
+    def write_files(self, output_path, entity_file_count=1, relationship_file_count=1, compressed=True):
+        #--entities-00000.csv.gz and relationships-0000.csv.gz and so on, each set split evenly and kept in entity_id order
+        file_extension = '.csv.gz' if compressed else '.csv'
+        relationship_file_list = [os.path.join(output_path, f'relationships-{i:04d}{file_extension}') for i in range(relationship_file_count)]
+        relationship_row_count = self.write_csv_files(relationship_file_list, relationship_columns, ([relationship_row] for relationship_row in self.get_relationship_rows()),
+                                                      sum(self.out_degree_list))
+        entity_file_list = [os.path.join(output_path, f'entities-{i:05d}{file_extension}') for i in range(entity_file_count)]
+        entity_row_count = self.write_csv_files(entity_file_list, entity_columns, ([[row[column] for column in entity_columns] for row in entity_rows] for entity_rows in self.get_entity_rows()),
+                                                self.entity_count)
+        return {'entity_file_list': entity_file_list, 'entity_row_count': entity_row_count, 'relationship_file_list': relationship_file_list, 'relationship_row_count': relationship_row_count}
+
+    #----------------------------------------
+    def write_csv_files(self, file_name_list, column_list, row_group_iterator, group_count):
+        #--the groups of rows are spread evenly over the files, never splitting a group
+        row_count = 0
+        groups_per_file = -(-group_count // len(file_name_list)) if group_count else 1
+        for file_number, file_name in enumerate(file_name_list):
+            if file_name.endswith('.gz'):
+                file_handle = gzip.open(file_name, 'wt', compresslevel=6, encoding='utf-8', newline='')
+            else:
+                file_handle = open(file_name, 'w', encoding='utf-8', newline='')
+            csv_writer = csv.writer(file_handle)
+            csv_writer.writerow(column_list)
+            for row_group in itertools.islice(row_group_iterator, groups_per_file if file_number < len(file_name_list) - 1 else None):
+                csv_writer.writerows(row_group)
+                row_count += len(row_group)
+            file_handle.close()
+        return row_count
+
+#----------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output_path', help='the directory to write the synthetic entity and relationship files to')
+    parser.add_argument('-n', '--entity_count', type=int, default=100000, help='number of entities to make, defaults to 100000')
+    parser.add_argument('-e', '--entity_files', type=int, default=1, help='number of entity files to split them into, defaults to 1')
+    parser.add_argument('-r', '--relationship_files', type=int, default=1, help='number of relationship files to split the relationships into, defaults to 1')
+    parser.add_argument('-s', '--seed', type=int, default=1, help='random seed, the same seed and entity count always make the same files')
+    parser.add_argument('-c', '--codes_file', default='sayari_codes.csv', help='code table to take the identifier, contact and country codes and their frequencies from, defaults to sayari_codes.csv')
+    parser.add_argument('--uncompressed', action='store_true', default=False, help='write .csv files rather than .csv.gz')
+    args = parser.parse_args()
+
+    if not args.output_path or not os.path.isdir(args.output_path):
+        print('\nPlease supply a valid output directory on the command line\n')
+        sys.exit(1)
+
+    timer_start = time.time()
+    print(f'\nGenerating {args.entity_count} entities ...\n')
+    generator = sayari_generator(args.entity_count, args.seed, args.codes_file)
+    file_results = generator.write_files(args.output_path, args.entity_files, args.relationship_files, not args.uncompressed)
+    print(f'{file_results["entity_row_count"]} entity rows written to {len(file_results["entity_file_list"])} files')
+    print(f'{file_results["relationship_row_count"]} relationship rows written to {len(file_results["relationship_file_list"])} files')
+    print(f'\nCompleted in {round((time.time() - timer_start) / 60, 1)} minutes\n')
+
+    sys.exit(0)
@@ -8,34 +8,219 @@ from datetime import datetime
 from dateutil.parser import parse as dateparse
 import signal
 import random
-import pandas
 import glob
 import gzip
 import io
 import sqlite3
 import psutil
+import multiprocessing
+import collections
+import itertools
+import array
+import functools
+import heapq
+import traceback
+import fcntl
+import socket
+import zlib
+import mmap
+import struct
+import hashlib
+import marshal
+import threading
+import queue
+import cProfile
+import concurrent.futures
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#--bump when the relationship database layout changes so older databases get rebuilt
+relation_db_version = 5
+relation_select_sql = 'select src, rel_pointers from relationships'
+relation_backend_list = ['sqlite', 'mmap']
+mmap_index_magic = b'SAYRIDX1'
+mmap_index_header = struct.Struct('<8sI')
+entity_index_block_size = 1000
+sort_merge_width = 64
+output_block_size = 10000
+stage_list = ['read', 'read_wait', 'lookup', 'hash', 'map', 'map_row', 'relationships', 'encode', 'write', 'compress', 'checkpoint']
+worker_profiler = [] #--the profiler of a worker process mapping chunks with --profile
+progress_report_secs = 5
+row_cache_magic = b'SAYRROW1'
+row_cache_block_size = 1000
+#--the json columns of the entity files and the first characters map_row decodes them on, the row cache keeps them decoded
+row_cache_columns = {'source_counts': '{[', 'shares': '{', 'name': '{', 'address': '{', 'date_of_birth': '{', 'gender': '{', 'contact': '{',
+                     'identifier': '{', 'weak_identifier': '{', 'status': '{[', 'company_type': '{[', 'country': '{[', 'additional_information': '{[', 'finances': '{['}
+monitor = None #--the progress monitor with --metrics_file, worker processes report to its queue
 
 #=========================
 class mapper():
 
     #----------------------------------------
-    def __init__(self, codes_file_name, relationdb_name = None):
+    def __init__(self, codes_file_name):
 
         self.load_reference_data()
-        self.stat_pack = {}
+        self.stats = stat_collector(args.stats)
+        self.stage_times = stage_timer()
 
         self.codes_file_name = codes_file_name
 
-        self.code_conversion_data, self.unmapped_code_count = self.load_codes_file()
-        self.new_code_records = []
+        code_conversion_data, self.unmapped_code_count = self.load_codes_file()
+        self.compile_codes(code_conversion_data)
 
-        if os.path.exists(args.relationdb_name): #--will be opened later if does not exist
-            self.open_relation_db(relationdb_name) if relationdb_name else None
+        self.codec = json_codec(args.raw_utf8)
+
+        #--opened once the relationships are known to be loaded
+        self.relation_store_list = []
+        self.merge_join = False
+        self.rel_pointer_cache = None
+        self.last_rel_record_id = None
+
+        #--opened when only the changes since the last snapshot are to be written
+        self.hash_index = None
+        self.entity_hash_updates = []
+
+        #--opened when the output blocks each entity is written to are to be indexed
+        self.entity_index = None
 
     #----------------------------------------
     def open_relation_db(self, relationdb_name):
-        self.relation_dbo = sqlite3.connect(f'file:{relationdb_name}?mode=ro', uri=True)
-        self.relation_dbo.cursor().execute('PRAGMA query_only=ON')
+        self.close_relation_db()
+        if relationdb_name:
+            shard_count, backend = get_relation_db_info(relationdb_name)
+            store_class = mmap_relation_store if backend == 'mmap' else sqlite_relation_store
+            self.merge_join = args.merge_join
+            for shard_name in relation_shard_names(relationdb_name, shard_count):
+                self.relation_store_list.append(store_class(shard_name, self.merge_join))
+
+    #----------------------------------------
+    def close_relation_db(self):
+        for relation_store in self.relation_store_list:
+            relation_store.close()
+        self.relation_store_list = []
+
+    #----------------------------------------
+    def open_hash_index(self, hash_db_name):
+        self.close_hash_index()
+        if hash_db_name:
+            self.hash_index = entity_hash_index(hash_db_name, self.get_mapping_signature())
+
+    #----------------------------------------
+    def close_hash_index(self):
+        if self.hash_index:
+            self.hash_index.close()
+        self.hash_index = None
+
+    #----------------------------------------
+    def open_entity_index(self, entity_index_name):
+        self.close_entity_index()
+        if entity_index_name:
+            self.entity_index = entity_locator_index(entity_index_name)
+
+    #----------------------------------------
+    def close_entity_index(self):
+        if self.entity_index:
+            self.entity_index.close()
+        self.entity_index = None
+
+    #----------------------------------------
+    def get_mapping_signature(self):
+        #--anything besides the entity rows and relationships that changes the output, a new signature means every entity is remapped,
+        #--codes still waiting for review keep the default mapping they were added with so they are left out
+        signature_hash = hashlib.blake2b(digest_size=16)
+        with open(os.path.abspath(__file__), 'rb') as f:
+            signature_hash.update(f.read())
+        signature_hash.update(repr(args.extended_format).encode('utf-8'))
+        for code_data in self.code_record_list:
+            if code_data['REVIEWED'].upper() == 'Y':
+                signature_hash.update(repr((code_data['CODE_TYPE'], code_data['CODE'], code_data['ATTRIBUTE'], code_data['VALUE1'])).encode('utf-8'))
+        return signature_hash.digest()
+
+    #----------------------------------------
+    def get_changed_entities(self, entity_list):
+        #--the rows and rel pointers of each entity are hashed before it is mapped and only the new and changed ones go on to be mapped,
+        #--every hash is queued for the hash index so the entity counts as seen in this snapshot
+        base_hashes = self.hash_index.get_base_hashes([input_rows[0]['entity_id'] for input_rows in entity_list])
+        changed_entity_list = []
+        for input_rows in entity_list:
+            record_id = input_rows[0]['entity_id']
+            rel_pointers = self.get_rel_pointers(record_id) if self.relation_store_list and self.has_relationships(input_rows) else None
+            content_hash = self.hash_index.get_content_hash(input_rows, rel_pointers)
+            self.entity_hash_updates.append((record_id, content_hash))
+            base_hash = base_hashes.get(record_id)
+            if base_hash == content_hash:
+                self.update_stat('CHANGES', 'UNCHANGED_ENTITIES')
+                continue
+            self.update_stat('CHANGES', 'NEW_ENTITIES' if base_hash is None else 'CHANGED_ENTITIES', record_id)
+            changed_entity_list.append(input_rows)
+        return changed_entity_list
+
+    #----------------------------------------
+    def save_entity_hashes(self):
+        #--only called once the records of these entities are safely in the output
+        if self.hash_index and self.entity_hash_updates:
+            self.hash_index.save_hashes(self.entity_hash_updates)
+        self.entity_hash_updates = []
+
+    #----------------------------------------
+    def has_relationships(self, input_rows):
+        #--the zero row carries the entity's degree, no need to look up the ones without any edges
+        for input_row in input_rows:
+            if str(input_row['i']) == '0':
+                return str(input_row.get('degree') or '').strip() != '0'
+        return True
+
+    #----------------------------------------
+    def prefetch_rel_pointers(self, entity_list):
+        #--each shard is asked for all of its entities in the batch at once
+        self.rel_pointer_cache = {}
+        shard_count = len(self.relation_store_list)
+        shard_record_id_lists = [[] for i in range(shard_count)]
+        for input_rows in entity_list:
+            if self.has_relationships(input_rows):
+                record_id = input_rows[0]['entity_id']
+                shard_record_id_lists[relation_shard(record_id, shard_count)].append(record_id)
+        for relation_store, record_id_list in zip(self.relation_store_list, shard_record_id_lists):
+            if record_id_list:
+                self.rel_pointer_cache.update(relation_store.get_rel_pointers_list(record_id_list))
+
+    #----------------------------------------
+    def map_batch(self, entity_list):
+        if self.relation_store_list and not self.merge_join:
+            timer_start = time.perf_counter()
+            self.prefetch_rel_pointers(entity_list)
+            self.stage_times.add('lookup', time.perf_counter() - timer_start, len(entity_list))
+        if self.hash_index:
+            timer_start = time.perf_counter()
+            entity_count = len(entity_list)
+            entity_list = self.get_changed_entities(entity_list)
+            self.stage_times.add('hash', time.perf_counter() - timer_start, entity_count)
+        timer_start = time.perf_counter()
+        json_list = [self.map(input_rows) for input_rows in entity_list]
+        self.stage_times.add('map', time.perf_counter() - timer_start, len(entity_list))
+        self.rel_pointer_cache = None
+        return json_list
+
+    #----------------------------------------
+    def get_rel_pointers(self, record_id):
+        #--returns the rel pointer json computed when the relationships were loaded
+        if self.rel_pointer_cache is not None:
+            return self.rel_pointer_cache.get(record_id)
+        if self.merge_join:
+            #--each shard holds a sorted subset of the srcs, so sorted entities stay sorted within every shard
+            if self.last_rel_record_id and record_id < self.last_rel_record_id:
+                self.update_stat('RELATIONSHIPS', 'OUT_OF_ORDER_ENTITIES', record_id)
+            self.last_rel_record_id = record_id
+        return self.relation_store_list[relation_shard(record_id, len(self.relation_store_list))].get_rel_pointers(record_id)
+
+    #----------------------------------------
+    def reset_relation_position(self):
+        #--a new file or chunk starts a new sorted run of entities
+        self.last_rel_record_id = None
+        for relation_store in self.relation_store_list:
+            relation_store.reset()
 
     #----------------------------------------
     def load_codes_file(self):
@@ -54,19 +239,55 @@ class mapper():
                     unmapped_code_count += 1
         return code_conversion_data, unmapped_code_count
 
+    #----------------------------------------
+    def compile_codes(self, code_conversion_data):
+        #--one flat lookup from (code type, code) to a ready (code index, senzing attribute, value1) entry,
+        #--the index points into a plain counter array and, for codes added by this run, a list of examples
+        self.code_lookup = {}
+        self.code_record_list = []
+        self.code_counts = array.array('q')
+        self.code_examples = {}
+        self.new_code_indexes = []
+        for code_type in code_conversion_data:
+            for code, code_data in code_conversion_data[code_type].items():
+                self.code_lookup[(code_type, code)] = (len(self.code_record_list), code_data['ATTRIBUTE'], code_data['VALUE1'])
+                self.code_record_list.append(code_data)
+                self.code_counts.append(0)
+
+    #----------------------------------------
+    def get_new_code_records(self):
+        #--the codes this run added with their counts and examples as sayari_codes.csv rows
+        new_code_records = []
+        for code_index in self.new_code_indexes:
+            code_data = dict(self.code_record_list[code_index])
+            code_data['COUNT'] = self.code_counts[code_index]
+            code_data['EXAMPLES'] = list(self.code_examples[code_index])
+            new_code_records.append(code_data)
+        return new_code_records
+
     #----------------------------------------
     def save_codes_file(self):
-        if self.new_code_records:
-            prior_codes_data, unmapped_code_count = self.load_codes_file()
-            for code_data in self.new_code_records:
-                if code_data['CODE_TYPE'] in prior_codes_data and code_data['CODE'] in prior_codes_data[code_data['CODE_TYPE']]:
-                    continue  #--another process may have added it already
-                if code_data['CODE_TYPE'] not in prior_codes_data:
-                    prior_codes_data[code_data['CODE_TYPE']] = {}
-                prior_codes_data[code_data['CODE_TYPE']][code_data['CODE']] = code_data
-
-            with open(self.codes_file_name, 'w') as f:
-                f.write(','.join(['REVIEWED', 'CODE_TYPE', 'CODE', 'ATTRIBUTE', 'VALUE1', 'COUNT', 'EXAMPLES']) + '\n')
+        #--other mapper processes may be saving at the same time, so the file is re-read under a lock, this run's codes are folded
+        #--into it and it is replaced in one step, codes another process already added get this run's counts and examples
+        if self.new_code_indexes:
+            with file_lock(self.codes_file_name):
+                prior_codes_data, unmapped_code_count = self.load_codes_file()
+                for code_data in self.get_new_code_records():
+                    if code_data['CODE_TYPE'] in prior_codes_data and code_data['CODE'] in prior_codes_data[code_data['CODE_TYPE']]:
+                        prior_code_data = prior_codes_data[code_data['CODE_TYPE']][code_data['CODE']]
+                        prior_code_data['COUNT'] = int(prior_code_data['COUNT'] or 0) + code_data['COUNT']
+                        prior_code_data['EXAMPLES'] = prior_code_data['EXAMPLES'].split(' | ') if prior_code_data['EXAMPLES'] else []
+                        for example_value in code_data['EXAMPLES']:
+                            if len(prior_code_data['EXAMPLES']) < 10 and example_value not in prior_code_data['EXAMPLES']:
+                                prior_code_data['EXAMPLES'].append(example_value)
+                        continue
+                    if code_data['CODE_TYPE'] not in prior_codes_data:
+                        prior_codes_data[code_data['CODE_TYPE']] = {}
+                    prior_codes_data[code_data['CODE_TYPE']][code_data['CODE']] = code_data
+
+                output_buffer = io.StringIO()
+                csv_writer = csv.writer(output_buffer, lineterminator='\n')
+                csv_writer.writerow(['REVIEWED', 'CODE_TYPE', 'CODE', 'ATTRIBUTE', 'VALUE1', 'COUNT', 'EXAMPLES'])
                 for code_type in ['ENTITY_TYPE', 'CONTACT_TYPE', 'COUNTRY_CONTEXT', 'IDENTIFIER_TYPE', 'WEAK_IDENTIFIER_TYPE', 'COUNTRY_CODE']:
                     if code_type in prior_codes_data:
                         for code in sorted(prior_codes_data[code_type]):
@@ -83,7 +304,15 @@ class mapper():
                                            str(code_data['COUNT']), 
                                            code_data['EXAMPLES'] if type(code_data['EXAMPLES']) != list else ' | '.join(code_data['EXAMPLES'])
                                           ]
-                            f.write(','.join(code_record) + '\n')
+                            csv_writer.writerow(code_record)
+                replace_file(self.codes_file_name, output_buffer.getvalue())
+
+    #----------------------------------------
+    def save_delta_file(self, delta_path):
+        #--this run's new codes and statistics for a later --merge_deltas rather than touching the shared files directly
+        delta_file_name = os.path.join(delta_path, f'sayari_delta-{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}.json')
+        replace_file(delta_file_name, json.dumps(self.collect_worker_results(), separators=(',', ':')))
+        return delta_file_name
 
     #----------------------------------------
     def map(self, input_rows):
@@ -104,8 +333,10 @@ class mapper():
         json_data['status_list'] = [] 
         json_data['company_type_list'] = [] 
 
+        timer_start = time.perf_counter()
         for input_row in input_rows:
-            json_data = mapper.map_row(input_row, json_data)
+            json_data = self.map_row(input_row, json_data)
+        self.stage_times.add('map_row', time.perf_counter() - timer_start, len(input_rows))
 
         #--set organization name attribute and first address label
         if 'RECORD_TYPE' in json_data and json_data['RECORD_TYPE'] == 'ORGANIZATION':
@@ -175,46 +406,18 @@ class mapper():
         del(json_data['company_type_list'])
 
         #--add the relationships
-        if self.relation_dbo:
+        if self.relation_store_list:
+            timer_start = time.perf_counter()
             json_data['RELATIONSHIPS'] = [{
                 'REL_ANCHOR_DOMAIN': 'SAYARI',
                 'REL_ANCHOR_KEY': json_data['RECORD_ID']
             }]
             #if json_data['RECORD_ID'] in ('0Z4OIBVfSTjbIfCBaLzvSg', 'ciNgIv0eGHGH-OVDaUwX8Q', 'VJh3jW0Yk-m7iYUlEzYT4A'):
             #    print('-'*50 + '\n', json_data['NAME_LIST'][0])
-            relation_rows = self.relation_dbo.cursor().execute('select * from relationships where src = ?', (json_data['RECORD_ID'],)).fetchall()
-            for relation_row in relation_rows:
-                #if json_data['RECORD_ID'] in ('0Z4OIBVfSTjbIfCBaLzvSg', 'ciNgIv0eGHGH-OVDaUwX8Q', 'VJh3jW0Yk-m7iYUlEzYT4A'):
-                #    print(json.dumps(relation_row, indent=4))
-                rel_pointer_data = {'REL_POINTER_DOMAIN': 'SAYARI',
-                                    'REL_POINTER_KEY': relation_row[1],
-                                    'REL_POINTER_ROLE': relation_row[2]
-                                   }
-                if relation_row[4]: #--from_date
-                    rel_pointer_data['REL_POINTER_FROM_DATE'] = relation_row[4]
-                if relation_row[5]: #--thru_date
-                    rel_pointer_data['REL_POINTER_THRU_DATE'] = relation_row[5]
-                    try:
-                        if dateparse(relation_row[5]) < datetime.now():
-                            rel_pointer_data['REL_POINTER_ROLE'] = '(former) ' + rel_pointer_data['REL_POINTER_ROLE']
-                            #input(json.dumps(rel_pointer_data, indent=4))
-                    except: pass
-                if relation_row[8]: #--shares
-                    percentage = 0
-                    try: 
-                        share_data = json.loads(relation_row[8])
-                        for share_record in share_data:
-                            if 'percentage' in share_record:
-                                percentage = share_record['percentage']
-                                break
-                    except: 
-                        pass
-                        #print('-- bad share data on relation --')
-                        #print(relation_row)
-                    if percentage: 
-                        rel_pointer_data['REL_POINTER_ROLE'] = str(percentage) + ' ' + rel_pointer_data['REL_POINTER_ROLE']
-
-                json_data['RELATIONSHIPS'].append(rel_pointer_data)
+            rel_pointers = self.get_rel_pointers(json_data['RECORD_ID']) if self.has_relationships(input_rows) else None
+            if rel_pointers:
+                json_data['RELATIONSHIPS'].extend(self.codec.decode(rel_pointers))
+            self.stage_times.add('relationships', time.perf_counter() - timer_start)
 
         return json_data
 
@@ -262,13 +465,10 @@ class mapper():
             #      vessel (1449)
             #      aircraft (1267)
             entity_type = raw_data['type'].upper()
-            if 'ENTITY_TYPE' not in self.code_conversion_data:
-                self.code_conversion_data['ENTITY_TYPE'] = {}
-            if entity_type not in self.code_conversion_data['ENTITY_TYPE']:
-                self.add_code_record('ENTITY_TYPE', entity_type, 'RECORD_TYPE', entity_type.upper())
-            self.update_sayari_code_stats('ENTITY_TYPE', entity_type, '')
+            code_entry = self.code_lookup.get(('ENTITY_TYPE', entity_type)) or self.add_code_record('ENTITY_TYPE', entity_type, 'RECORD_TYPE', entity_type.upper())
+            self.update_sayari_code_stats(code_entry[0], '')
 
-            json_data['RECORD_TYPE'] = self.code_conversion_data['ENTITY_TYPE'][entity_type]['VALUE1']
+            json_data['RECORD_TYPE'] = code_entry[2]
             self.update_stat('ENTITY_TYPE', entity_type)
 
             # columnName: label (its the best name for the entity)
@@ -335,7 +535,7 @@ class mapper():
             #      {"USA/consolidated_screening_list":1.0,"USA/ofac_sdn":1.0} (20094)
             if raw_data['source_counts']: 
                 if type(raw_data['source_counts']) == str and raw_data['source_counts'][0:1] in ['{', '[']:
-                    raw_data['source_counts'] = json.loads(raw_data['source_counts'])
+                    raw_data['source_counts'] = self.codec.decode(raw_data['source_counts'])
                 if type(raw_data['source_counts']) == dict:
                     json_data['sources'] = ' | '.join(sorted(list(raw_data['source_counts'].keys())))
                 elif type(raw_data['source_counts']) == list:
@@ -365,7 +565,7 @@ class mapper():
             #      {"extra":{"IssuedShares":"1199.0","PerShareValue":"1.0"},"num_shares":1199.0,"monetary_value":1199.0,"currency":"EUR","type":"Ordinary A"} (2703)
             if raw_data['shares'] and args.extended_format: 
                 if type(raw_data['shares']) == str and raw_data['shares'][0:1] == '{':
-                    raw_data['shares'] = json.loads(raw_data['shares'])
+                    raw_data['shares'] = self.codec.decode(raw_data['shares'])
                 if type(raw_data['shares']) == dict:
                     json_data['shares'] = json.dumps(raw_data['shares'])
 
@@ -460,18 +660,14 @@ class mapper():
                     contact_type = contact_type.upper()
                 else:
                     contact_type = 'NULL'
-                if 'CONTACT_TYPE' not in self.code_conversion_data:
-                    self.code_conversion_data['CONTACT_TYPE'] = {}
-                if contact_type not in self.code_conversion_data['CONTACT_TYPE']:
-                    self.add_code_record('CONTACT_TYPE', contact_type, '<unknown>', '')
-                self.update_sayari_code_stats('CONTACT_TYPE', contact_type, contact_value)
-                senzing_attr = self.code_conversion_data['CONTACT_TYPE'][contact_type]['ATTRIBUTE']
+                code_index, senzing_attr, phone_type = self.code_lookup.get(('CONTACT_TYPE', contact_type)) or self.add_code_record('CONTACT_TYPE', contact_type, '<unknown>', '')
+                self.update_sayari_code_stats(code_index, contact_value)
                 if senzing_attr == '<unknown>':
                     self.update_stat('?-CONTACT_TYPES', contact_type, raw_data['contact'])
                 else:
                     mapped_dict = {senzing_attr: contact_value}
-                    if senzing_attr == 'PHONE_NUMBER' and self.code_conversion_data['CONTACT_TYPE'][contact_type]['VALUE1']:
-                        mapped_dict['PHONE_TYPE'] = self.code_conversion_data['CONTACT_TYPE'][contact_type]['VALUE1']
+                    if senzing_attr == 'PHONE_NUMBER' and phone_type:
+                        mapped_dict['PHONE_TYPE'] = phone_type
                     if mapped_dict not in json_data['CONTACT_METHODS']: 
                         json_data['CONTACT_METHODS'].append(mapped_dict)
 
@@ -527,7 +723,7 @@ class mapper():
             # json_data['status_list'].append(json.loads(raw_data['status'])['value'])
             
             #--attempt to pick fields user wants to see
-            parsed_data = json.loads(raw_data['status'])
+            parsed_data = self.codec.decode_value(raw_data['status'])
             if 'value' in parsed_data:
                 string_data = parsed_data['value']
                 if 'date' in parsed_data:
@@ -548,7 +744,7 @@ class mapper():
             # json_data['company_type_list'].append(raw_data['company_type'])
 
             #--key value only for cleaner display 
-            json_data['company_type_list'].append(json.loads(raw_data['company_type'])['value'])
+            json_data['company_type_list'].append(self.codec.decode_value(raw_data['company_type'])['value'])
 
         # columnName: country
         # 10.84 populated, 0.39 unique
@@ -558,7 +754,7 @@ class mapper():
         #      {"value":"GBR","context":"nationality"} (8188)
         #      {"extra":{"Original Text":"Malta"},"value":"MLT","context":"address"} (7462)
         if raw_data['country']:
-            country_dict = json.loads(raw_data['country'])
+            country_dict = self.codec.decode_value(raw_data['country'])
             mapped_dict = self.map_country('COUNTRY_CONTEXT', country_dict)
             if mapped_dict and mapped_dict not in json_data['ATTRIBUTE_LIST']: 
                 if 'unknown' in mapped_dict:
@@ -579,7 +775,7 @@ class mapper():
         #      {"extra":{"Programs":"SYRIA","Source List":"Specially Designated Nationals (SDN) - Treasury Department"},"type":"Sanction Information"} (563)
         if raw_data['additional_information']:
             self.update_stat('?-REVIEW', 'HAS_ADDITION_INFO', json_data['RECORD_ID'])
-            parsed_data = json.loads(raw_data['additional_information'])
+            parsed_data = self.codec.decode_value(raw_data['additional_information'])
             if 'extra' in parsed_data and parsed_data['extra']:
                 for key in parsed_data['extra']:
                     if key not in json_data:
@@ -589,7 +785,7 @@ class mapper():
                         if temp_data[0] + temp_data[-1] != '[]':  #--PROTECT THIS!
                             temp_list = [temp_data]
                         else: 
-                            temp_list = json.loads(temp_data)
+                            temp_list = self.codec.decode(temp_data)
                         if parsed_data['extra'][key] not in temp_list:
                             temp_list.append(parsed_data['extra'][key]) 
                             json_data[key] = json.dumps(temp_list)
@@ -604,16 +800,16 @@ class mapper():
         if raw_data['finances'] and args.extended_format:
             #json_data['finances'] = raw_data['finances']
             if 'finances' not in json_data:
-                json_data['finances'] = json.loads(raw_data['finances'])
+                json_data['finances'] = self.codec.decode_value(raw_data['finances'])
             else:
-                json_data['finances'].update(json.loads(raw_data['finances']))
+                json_data['finances'].update(self.codec.decode_value(raw_data['finances']))
 
         return json_data
 
     #-----------------------------------
     def get_value_only(self, field_dict, field_tag):
         if type(field_dict[field_tag]) == str and field_dict[field_tag][0:1] == '{':
-            field_dict[field_tag] = json.loads(field_dict[field_tag])
+            field_dict[field_tag] = self.codec.decode(field_dict[field_tag])
         if type(field_dict[field_tag]) == dict and 'value' in field_dict[field_tag]:
             return field_dict[field_tag]['value']
         else:
@@ -625,7 +821,7 @@ class mapper():
         field_value = None
         field_type = None
         if type(field_dict[field_tag]) == str and field_dict[field_tag][0:1] == '{':
-            field_dict[field_tag] = json.loads(field_dict[field_tag])
+            field_dict[field_tag] = self.codec.decode(field_dict[field_tag])
         if type(field_dict[field_tag]) == dict and 'value' in field_dict[field_tag]:
             field_value = field_dict[field_tag]['value']
         if type(field_dict[field_tag]) == dict and 'type' in field_dict[field_tag]:
@@ -638,7 +834,7 @@ class mapper():
     def map_identifier(self, code_type, identifier_data):
 
         if type(identifier_data) == str and identifier_data[0:1] == '{':
-            identifier_data = json.loads(identifier_data)
+            identifier_data = self.codec.decode(identifier_data)
         if type(identifier_data) == dict and 'value' in identifier_data:
 
             id_value = identifier_data['value']
@@ -651,11 +847,9 @@ class mapper():
 
             #--direct mapping
             id_type = id_type.upper()
-            if code_type not in self.code_conversion_data:
-                self.code_conversion_data[code_type] = {}
-            if id_type in self.code_conversion_data[code_type]:
-                senzing_attr = self.code_conversion_data[code_type][id_type]['ATTRIBUTE']
-                country_code = self.code_conversion_data[code_type][id_type]['VALUE1']
+            code_entry = self.code_lookup.get((code_type, id_type))
+            if code_entry:
+                code_index, senzing_attr, country_code = code_entry
                 ##self.update_stat(f'=-{code_type}', f'{id_type} | {senzing_attr}', id_value)
 
             #--try to figure it out,. e.g. "AUS-AUSTRALIAN PASSPORT"
@@ -668,14 +862,14 @@ class mapper():
 
                 self.update_stat(f'?-{code_type}', f'{id_type} | {senzing_attr}', id_value)
 
-                if len(id_type) > 4 and id_type[3] in ('-', '_', ' ') and id_type[0:3] in self.code_conversion_data['COUNTRY_CODE']:
+                if len(id_type) > 4 and id_type[3] in ('-', '_', ' ') and ('COUNTRY_CODE', id_type[0:3]) in self.code_lookup:
                     country_code = id_type[0:3]
                 else:
                     country_code = ''
 
-                self.add_code_record(code_type, id_type, senzing_attr, country_code)
+                code_index = self.add_code_record(code_type, id_type, senzing_attr, country_code)[0]
 
-            self.update_sayari_code_stats(code_type, id_type, id_value)
+            self.update_sayari_code_stats(code_index, id_value)
 
             if senzing_attr in ('OTHER_ID', 'NATIONAL_ID', 'TAX_ID', 'DRIVERS_LICENSE'): 
                 mapped_dict = {senzing_attr + '_NUMBER': id_value}
@@ -699,15 +893,13 @@ class mapper():
             #--direct mapping
             country_context = country_dict['context'].upper()
 
-            if country_context not in self.code_conversion_data[code_type]:
-                self.add_code_record(code_type, country_context, '<unknown>', '')
-            self.update_sayari_code_stats(code_type, country_context, country_dict['value'])
+            code_index, senzing_attr, value1 = self.code_lookup.get((code_type, country_context)) or self.add_code_record(code_type, country_context, '<unknown>', '')
+            self.update_sayari_code_stats(code_index, country_dict['value'])
 
-            if self.code_conversion_data[code_type][country_context]['ATTRIBUTE'] == '<unknown>':
+            if senzing_attr == '<unknown>':
                 self.update_stat('?' + code_type, country_context, country_dict['value'])
                 mapped_dict = {country_context: country_dict['value'], 'unknown': 'yes'}
             else:
-                senzing_attr = self.code_conversion_data[code_type][country_context]['ATTRIBUTE']
                 mapped_dict = {senzing_attr: country_dict['value']}
             return mapped_dict
         else:
@@ -721,30 +913,23 @@ class mapper():
 
     #-----------------------------------
     def add_code_record(self, code_type, raw_code, attribute, value1):
-        #new_code_record = ['N', code_type, raw_code, attribute, value1, 0, '']
-        #self.new_code_records.append(new_code_record)
-        if code_type not in self.code_conversion_data:
-            self.code_conversion_data[code_type] = {}
-        self.code_conversion_data[code_type][raw_code] = {'REVIEWED': 'N', 'CODE_TYPE': code_type, 'CODE': raw_code, 'ATTRIBUTE': attribute, 'VALUE1': value1, 'COUNT': 0, 'EXAMPLES': []}
-        self.new_code_records.append(self.code_conversion_data[code_type][raw_code])
+        #--returns the new lookup entry
+        code_index = len(self.code_record_list)
+        self.code_lookup[(code_type, raw_code)] = (code_index, attribute, value1)
+        self.code_record_list.append({'REVIEWED': 'N', 'CODE_TYPE': code_type, 'CODE': raw_code, 'ATTRIBUTE': attribute, 'VALUE1': value1})
+        self.code_counts.append(0)
+        self.code_examples[code_index] = []
+        self.new_code_indexes.append(code_index)
         self.unmapped_code_count += 1
-        return
+        return self.code_lookup[(code_type, raw_code)]
 
     #-----------------------------------
-    def update_sayari_code_stats(self, code_type, raw_code, example_value):
-        if type(self.code_conversion_data[code_type][raw_code]['COUNT']) != int:
-            if not self.code_conversion_data[code_type][raw_code]['COUNT']:
-                self.code_conversion_data[code_type][raw_code]['COUNT'] = 0
-            else:
-                self.code_conversion_data[code_type][raw_code]['COUNT'] = int(self.code_conversion_data[code_type][raw_code]['COUNT'])
-        self.code_conversion_data[code_type][raw_code]['COUNT'] += 1
-
-        if not self.code_conversion_data[code_type][raw_code]['EXAMPLES']:
-            self.code_conversion_data[code_type][raw_code]['EXAMPLES'] = []
-        if len(self.code_conversion_data[code_type][raw_code]['EXAMPLES']) < 10 and example_value not in self.code_conversion_data[code_type][raw_code]['EXAMPLES']:
-            if type(self.code_conversion_data[code_type][raw_code]['EXAMPLES']) != list:
-                self.code_conversion_data[code_type][raw_code]['EXAMPLES'] = self.code_conversion_data[code_type][raw_code]['EXAMPLES'].split(' | ')
-            self.code_conversion_data[code_type][raw_code]['EXAMPLES'].append(example_value)
+    def update_sayari_code_stats(self, code_index, example_value):
+        #--only the codes added by this run are written back with their counts, so only they keep examples
+        self.code_counts[code_index] += 1
+        code_examples = self.code_examples.get(code_index)
+        if code_examples is not None and len(code_examples) < 10 and example_value not in code_examples:
+            code_examples.append(example_value)
         return
 
     #-----------------------------------
@@ -758,8 +943,9 @@ class mapper():
 
     #----------------------------------------
     def format_dob(self, raw_date):
-        try: new_date = dateparse(raw_date)
-        except: return ''
+        new_date = parse_date(raw_date)
+        if not new_date:
+            return ''
 
         #--correct for prior century dates
         if new_date.year > datetime.now().year:
@@ -781,24 +967,53 @@ class mapper():
         #if (not cat1) or (not cat2):
         #    print(f'[{cat1}], [{cat2}], [{example}]')
         #    input('wait')
-        if cat1 not in self.stat_pack:
-            self.stat_pack[cat1] = {}
-        if cat2 not in self.stat_pack[cat1]:
-            self.stat_pack[cat1][cat2] = {}
-            self.stat_pack[cat1][cat2]['count'] = 0
-
-        self.stat_pack[cat1][cat2]['count'] += 1
-        if example:
-            if 'examples' not in self.stat_pack[cat1][cat2]:
-                self.stat_pack[cat1][cat2]['examples'] = []
-            if example not in self.stat_pack[cat1][cat2]['examples']:
-                if len(self.stat_pack[cat1][cat2]['examples']) < 5:
-                    self.stat_pack[cat1][cat2]['examples'].append(example)
-                else:
-                    randomSampleI = random.randint(2, 4)
-                    self.stat_pack[cat1][cat2]['examples'][randomSampleI] = example
+        self.stats.update(cat1, cat2, example)
         return
 
+    #----------------------------------------
+    def collect_worker_results(self):
+        #--hand the stats, stage times and new codes of a worker process back to the main process and start over
+        worker_results = {'stat_pack': self.stats.collect(), 'stage_times': self.stage_times.collect(), 'new_code_records': self.get_new_code_records()}
+        for code_index in self.new_code_indexes:
+            self.code_counts[code_index] = 0
+            self.code_examples[code_index] = []
+        return worker_results
+
+    #----------------------------------------
+    def merge_worker_results(self, worker_results):
+        self.stats.merge(worker_results['stat_pack'])
+        self.stage_times.merge(worker_results.get('stage_times', {}))
+
+        for worker_code_data in worker_results['new_code_records']:
+            code_type = worker_code_data['CODE_TYPE']
+            raw_code = worker_code_data['CODE']
+            code_entry = self.code_lookup.get((code_type, raw_code))
+            if not code_entry:
+                code_entry = self.add_code_record(code_type, raw_code, worker_code_data['ATTRIBUTE'], worker_code_data['VALUE1'])
+            elif code_entry[0] not in self.code_examples:
+                #--a delta for a code an earlier merge already saved, its counts still have to be folded in
+                self.code_examples[code_entry[0]] = []
+                self.new_code_indexes.append(code_entry[0])
+            code_index = code_entry[0]
+            self.code_counts[code_index] += worker_code_data['COUNT']
+            code_examples = self.code_examples.setdefault(code_index, [])
+            for example_value in worker_code_data['EXAMPLES']:
+                if len(code_examples) < 10 and example_value not in code_examples:
+                    code_examples.append(example_value)
+
+    #----------------------------------------
+    def get_stat_pack(self):
+        #--the statistics log, with the time spent in each stage alongside the mapping statistics
+        stat_pack = self.stats.get_stat_pack()
+        if self.stage_times.stage_data:
+            stat_pack['STAGE_TIMES'] = self.stage_times.get_stat_pack()
+        return stat_pack
+
+    #----------------------------------------
+    def merge_stat_pack(self, stat_pack):
+        self.stage_times.merge_stat_pack(stat_pack.pop('STAGE_TIMES', {}))
+        self.stats.merge_stat_pack(stat_pack)
+
     #----------------------------------------
     def capture_mapped_stats(self, json_data):
 
@@ -816,211 +1031,2461 @@ class mapper():
                         for key2 in subrecord:
                             self.update_stat(data_source, key2, subrecord[key2])
 
-#----------------------------------------
-def load_relationships(relationdb_name, relationship_file_list):
+#=========================
+class stat_collector():
+    #--the mapping statistics within a fixed memory budget, a category keeps exact counts until it has max_values distinct values,
+    #--after that only its heaviest hitters are kept using the space saving algorithm, so categories keyed by raw values can no
+    #--longer grow without bound, the examples of each value are a reservoir sample of all its occurrences
 
-    if os.path.exists(relationdb_name):
-        os.remove(relationdb_name)
+    #----------------------------------------
+    def __init__(self, stats_level='full', max_values=1000, max_examples=5):
+        self.max_values = max_values
+        self.max_examples = max_examples if stats_level == 'full' else 0
+        self.heap_sequence = itertools.count()
+        self.category_data = {}
+        self.stats_level = stats_level
 
-    print(f'\nLoading {len(relationship_file_list)} relationship files ...\n')
-    relation_dbo = sqlite3.connect(relationdb_name, isolation_level=None)
-    relation_dbo.cursor().execute("PRAGMA journal_mode=wal")
-    relation_dbo.cursor().execute("PRAGMA synchronous=0")
+    #----------------------------------------
+    def update(self, cat1, cat2, example=None, weight=1):
+        if self.stats_level == 'off':
+            return
+        value_data = self.count_value(cat1, cat2, weight)
+        if example and self.max_examples:
+            self.sample_example(value_data, example)
 
-    for relationship_file_name in relationship_file_list:
-        print(relationship_file_name, '...', end='', flush=True)
-        timer_start = time.time()
-        base_file_name, file_extension = os.path.splitext(relationship_file_name)
-        compressed_file = file_extension.upper() == '.GZ'
-        if compressed_file:
-            df = pandas.read_csv(relationship_file_name, low_memory=False, encoding='utf-8', compression='gzip')
+    #----------------------------------------
+    def count_value(self, cat1, cat2, weight):
+        #--value data is [count, overcount, examples seen, examples]
+        category = self.category_data.get(cat1)
+        if category is None:
+            category = self.category_data[cat1] = {'values': {}, 'heap': None}
+        try: value_data = category['values'].get(cat2)
+        except TypeError: #--unhashable values such as dicts
+            cat2 = json.dumps(cat2)
+            value_data = category['values'].get(cat2)
+        if value_data is None:
+            value_data = self.add_value(category, cat2, weight)
         else:
-            df = pandas.read_csv(relationship_file_name, low_memory=False, encoding='utf-8')
+            value_data[0] += weight
+        return value_data
 
-        #df[['src', 'dst', 'type']].to_sql('relationships', relation_dbo, index=False, method='multi', chunksize=10000, if_exists='append')
-        df.to_sql('relationships', relation_dbo, index=False, method='multi', chunksize=10000, if_exists='append')
-        print(f' completed in {round((time.time() - timer_start) / 60, 1)} minutes')
+    #----------------------------------------
+    def add_value(self, category, cat2, weight):
+        values = category['values']
+        if len(values) < self.max_values:
+            value_data = [weight, 0, 0, []]
+        else:
+            #--space saving, the new value takes over the counter of the smallest one and its count is the most it can be over by
+            min_count = values.pop(self.pop_min_value(category))[0]
+            value_data = [min_count + weight, min_count, 0, []]
+        values[cat2] = value_data
+        if category['heap'] is not None:
+            heapq.heappush(category['heap'], (value_data[0], next(self.heap_sequence), cat2))
+        return value_data
 
-        #display_process_stats(main_pid, 'after loading this file')
-        if shut_down:
-            break
+    #----------------------------------------
+    def pop_min_value(self, category):
+        #--the heap is only built once a category is full and its counts are brought up to date lazily as they reach the top
+        values = category['values']
+        if category['heap'] is None:
+            category['heap'] = [(value_data[0], next(self.heap_sequence), cat2) for cat2, value_data in values.items()]
+            heapq.heapify(category['heap'])
+        heap = category['heap']
+        while True:
+            heap_count, sequence, cat2 = heap[0]
+            value_data = values.get(cat2)
+            if value_data is None:
+                heapq.heappop(heap)
+            elif value_data[0] != heap_count:
+                heapq.heapreplace(heap, (value_data[0], next(self.heap_sequence), cat2))
+            else:
+                heapq.heappop(heap)
+                return cat2
 
-    if not shut_down:
-        print('\nindexing relationships ...', end='', flush = True)
-        timer_start = time.time()
-        relation_dbo.cursor().execute('create index ix_relationships on relationships (src)')
-        print(f' completed in {round((time.time() - timer_start) / 60, 1)} minutes')
+    #----------------------------------------
+    def sample_example(self, value_data, example):
+        value_data[2] += 1
+        examples = value_data[3]
+        if example in examples:
+            return
+        if len(examples) < self.max_examples:
+            examples.append(example)
+        else:
+            sample_index = random.randrange(value_data[2])
+            if sample_index < self.max_examples:
+                examples[sample_index] = example
 
-    relation_dbo.cursor().execute('create table finished (dummy integer)')
-    relation_dbo.close()
+    #----------------------------------------
+    def collect(self):
+        #--hands the statistics gathered so far to the main process and starts over
+        collected_data = {cat1: category['values'] for cat1, category in self.category_data.items()}
+        self.category_data = {}
+        return collected_data
 
+    #----------------------------------------
+    def merge(self, collected_data):
+        if self.stats_level == 'off':
+            return
+        for cat1, values in collected_data.items():
+            for cat2, (count, overcount, examples_seen, examples) in values.items():
+                value_data = self.count_value(cat1, cat2, count)
+                value_data[1] += overcount
+                if examples and self.max_examples:
+                    self.merge_examples(value_data, examples_seen, examples)
 
-# -----------------------------------
-def remove_json_nulls (d):
-    if isinstance(d, dict):
-        for k, v in list(d.items()):
-            if v is None:
-                del d[k]
-            elif type(v) == str and v.upper() == 'NULL':
-                del d[k]
+    #----------------------------------------
+    def merge_examples(self, value_data, examples_seen, examples):
+        #--each slot is drawn from either sample in proportion to how many examples each one saw
+        my_examples, their_examples = value_data[3][:], examples[:]
+        random.shuffle(my_examples)
+        random.shuffle(their_examples)
+        my_examples_seen = value_data[2]
+        merged_examples = []
+        while len(merged_examples) < self.max_examples and (my_examples or their_examples):
+            if my_examples and (not their_examples or random.randrange(my_examples_seen + examples_seen) < my_examples_seen):
+                example = my_examples.pop()
             else:
-                remove_json_nulls(v)
-    if isinstance(d, list):
-        for v in d:
-            remove_json_nulls(v)
-    return d
+                example = their_examples.pop()
+            if example not in merged_examples:
+                merged_examples.append(example)
+        value_data[2] = my_examples_seen + examples_seen
+        value_data[3] = merged_examples
 
-# --------------------------------------
-def sql_exec(dbo, sql, parm_list=None):
-    try:
-        exec_cursor = dbo.cursor()
-        if parm_list:
-            if type(parm_list) not in (list, tuple):
-                parm_list = [parm_list]
-            exec_cursor.execute(sql, parm_list)
+    #----------------------------------------
+    def merge_stat_pack(self, stat_pack):
+        #--folds in a stats log written by get_stat_pack, each example list counts as a sample of that many
+        collected_data = {}
+        for cat1 in stat_pack:
+            collected_data[cat1] = {}
+            for cat2, stat_data in stat_pack[cat1].items():
+                examples = stat_data.get('examples', [])
+                collected_data[cat1][cat2] = [stat_data['count'], stat_data.get('overcount', 0), len(examples), examples]
+        self.merge(collected_data)
+
+    #----------------------------------------
+    def get_stat_pack(self):
+        stat_pack = {}
+        for cat1, category in self.category_data.items():
+            stat_pack[cat1] = {}
+            for cat2, (count, overcount, examples_seen, examples) in category['values'].items():
+                stat_pack[cat1][cat2] = {'count': count}
+                if examples:
+                    stat_pack[cat1][cat2]['examples'] = examples
+                if overcount:
+                    stat_pack[cat1][cat2]['overcount'] = overcount
+        return stat_pack
+
+#=========================
+class stage_timer():
+    #--the seconds and number of rows, entities or records that went through each stage of the mapping, they are timed a batch
+    #--or an entity at a time so the clock is read far less often than the work it measures, and handed back by workers like the stats
+
+    #----------------------------------------
+    def __init__(self):
+        self.stage_data = {}
+        self.reported_data = {}
+
+    #----------------------------------------
+    def add(self, stage, seconds, count=1):
+        stage_data = self.stage_data.get(stage)
+        if stage_data is None:
+            self.stage_data[stage] = [seconds, count]
         else:
-            exec_cursor.execute(sql)
-    except Exception as err:
-        print(f'\nSQL ERROR:\n{sql}\n{err}\n')
-        raise Exception(err)
+            stage_data[0] += seconds
+            stage_data[1] += count
 
-    cursor_data = {}
-    if exec_cursor:
-        cursor_data['SQL'] = sql
-        cursor_data['CURSOR'] = exec_cursor
-        cursor_data['ROWS_AFFECTED'] = exec_cursor.rowcount
-        if exec_cursor.description:
-            cursor_data['FIELD_LIST'] = [field_data[0] for field_data in exec_cursor.description]
-    return cursor_data
+    #----------------------------------------
+    def collect(self):
+        collected_data = self.stage_data
+        self.stage_data = {}
+        self.reported_data = {}
+        return collected_data
 
-# --------------------------------------
-def sql_fetch_next(cursor_data):
-    row = cursor_data['CURSOR'].fetchone()
-    if row:
-        type_fixed_row = tuple([el.decode('utf-8') if type(el) is bytearray else el for el in row])
-        return dict(list(zip(cursor_data['FIELD_LIST'], type_fixed_row)))
+    #----------------------------------------
+    def merge(self, collected_data):
+        for stage, (seconds, count) in collected_data.items():
+            self.add(stage, seconds, count)
 
-# --------------------------------------
-def sql_fetch_all(cursor_data):
-    ''' fetch all the rows with column names '''
-    row_list = []
-    for row in cursor_data['CURSOR'].fetchall():
-        type_fixed_row = tuple([el.decode('utf-8') if type(el) is bytearray else el for el in row])
-        row_dict = dict(list(zip(cursor_data['FIELD_LIST'], type_fixed_row)))
-        row_list.append(row_dict)
-    return row_list
+    #----------------------------------------
+    def merge_stat_pack(self, stat_pack):
+        for stage, stage_data in stat_pack.items():
+            self.add(stage, stage_data['seconds'], stage_data['count'])
+
+    #----------------------------------------
+    def get_stat_pack(self):
+        return {stage: {'seconds': round(seconds, 3), 'count': count, 'per_second': int(count / seconds) if seconds else 0} for stage, (seconds, count) in self.stage_data.items()}
+
+    #----------------------------------------
+    def get_stages(self):
+        #--in the order the work flows through them
+        return sorted(self.stage_data, key=lambda stage: stage_list.index(stage) if stage in stage_list else len(stage_list))
+
+    #----------------------------------------
+    def get_progress_text(self):
+        #--the seconds each stage took since the last progress line
+        stage_text_list = []
+        for stage in self.get_stages():
+            seconds = self.stage_data[stage][0] - self.reported_data.get(stage, 0)
+            self.reported_data[stage] = self.stage_data[stage][0]
+            stage_text_list.append(f'{stage} {round(seconds, 1)}s')
+        return '[' + ', '.join(stage_text_list) + ']' if stage_text_list else ''
+
+#=========================
+class progress_monitor():
+    #--every process reports the progress of the file it is on to a queue, a background thread of the main process folds it together
+    #--with the memory each process is using and writes it to a metrics file every so often, as json or in the prometheus text
+    #--format when the file name ends in .prom, the eta is based on the bytes read from disk so it holds up on files of any size
+
+    #----------------------------------------
+    def __init__(self, metrics_file_name, interval):
+        self.metrics_file_name = metrics_file_name
+        self.interval = interval
+        self.progress_queue = multiprocessing.get_context('fork').Queue()
+        self.main_process = psutil.Process(os.getpid())
+        self.lock = threading.Lock()
+        self.status = 'running'
+        self.start_phase('starting', [])
+        self.stop_event = threading.Event()
+        self.monitor_thread = threading.Thread(target=self.monitor_progress, daemon=True)
+        self.monitor_thread.start()
+
+    #----------------------------------------
+    def start_phase(self, phase, file_list):
+        with self.lock:
+            self.phase = phase
+            self.phase_start_time = time.time()
+            self.file_sizes = {file_name: os.path.getsize(file_name) for file_name in file_list}
+            self.file_progress = {}
+
+    #----------------------------------------
+    def close(self, status):
+        self.stop_event.set()
+        self.monitor_thread.join()
+        while True:
+            try: self.update_progress(*self.progress_queue.get_nowait())
+            except queue.Empty: break
+        self.status = status
+        self.write_metrics()
+
+    #----------------------------------------
+    def monitor_progress(self):
+        next_write_time = time.time()
+        while not self.stop_event.is_set():
+            try: self.update_progress(*self.progress_queue.get(timeout=max(min(next_write_time - time.time(), 1), 0.01)))
+            except queue.Empty: pass
+            if time.time() >= next_write_time:
+                try: self.write_metrics()
+                except Exception as err:
+                    print(f'\nWARNING: could not write {self.metrics_file_name}: {err}\n')
+                next_write_time = time.time() + self.interval
+
+    #----------------------------------------
+    def update_progress(self, pid, file_name, bytes_read, row_count, record_count, finished, report_time):
+        with self.lock:
+            if file_name not in self.file_sizes: #--a late report from a phase already over
+                return
+            file_progress = self.file_progress.get(file_name)
+            if not file_progress:
+                #--a resumed file starts from its checkpoint, only what this run does counts towards its rates
+                file_progress = self.file_progress[file_name] = {'start_row_count': row_count, 'start_record_count': record_count}
+            file_progress.update({'pid': pid, 'bytes_read': self.file_sizes[file_name] if finished else bytes_read, 'row_count': row_count,
+                                  'record_count': record_count, 'finished': finished, 'report_time': report_time})
+
+    #----------------------------------------
+    def get_metrics(self):
+        with self.lock:
+            current_time = time.time()
+            elapsed_secs = max(current_time - self.phase_start_time, 0.001)
+            file_progress_list = list(self.file_progress.items())
+            bytes_total = sum(self.file_sizes.values())
+            bytes_read = min(sum(file_progress['bytes_read'] for file_name, file_progress in file_progress_list), bytes_total)
+            bytes_per_second = bytes_read / elapsed_secs
+            metrics = {'phase': self.phase,
+                       'status': self.status,
+                       'updated': datetime.fromtimestamp(current_time).isoformat(timespec='seconds'),
+                       'elapsed_seconds': round(elapsed_secs, 1),
+                       'files_total': len(self.file_sizes),
+                       'files_completed': sum(1 for file_name, file_progress in file_progress_list if file_progress['finished']),
+                       'rows': sum(file_progress['row_count'] for file_name, file_progress in file_progress_list),
+                       'records': sum(file_progress['record_count'] for file_name, file_progress in file_progress_list),
+                       'rows_per_second': round(sum(file_progress['row_count'] - file_progress['start_row_count'] for file_name, file_progress in file_progress_list) / elapsed_secs, 1),
+                       'records_per_second': round(sum(file_progress['record_count'] - file_progress['start_record_count'] for file_name, file_progress in file_progress_list) / elapsed_secs, 1),
+                       'input_bytes_read': bytes_read,
+                       'input_bytes_total': bytes_total,
+                       'input_percent': round(bytes_read * 100 / bytes_total, 1) if bytes_total else 0,
+                       'eta_seconds': round((bytes_total - bytes_read) / bytes_per_second) if bytes_per_second else None}
+
+            #--the memory of every process and the file each one is on, a worker that stops reporting has stalled
+            active_files = {file_progress['pid']: (file_name, file_progress) for file_name, file_progress in file_progress_list if not file_progress['finished']}
+        metrics['processes'] = []
+        for process in [self.main_process] + self.main_process.children(recursive=True):
+            try: process_metrics = {'pid': process.pid, 'role': 'main' if process == self.main_process else 'worker', 'rss_bytes': process.memory_info().rss}
+            except psutil.Error:
+                continue
+            if process.pid in active_files:
+                file_name, file_progress = active_files[process.pid]
+                process_metrics.update({'file_name': file_name, 'bytes_read': file_progress['bytes_read'], 'file_size': self.file_sizes[file_name], 
+                                        'rows': file_progress['row_count'], 'records': file_progress['record_count'],
+                                        'seconds_since_update': round(current_time - file_progress['report_time'], 1)})
+            metrics['processes'].append(process_metrics)
+        metrics['rss_bytes'] = sum(process_metrics['rss_bytes'] for process_metrics in metrics['processes'])
+        return metrics
+
+    #----------------------------------------
+    def write_metrics(self):
+        metrics = self.get_metrics()
+        if self.metrics_file_name.upper().endswith('.PROM'):
+            replace_file(self.metrics_file_name, format_prometheus_metrics(metrics))
+        else:
+            replace_file(self.metrics_file_name, json.dumps(metrics, indent=4))
 
 #----------------------------------------
-def signal_handler(signal, frame):
-    print('USER INTERUPT! Shutting down ... (please wait)')
-    global shut_down
-    shut_down = True
-    return
+def format_prometheus_metrics(metrics):
+    #--the text format read by the node exporter's textfile collector, every metric is labeled with the phase of the run
+    phase_label = f'phase="{metrics["phase"]}"'
+    metric_lines = []
+    for metric_name, metric_type, metric_key in [('files_total', 'gauge', 'files_total'),
+                                                 ('files_completed', 'gauge', 'files_completed'),
+                                                 ('rows_total', 'counter', 'rows'),
+                                                 ('records_total', 'counter', 'records'),
+                                                 ('rows_per_second', 'gauge', 'rows_per_second'),
+                                                 ('records_per_second', 'gauge', 'records_per_second'),
+                                                 ('input_bytes_read', 'gauge', 'input_bytes_read'),
+                                                 ('input_bytes_total', 'gauge', 'input_bytes_total'),
+                                                 ('eta_seconds', 'gauge', 'eta_seconds'),
+                                                 ('elapsed_seconds', 'gauge', 'elapsed_seconds'),
+                                                 ('rss_bytes', 'gauge', 'rss_bytes')]:
+        if metrics[metric_key] is not None:
+            metric_lines.append(f'# TYPE sayari_mapper_{metric_name} {metric_type}')
+            metric_lines.append(f'sayari_mapper_{metric_name}{{{phase_label}}} {metrics[metric_key]}')
+    metric_lines.append('# TYPE sayari_mapper_running gauge')
+    metric_lines.append(f'sayari_mapper_running{{{phase_label}}} {1 if metrics["status"] == "running" else 0}')
+
+    metric_lines.append('# TYPE sayari_mapper_process_rss_bytes gauge')
+    for process_metrics in metrics['processes']:
+        metric_lines.append(f'sayari_mapper_process_rss_bytes{{{phase_label},pid="{process_metrics["pid"]}",role="{process_metrics["role"]}"}} {process_metrics["rss_bytes"]}')
+    metric_lines.append('# TYPE sayari_mapper_process_seconds_since_update gauge')
+    for process_metrics in metrics['processes']:
+        if 'seconds_since_update' in process_metrics:
+            file_label = os.path.basename(process_metrics['file_name']).replace('\\', '\\\\').replace('"', '\\"')
+            metric_lines.append(f'sayari_mapper_process_seconds_since_update{{{phase_label},pid="{process_metrics["pid"]}",file="{file_label}"}} {process_metrics["seconds_since_update"]}')
+    return '\n'.join(metric_lines) + '\n'
 
 #----------------------------------------
-def display_process_stats(pid, note):
-    print(f'\n{note} memory used: {round(pid.memory_info().rss /1024 /1024 /1024.0,2)}gb\n')  # in bytes 
+def get_file_position(file_handle):
+    #--how far the file on disk has been read, the compressed bytes of a gzip file, a little ahead of the rows parsed from it
+    if isinstance(file_handle, row_cache_reader):
+        return file_handle.get_input_position()
+    return os.lseek(file_handle.fileno(), 0, os.SEEK_CUR)
 
 #----------------------------------------
-if __name__ == "__main__":
-    shut_down = False   
-    signal.signal(signal.SIGINT, signal_handler)
-    main_pid = psutil.Process(os.getpid())
+def report_progress(file_name, bytes_read, row_count, record_count=0, finished=False):
+    #--called by whichever process is reading the file
+    if monitor:
+        monitor.progress_queue.put((os.getpid(), file_name, bytes_read, row_count, record_count, finished, time.time()))
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input_path', help='the directory that contains the Sayari files')
-    parser.add_argument('-o', '--output_path', help='the directory to write the mapped json files to')
-    parser.add_argument('-r', '--relationdb_name', help='the relationship db file to build or use')
-    parser.add_argument('-l', '--log_file', help='optional name of the statistics log file')
-    parser.add_argument('-x', '--extended_format', action='store_true', default=False, help='map all the fields including finances and other information')
-    parser.add_argument('-D', '--debug', action='store_true', default=False, help='run in debug mode')
-    parser.add_argument('-U', '--unattended', action='store_true', default=False, help='dont ask questions')
-    parser.add_argument('-f', '--filter_file', help='optional name of a file containing a list of nodes')
-    args = parser.parse_args()
+#=========================
+class file_lock():
+    #--an exclusive lock on a companion .lock file held for the duration of a with block, it waits for other processes
 
-    if not args.input_path:
-        print('\nPlease supply a valid input file path on the command line\n')
-        sys.exit(1)
-    if not args.output_path:
-        print('\nPlease supply a valid output file path on the command line\n') 
-        sys.exit(1)
-    if not args.relationdb_name:
-        print('\nPlease supply a valid relationship database file name on the command line\n') 
-        sys.exit(1)
+    #----------------------------------------
+    def __init__(self, file_name):
+        self.lock_file_name = file_name + '.lock'
+        self.lock_file_handle = None
 
-    node_filter_list = None
-    if args.filter_file:
-        try:
-            with open(args.filter_file, 'r') as f:
-                node_filter_list = [l[0:-1].strip() for l in f.readlines() if len(l) > 5]
-        except Exception as err:
-            print(f'\nfilter file error: {err}\n')
-            sys.exit(1)
-        print(f'\nFiltering for {len(node_filter_list)} nodes:\n')
-        print(json.dumps(node_filter_list, indent=4))
-        print()
-        if not args.unattended:
-            response = input('OK to proceed? (y/n) ')
-            if not response.upper().startswith('Y'):
-                print(f'\nProcess aborted!')
-                sys.exit(1)
+    #----------------------------------------
+    def __enter__(self):
+        self.lock_file_handle = open(self.lock_file_name, 'a')
+        fcntl.flock(self.lock_file_handle, fcntl.LOCK_EX)
+        return self
 
-    #--validate output directory
-    if not os.path.isdir(args.output_path):
-        print('\nOutput file path is not a valid directory\n') 
-        sys.exit(1)
-    if args.output_path[-1] != os.path.sep:
-        args.output_path = args.output_path + os.path.sep
-    
-    # get list of files, ajusting file spec for directory
-    if os.path.isdir(args.input_path): 
-        if args.input_path[-1] == os.path.sep:
-            input_file_list = glob.glob(args.input_path + '*')
-        else:
-            input_file_list = glob.glob(args.input_path + os.path.sep + '*')
-    else:
-        input_file_list = glob.glob(args.input_path)
+    #----------------------------------------
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        fcntl.flock(self.lock_file_handle, fcntl.LOCK_UN)
+        self.lock_file_handle.close()
 
-    # count files and confirm to proceed
-    print('\nQualifying files ...\n')
-    entity_file_list = []
-    relationship_file_list = []
-    for input_file_name in sorted(input_file_list):
-        if not os.path.splitext(input_file_name)[1].upper() in ('.CSV', '.GZ'):
-            continue
-        if 'relationships' in input_file_name:
-            print('relationship ->', input_file_name)
-            relationship_file_list.append(input_file_name)
-        elif 'entities' in input_file_name or not os.path.isdir(args.input_path):
-            print('entity ->',input_file_name)
-            entity_file_list.append(input_file_name)
-    print(f'\n{len(entity_file_list)} entity files and {len(relationship_file_list)} relationship files found\n')
-    if not entity_file_list and not relationship_file_list:
-        print(f'\nNo Sayari files found at {args.input_path}\n')
-        print('\tSayari files must end with .csv or .gz ... parquet files are not currenty supported.')
-        print('\tSayari entity files must have "entities" somewhere in the file name.')
-        print('\tSayari relationship files must have "relationships" somewhere in the file name.\n')
-        sys.exit(1)
-    if not args.unattended:
-        response = input('OK to proceed? (y/n) ')
-        if not response.upper().startswith('Y'):
-            print(f'\nProcess aborted!')
-            sys.exit(1)
+#----------------------------------------
+def replace_file(file_name, file_contents):
+    #--readers see either the old file or the new one, never a partly written one
+    temp_file_name = f'{file_name}.{os.getpid()}.tmp'
+    with open(temp_file_name, 'w', encoding='utf-8') as f:
+        f.write(file_contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file_name, file_name)
 
-    #--create the mapper and warn if unmapped codes
-    mapper = mapper('sayari_codes.csv', args.relationdb_name)
-    if mapper.unmapped_code_count > 0 and entity_file_list and not args.unattended:
-        print(f'\nWARNING: there are {mapper.unmapped_code_count} unmapped codes in sayari_codes.csv!!\n')
-        response = input('Do you wish to continue anyway? (y/n) ')
-        if not response.upper().startswith('Y'):
-            print('\nProcess aborted!\n')
-            sys.exit(1)
+#----------------------------------------
+def merge_delta_files(delta_path, codes_file_name, log_file_name):
+    #--folds the delta files of any number of mapper runs into the code table and the stats log, the merged deltas are removed
+    #--so each one is only ever counted once, a lock on the delta directory keeps two merges from taking the same files
+    with file_lock(os.path.join(delta_path, 'sayari_delta')):
+        delta_file_list = sorted(glob.glob(os.path.join(delta_path, 'sayari_delta-*.json')))
+        print(f'\nMerging {len(delta_file_list)} delta files from {delta_path} ...\n')
+        if not delta_file_list:
+            return 0
+
+        delta_mapper = mapper(codes_file_name)
+        if log_file_name and os.path.exists(log_file_name):
+            with open(log_file_name, 'r') as f:
+                delta_mapper.merge_stat_pack(json.load(f))
+        for delta_file_name in delta_file_list:
+            with open(delta_file_name, 'r', encoding='utf-8') as f:
+                delta_mapper.merge_worker_results(json.load(f))
+            print(delta_file_name)
+
+        delta_mapper.save_codes_file()
+        print(f'\n{len(delta_mapper.new_code_indexes)} codes merged into {codes_file_name}')
+        if log_file_name:
+            replace_file(log_file_name, json.dumps(delta_mapper.get_stat_pack(), indent=4, sort_keys = True))
+            print(f'Mapping stats merged into {log_file_name}')
+
+        for delta_file_name in delta_file_list:
+            os.remove(delta_file_name)
+    print()
+    return 0
 
-    #--determine if relationships need to be loaded
+#=========================
+class json_codec():
+    #--orjson is used when it is installed as it is several times faster than the json module, anything it rejects
+    #--such as integers over 64 bits falls back to the json module so the results never depend on which is installed
+
+    #----------------------------------------
+    def __init__(self, raw_utf8=False):
+        if raw_utf8:
+            self.encode_record = self.encode_utf8_record
+        else:
+            self.encode_record = self.encode_ascii_record
+
+    #----------------------------------------
+    def decode(self, json_string):
+        if orjson:
+            try: return orjson.loads(json_string)
+            except orjson.JSONDecodeError: pass
+        return json.loads(json_string)
+
+    #----------------------------------------
+    def decode_value(self, value):
+        #--the json columns of rows read back from a row cache are already decoded
+        if type(value) == str:
+            return self.decode(value)
+        return value
+
+    #----------------------------------------
+    def encode_ascii_record(self, json_data):
+        #--the original output format, non-latin characters escaped as \uXXXX
+        return json.dumps(json_data).encode('ascii')
+
+    #----------------------------------------
+    def encode_utf8_record(self, json_data):
+        #--compact json with the characters left as utf-8, ready to be written straight to the output file
+        if orjson:
+            try: return orjson.dumps(json_data)
+            except orjson.JSONEncodeError: pass
+        return json.dumps(json_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+#=========================
+class entity_hash_index():
+    #--a hash of every entity as of the last completed snapshot, so a new snapshot only has to map and write what changed,
+    #--every entity seen is marked with the current snapshot and those still unmarked when it completes were deleted
+
+    #----------------------------------------
+    def __init__(self, hash_db_name, mapping_signature):
+        self.hash_dbo = sqlite3.connect(hash_db_name, isolation_level=None, timeout=600)
+        self.hash_dbo.cursor().execute('PRAGMA journal_mode=wal')
+        self.hash_dbo.cursor().execute('PRAGMA synchronous=1')
+        self.hash_dbo.cursor().execute('create table if not exists entity_hashes (entity_id text primary key, base_hash blob, new_hash blob, snapshot integer) without rowid')
+        self.hash_dbo.cursor().execute('create table if not exists snapshots (completed_snapshot integer)')
+        self.hash_dbo.cursor().execute('create table if not exists snapshot_files (file_name text primary key)')
+        completed_row = self.hash_dbo.cursor().execute('select completed_snapshot from snapshots').fetchone()
+        if not completed_row:
+            self.hash_dbo.cursor().execute('insert into snapshots values (0)')
+        #--an interrupted snapshot is continued rather than started over, its base hashes are still those of the last completed one
+        self.snapshot = (completed_row[0] if completed_row else 0) + 1
+        self.mapping_signature = mapping_signature
+
+    #----------------------------------------
+    def close(self):
+        self.hash_dbo.close()
+
+    #----------------------------------------
+    def get_content_hash(self, input_rows, rel_pointers):
+        content_hash = hashlib.blake2b(self.mapping_signature, digest_size=16)
+        for input_row in input_rows:
+            content_hash.update(repr(tuple(input_row.values())).encode('utf-8'))
+        if rel_pointers:
+            content_hash.update(rel_pointers.encode('utf-8'))
+        return content_hash.digest()
+
+    #----------------------------------------
+    def get_base_hashes(self, entity_id_list):
+        base_hashes = {}
+        for i in range(0, len(entity_id_list), 500):
+            entity_id_chunk = entity_id_list[i:i + 500]
+            sql = 'select entity_id, base_hash from entity_hashes where entity_id in (%s)' % ','.join(['?'] * len(entity_id_chunk))
+            for hash_row in self.hash_dbo.cursor().execute(sql, entity_id_chunk):
+                base_hashes[hash_row[0]] = hash_row[1]
+        return base_hashes
+
+    #----------------------------------------
+    def save_hashes(self, entity_hash_list):
+        self.hash_dbo.cursor().execute('begin immediate')
+        self.hash_dbo.cursor().executemany('insert into entity_hashes values (?, null, ?, ?) on conflict (entity_id) do update set new_hash = excluded.new_hash, snapshot = excluded.snapshot',
+                                           [(entity_id, content_hash, self.snapshot) for entity_id, content_hash in entity_hash_list])
+        self.hash_dbo.cursor().execute('commit')
+
+    #----------------------------------------
+    def get_deleted_entity_ids(self):
+        for hash_row in self.hash_dbo.cursor().execute('select entity_id from entity_hashes where snapshot < ? and base_hash is not null', (self.snapshot,)):
+            yield hash_row[0]
+
+    #----------------------------------------
+    def get_snapshot_file_names(self):
+        #--the entity files the last completed snapshot was made of
+        return {file_row[0] for file_row in self.hash_dbo.cursor().execute('select file_name from snapshot_files')}
+
+    #----------------------------------------
+    def complete_snapshot(self, file_name_list):
+        #--the hashes of this snapshot become the base the next one is compared to, along with the files it was made of
+        self.hash_dbo.cursor().execute('begin immediate')
+        self.hash_dbo.cursor().execute('delete from entity_hashes where snapshot < ?', (self.snapshot,))
+        self.hash_dbo.cursor().execute('update entity_hashes set base_hash = new_hash, new_hash = null')
+        self.hash_dbo.cursor().execute('update snapshots set completed_snapshot = ?', (self.snapshot,))
+        self.hash_dbo.cursor().execute('delete from snapshot_files')
+        self.hash_dbo.cursor().executemany('insert into snapshot_files values (?)', [(file_name,) for file_name in file_name_list])
+        self.hash_dbo.cursor().execute('commit')
+        self.snapshot += 1
+
+#=========================
+class entity_locator_index():
+    #--where each entity was written, as the output file and the offset and length of the block holding its record,
+    #--a compressed block is a gzip member of its own so any one of them can be read back without the rest of the file
+
+    #----------------------------------------
+    def __init__(self, entity_index_name):
+        self.index_dbo = sqlite3.connect(entity_index_name, isolation_level=None, timeout=600)
+        self.index_dbo.cursor().execute('PRAGMA journal_mode=wal')
+        self.index_dbo.cursor().execute('PRAGMA synchronous=1')
+        self.index_dbo.cursor().execute('create table if not exists entity_files (file_id integer primary key, file_name text unique)')
+        self.index_dbo.cursor().execute('create table if not exists entity_blocks (block_id integer primary key, file_id integer, block_offset integer, block_length integer)')
+        self.index_dbo.cursor().execute('create index if not exists entity_blocks_file on entity_blocks (file_id, block_offset)')
+        self.index_dbo.cursor().execute('create table if not exists entity_locations (entity_id text primary key, block_id integer) without rowid')
+
+    #----------------------------------------
+    def close(self):
+        self.index_dbo.close()
+
+    #----------------------------------------
+    def get_file_id(self, file_name):
+        file_name = os.path.abspath(file_name)
+        self.index_dbo.cursor().execute('insert or ignore into entity_files (file_name) values (?)', (file_name,))
+        return self.index_dbo.cursor().execute('select file_id from entity_files where file_name = ?', (file_name,)).fetchone()[0]
+
+    #----------------------------------------
+    def clear_file(self, file_name, block_offset):
+        #--blocks of a file that is about to be rewritten from this offset on, entities still pointing at them are just not found
+        self.index_dbo.cursor().execute('begin immediate')
+        self.index_dbo.cursor().execute('delete from entity_blocks where file_id = ? and block_offset >= ?', (self.get_file_id(file_name), block_offset))
+        self.index_dbo.cursor().execute('commit')
+
+    #----------------------------------------
+    def save_blocks(self, file_name, entity_block_list):
+        self.index_dbo.cursor().execute('begin immediate')
+        file_id = self.get_file_id(file_name)
+        for record_id_list, block_offset, block_length in entity_block_list:
+            block_id = self.index_dbo.cursor().execute('insert into entity_blocks (file_id, block_offset, block_length) values (?, ?, ?)', (file_id, block_offset, block_length)).lastrowid
+            self.index_dbo.cursor().executemany('insert or replace into entity_locations values (?, ?)', [(record_id, block_id) for record_id in record_id_list])
+        self.index_dbo.cursor().execute('commit')
+
+    #----------------------------------------
+    def get_blocks(self, entity_id_list):
+        #--returns the entities to look for in each block, keyed by file name, offset and length
+        entity_blocks = {}
+        for i in range(0, len(entity_id_list), 500):
+            entity_id_chunk = entity_id_list[i:i + 500]
+            sql = 'select entity_locations.entity_id, entity_files.file_name, entity_blocks.block_offset, entity_blocks.block_length ' \
+                  'from entity_locations join entity_blocks on entity_blocks.block_id = entity_locations.block_id ' \
+                  'join entity_files on entity_files.file_id = entity_blocks.file_id where entity_locations.entity_id in (%s)' % ','.join(['?'] * len(entity_id_chunk))
+            for index_row in self.index_dbo.cursor().execute(sql, entity_id_chunk):
+                entity_blocks.setdefault(index_row[1:], set()).add(index_row[0])
+        return entity_blocks
+
+#=========================
+class threaded_gzip_reader(io.RawIOBase):
+    #--decompresses a gzip file on a background thread a few chunks ahead of the reader, zlib lets go of the gil while it works
+    #--so the decompression overlaps with the csv parsing and mapping on the main thread
+
+    #----------------------------------------
+    def __init__(self, file_name, chunk_size=262144, queue_size=16):
+        super().__init__()
+        self.file_handle = open(file_name, 'rb')
+        self.chunk_size = chunk_size
+        self.chunk_queue = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self.chunk = memoryview(b'')
+        self.chunk_offset = 0
+        self.finished = False
+        self.decompress_thread = threading.Thread(target=self.decompress_file, daemon=True)
+        self.decompress_thread.start()
+
+    #----------------------------------------
+    def readable(self):
+        return True
+
+    #----------------------------------------
+    def fileno(self):
+        return self.file_handle.fileno()
+
+    #----------------------------------------
+    def close(self):
+        if not self.closed:
+            self.stop_event.set()
+            self.decompress_thread.join()
+            self.file_handle.close()
+        super().close()
+
+    #----------------------------------------
+    def decompress_file(self):
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            member_started = False
+            while not self.stop_event.is_set():
+                compressed_data = self.file_handle.read(self.chunk_size)
+                if not compressed_data:
+                    break
+                while compressed_data:
+                    member_started = True
+                    self.put_chunk(decompressor.decompress(compressed_data))
+                    if not decompressor.eof:
+                        break
+                    #--a gzip file can be several members one after the other, padded with zeros
+                    compressed_data = decompressor.unused_data.lstrip(b'\0')
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    member_started = False
+            if member_started and not self.stop_event.is_set():
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            self.put_chunk(None)
+        except Exception as err:
+            self.put_chunk(err)
+
+    #----------------------------------------
+    def put_chunk(self, chunk):
+        while not self.stop_event.is_set():
+            try: 
+                self.chunk_queue.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    #----------------------------------------
+    def readinto(self, buffer):
+        while self.chunk_offset >= len(self.chunk):
+            if self.finished:
+                return 0
+            chunk = self.chunk_queue.get()
+            if chunk is None:
+                self.finished = True
+                return 0
+            if isinstance(chunk, Exception):
+                raise chunk
+            self.chunk = memoryview(chunk)
+            self.chunk_offset = 0
+        byte_count = min(len(buffer), len(self.chunk) - self.chunk_offset)
+        buffer[:byte_count] = self.chunk[self.chunk_offset: self.chunk_offset + byte_count]
+        self.chunk_offset += byte_count
+        return byte_count
+
+#----------------------------------------
+def open_gzip_file(file_name):
+    #--a buffered binary stream of the decompressed file
+    if args.io_threads > 0:
+        return io.BufferedReader(threaded_gzip_reader(file_name), 1048576)
+    return io.BufferedReader(gzip.open(file_name, 'rb'))
+
+#=========================
+class background_iterator():
+    #--runs an iterator on a background thread a few items ahead of the loop consuming it
+
+    #----------------------------------------
+    def __init__(self, item_iterator, queue_size=4):
+        self.item_iterator = item_iterator
+        self.item_queue = queue.Queue(queue_size)
+        self.stop_event = threading.Event()
+        self.end_marker = object()
+        self.iterator_thread = threading.Thread(target=self.run_iterator, daemon=True)
+        self.iterator_thread.start()
+
+    #----------------------------------------
+    def __iter__(self):
+        return self
+
+    #----------------------------------------
+    def __next__(self):
+        item = self.item_queue.get()
+        if item is self.end_marker:
+            self.item_queue.put(item)
+            raise StopIteration
+        if isinstance(item, background_error):
+            raise item.err
+        return item
+
+    #----------------------------------------
+    def close(self):
+        self.stop_event.set()
+        self.iterator_thread.join()
+
+    #----------------------------------------
+    def run_iterator(self):
+        try:
+            for item in self.item_iterator:
+                if not self.put_item(item):
+                    return
+            self.put_item(self.end_marker)
+        except Exception as err:
+            self.put_item(background_error(err))
+
+    #----------------------------------------
+    def put_item(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.item_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+#=========================
+class row_cache_writer():
+    #--the rows of an entity file grouped by entity with their json columns decoded, so a --remap after the code table is changed
+    #--skips the decompression, csv parsing and json decoding, the file is a header naming the columns and the input file it was
+    #--made from followed by blocks of entities, each the marshalled row values compressed with zlib and preceded by its length
+
+    #----------------------------------------
+    def __init__(self, cache_file_name, input_file_name, field_name_list):
+        self.cache_file_name = cache_file_name
+        self.field_name_list = field_name_list
+        self.prefix_list = [row_cache_columns.get(field_name) for field_name in field_name_list]
+        self.entity_list = []
+        self.file_handle = open(cache_file_name + '.partial', 'wb')
+        header_data = marshal.dumps({'field_names': field_name_list, 'input_signature': get_row_cache_signature(input_file_name)})
+        self.file_handle.write(row_cache_magic + struct.pack('<I', len(header_data)) + header_data)
+
+    #----------------------------------------
+    def add_entity(self, input_rows):
+        entity_values = []
+        for input_row in input_rows:
+            row_values = []
+            for field_name, prefixes in zip(self.field_name_list, self.prefix_list):
+                value = input_row.get(field_name)
+                if prefixes and value and value[0] in prefixes:
+                    #--anything that would not decode is left for map_row to fail on as it always has
+                    try: value = mapper.codec.decode(value)
+                    except ValueError: pass
+                row_values.append(value)
+            entity_values.append(row_values)
+        self.entity_list.append(entity_values)
+        if len(self.entity_list) >= row_cache_block_size:
+            self.write_block()
+
+    #----------------------------------------
+    def write_block(self):
+        if self.entity_list:
+            block_data = zlib.compress(marshal.dumps(self.entity_list), 1)
+            self.file_handle.write(struct.pack('<I', len(block_data)) + block_data)
+            self.entity_list = []
+
+    #----------------------------------------
+    def close(self, finished):
+        #--only the cache of a whole file gets its real name
+        self.write_block()
+        self.file_handle.close()
+        if finished:
+            os.replace(self.cache_file_name + '.partial', self.cache_file_name)
+        else:
+            os.remove(self.cache_file_name + '.partial')
+
+#=========================
+class row_cache_reader():
+    #--reads back the entities of a row cache as lists of row dicts, the same as read from the entity file but with the json decoded
+
+    #----------------------------------------
+    def __init__(self, cache_file_name):
+        self.cache_file_name = cache_file_name
+        self.file_handle = open(cache_file_name, 'rb')
+        if self.file_handle.read(len(row_cache_magic)) != row_cache_magic:
+            self.file_handle.close()
+            raise ValueError(f'{cache_file_name} is not a row cache')
+        header_length = struct.unpack('<I', self.file_handle.read(4))[0]
+        header_data = marshal.loads(self.file_handle.read(header_length))
+        self.field_name_list = header_data['field_names']
+        self.input_signature = header_data['input_signature']
+        self.cache_file_size = os.fstat(self.file_handle.fileno()).st_size
+
+    #----------------------------------------
+    def close(self):
+        self.file_handle.close()
+
+    #----------------------------------------
+    def read_entities(self):
+        while True:
+            length_data = self.file_handle.read(4)
+            if not length_data:
+                break
+            block_length = struct.unpack('<I', length_data)[0]
+            for entity_values in marshal.loads(zlib.decompress(self.file_handle.read(block_length))):
+                yield [dict(zip(self.field_name_list, row_values)) for row_values in entity_values]
+
+    #----------------------------------------
+    def get_input_position(self):
+        #--how far through the cache in bytes of the entity file it was made from, so progress reads the same either way
+        return os.lseek(self.file_handle.fileno(), 0, os.SEEK_CUR) * self.input_signature[0] // max(self.cache_file_size, 1)
+
+#----------------------------------------
+def get_row_cache_file_name(input_file_name):
+    #--entities-00000.csv.gz is cached as entities-00000.rows on the row cache path
+    base_file_name = os.path.basename(input_file_name)
+    if base_file_name.upper().endswith('.GZ'):
+        base_file_name = os.path.splitext(base_file_name)[0]
+    return os.path.join(args.row_cache, os.path.splitext(base_file_name)[0] + '.rows')
+
+#----------------------------------------
+def get_row_cache_signature(input_file_name):
+    return [os.path.getsize(input_file_name), int(os.path.getmtime(input_file_name))]
+
+#----------------------------------------
+def open_row_cache(input_file_name):
+    #--the row cache of an entity file if there is one and it was made from the file as it is now
+    cache_file_name = get_row_cache_file_name(input_file_name)
+    if not os.path.exists(cache_file_name):
+        return None
+    try: cache_reader = row_cache_reader(cache_file_name)
+    except (OSError, ValueError, EOFError, struct.error):
+        return None
+    if cache_reader.input_signature != get_row_cache_signature(input_file_name):
+        cache_reader.close()
+        return None
+    return cache_reader
+
+#=========================
+class background_error():
+    #--carries an exception from a background thread to the one waiting on it
+
+    #----------------------------------------
+    def __init__(self, err):
+        self.err = err
+
+#=========================
+class block_writer():
+    #--streams output lines to a file in blocks, each compressed into a gzip member of its own on a pool of threads as zlib lets go
+    #--of the gil, a background thread writes them in order so the mapping carries on while earlier blocks are compressed and written
+
+    #----------------------------------------
+    def __init__(self, file_handle, block_size, compress_level=None, thread_count=0):
+        self.file_handle = file_handle
+        self.block_size = block_size
+        self.compress_level = compress_level #--none writes the blocks uncompressed
+        self.line_list = []
+        self.record_id_list = []
+        self.written_block_list = []
+        self.byte_count = file_handle.tell()
+        self.block_count = 0
+        self.write_error = None
+        self.thread_pool = None
+        if thread_count > 0:
+            self.thread_pool = concurrent.futures.ThreadPoolExecutor(thread_count)
+            self.block_queue = queue.Queue(thread_count * 2)
+            self.write_thread = threading.Thread(target=self.write_queued_blocks, daemon=True)
+            self.write_thread.start()
+
+    #----------------------------------------
+    def close(self):
+        written_block_list = self.flush()
+        if self.thread_pool:
+            self.block_queue.put(None)
+            self.write_thread.join()
+            self.thread_pool.shutdown()
+        return written_block_list
+
+    #----------------------------------------
+    def add_records(self, output_records):
+        self.add_lines([output_record[2] for output_record in output_records], [output_record[1] for output_record in output_records])
+
+    #----------------------------------------
+    def add_lines(self, line_list, record_id_list):
+        self.line_list.extend(line_list)
+        self.record_id_list.extend(record_id_list)
+        while len(self.line_list) >= self.block_size:
+            self.send_block(self.line_list[:self.block_size], self.record_id_list[:self.block_size])
+            del self.line_list[:self.block_size]
+            del self.record_id_list[:self.block_size]
+
+    #----------------------------------------
+    def flush(self):
+        #--returns the record ids, offset and length of every block written since the last flush once they are all in the file
+        if self.line_list:
+            self.send_block(self.line_list, self.record_id_list)
+            self.line_list = []
+            self.record_id_list = []
+        self.wait()
+        written_block_list = self.written_block_list
+        self.written_block_list = []
+        return written_block_list
+
+    #----------------------------------------
+    def wait(self):
+        #--until every block sent so far is in the file
+        if self.thread_pool:
+            self.block_queue.join()
+        if self.write_error:
+            raise self.write_error
+
+    #----------------------------------------
+    def send_block(self, line_list, record_id_list):
+        self.block_count += 1
+        if self.thread_pool:
+            self.block_queue.put((self.thread_pool.submit(self.encode_block, line_list), record_id_list))
+        else:
+            self.write_block(self.encode_block(line_list), record_id_list)
+
+    #----------------------------------------
+    def encode_block(self, line_list):
+        #--returns the block with how long it took, only the one thread that writes adds up the times
+        timer_start = time.perf_counter()
+        block_data = b'\n'.join(line_list) + b'\n'
+        if self.compress_level is not None:
+            block_data = gzip.compress(block_data, self.compress_level)
+        return block_data, time.perf_counter() - timer_start
+
+    #----------------------------------------
+    def write_block(self, encoded_block, record_id_list):
+        block_data, encode_seconds = encoded_block
+        if self.compress_level is not None:
+            mapper.stage_times.add('compress', encode_seconds, len(record_id_list))
+        self.written_block_list.append((record_id_list, self.byte_count, len(block_data)))
+        self.file_handle.write(block_data)
+        self.byte_count += len(block_data)
+
+    #----------------------------------------
+    def write_queued_blocks(self):
+        while True:
+            block_item = self.block_queue.get()
+            try:
+                if block_item is None:
+                    return
+                if not self.write_error:
+                    self.write_block(block_item[0].result(), block_item[1])
+            except Exception as err:
+                self.write_error = err
+            finally:
+                self.block_queue.task_done()
+
+#=========================
+class sharded_output_writer():
+    #--routes the records of one entity file to its output files, split by record type and into hash partitions of the record id
+    #--when asked for, each rolled over to a new part after so many records or megabytes, with none of that there is just the one
+    #--output file named after the entity file, they are all written to .partial files until the whole entity file is done
+
+    #----------------------------------------
+    def __init__(self, output_file_name, block_size, compress_level=None, thread_count=0, checkpoint_files=None):
+        self.output_file_name = output_file_name
+        self.root_name = output_file_name[:output_file_name.rindex('.json')]
+        self.extension = output_file_name[len(self.root_name):]
+        self.block_size = block_size
+        self.compress_level = compress_level
+        self.thread_count = thread_count
+        self.roll_records = args.roll_records or 0
+        self.roll_bytes = int((args.roll_mb or 0) * 1048576)
+
+        self.shard_file_list = [] #--every part of every shard in the order they were started
+        self.open_shards = {}
+        self.written_file_blocks = [] #--blocks of parts rolled over since the last flush
+        for file_entry in checkpoint_files or []:
+            file_entry = dict(file_entry, shard_key=tuple(file_entry['shard_key']))
+            self.shard_file_list.append(file_entry)
+            if file_entry['open']:
+                self.open_shard(file_entry)
+
+    #----------------------------------------
+    def get_shard_file_name(self, shard_key, part):
+        #--entities-00000.json.gz split by type into 4 partitions and rolled is entities-00000-person-1-of-4-0001.json.gz and so on
+        record_type, partition = shard_key
+        shard_file_name = self.root_name
+        if record_type:
+            shard_file_name += '-' + ''.join(c if c.isalnum() else '_' for c in record_type.lower())
+        if partition is not None:
+            shard_file_name += f'-{partition + 1}-of-{args.partition_count}'
+        if part is not None:
+            shard_file_name += f'-{part:04d}'
+        return shard_file_name + self.extension
+
+    #----------------------------------------
+    def open_shard(self, file_entry):
+        #--a part that was open at the last checkpoint is cut back to it and carried on
+        if os.path.exists(file_entry['file_name'] + '.partial') and file_entry['byte_count']:
+            file_handle = open(file_entry['file_name'] + '.partial', 'r+b')
+            file_handle.truncate(file_entry['byte_count'])
+            file_handle.seek(0, os.SEEK_END)
+        else:
+            file_handle = open(file_entry['file_name'] + '.partial', 'wb')
+        self.open_shards[file_entry['shard_key']] = (file_entry, file_handle, block_writer(file_handle, self.block_size, self.compress_level, self.thread_count))
+
+    #----------------------------------------
+    def start_shard(self, shard_key, part):
+        file_entry = {'file_name': self.get_shard_file_name(shard_key, part), 'shard_key': shard_key, 'part': part, 'record_count': 0, 'byte_count': 0, 'open': True}
+        self.shard_file_list.append(file_entry)
+        self.open_shard(file_entry)
+
+    #----------------------------------------
+    def close_shard(self, shard_key):
+        file_entry, file_handle, shard_writer = self.open_shards.pop(shard_key)
+        written_block_list = shard_writer.close()
+        if written_block_list:
+            self.written_file_blocks.append((file_entry['file_name'], written_block_list))
+        file_entry['byte_count'] = shard_writer.byte_count
+        file_entry['open'] = False
+        file_handle.flush()
+        os.fsync(file_handle.fileno())
+        file_handle.close()
+
+    #----------------------------------------
+    def add_records(self, output_records):
+        shard_records = {}
+        for shard_key, record_id, output_line in output_records:
+            shard_records.setdefault(shard_key, []).append((record_id, output_line))
+        for shard_key, record_list in shard_records.items():
+            while record_list:
+                if shard_key not in self.open_shards:
+                    self.start_shard(shard_key, self.get_next_part(shard_key))
+                file_entry, file_handle, shard_writer = self.open_shards[shard_key]
+                record_count = len(record_list) if not self.roll_records else min(len(record_list), self.roll_records - file_entry['record_count'])
+                block_count = shard_writer.block_count
+                shard_writer.add_lines([record[1] for record in record_list[:record_count]], [record[0] for record in record_list[:record_count]])
+                file_entry['record_count'] += record_count
+                record_list = record_list[record_count:]
+                if self.roll_bytes and shard_writer.block_count > block_count:
+                    shard_writer.wait() #--the size is only known once the block is compressed, so it is checked a block at a time
+                if (self.roll_records and file_entry['record_count'] >= self.roll_records) or (self.roll_bytes and shard_writer.byte_count >= self.roll_bytes):
+                    self.close_shard(shard_key)
+
+    #----------------------------------------
+    def get_next_part(self, shard_key):
+        if not self.roll_records and not self.roll_bytes:
+            return None
+        return max([file_entry['part'] for file_entry in self.shard_file_list if file_entry['shard_key'] == shard_key] + [0]) + 1
+
+    #----------------------------------------
+    def flush(self):
+        #--returns the blocks written to each file since the last flush once they are all on disk
+        written_file_blocks = self.written_file_blocks
+        self.written_file_blocks = []
+        for file_entry, file_handle, shard_writer in self.open_shards.values():
+            written_block_list = shard_writer.flush()
+            if written_block_list:
+                written_file_blocks.append((file_entry['file_name'], written_block_list))
+            file_entry['byte_count'] = shard_writer.byte_count
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        return written_file_blocks
+
+    #----------------------------------------
+    def close(self):
+        for shard_key in list(self.open_shards):
+            self.close_shard(shard_key)
+        return self.flush()
+
+    #----------------------------------------
+    def get_checkpoint_files(self):
+        return [dict(file_entry) for file_entry in self.shard_file_list]
+
+    #----------------------------------------
+    def finish(self):
+        #--gives every part its real name, the manifest goes last so its being there means the whole entity file was written
+        if not self.shard_file_list and not output_sharded():
+            with open(self.output_file_name + '.partial', 'wb') as file_handle:
+                if self.compress_level is not None:
+                    file_handle.write(gzip.compress(b'')) #--an empty file is still a gzip file
+            self.shard_file_list.append({'file_name': self.output_file_name, 'shard_key': (None, None), 'part': None, 'record_count': 0, 'byte_count': 0, 'open': False})
+        for file_entry in self.shard_file_list:
+            os.replace(file_entry['file_name'] + '.partial', file_entry['file_name'])
+        if output_sharded():
+            manifest_data = {'output_file_count': len(self.shard_file_list),
+                             'record_count': sum(file_entry['record_count'] for file_entry in self.shard_file_list),
+                             'output_files': [{'file_name': os.path.basename(file_entry['file_name']),
+                                               'record_type': file_entry['shard_key'][0],
+                                               'partition': file_entry['shard_key'][1] + 1 if file_entry['shard_key'][1] is not None else None,
+                                               'part': file_entry['part'],
+                                               'record_count': file_entry['record_count'],
+                                               'byte_count': file_entry['byte_count']} for file_entry in self.shard_file_list]}
+            replace_file(get_manifest_file_name(self.output_file_name), json.dumps(manifest_data, indent=4))
+
+#----------------------------------------
+def output_sharded():
+    return bool(args.partition_count > 1 or args.partition_by_type or args.roll_records or args.roll_mb)
+
+#----------------------------------------
+def get_output_layout():
+    #--a checkpoint only applies if the output is still being split the same way
+    return [args.partition_count, args.partition_by_type, args.roll_records, args.roll_mb]
+
+#----------------------------------------
+def get_manifest_file_name(output_file_name):
+    return output_file_name[:output_file_name.rindex('.json')] + '.manifest.json'
+
+#----------------------------------------
+def get_shard_key(json_data):
+    record_type = (json_data.get('RECORD_TYPE') or 'UNKNOWN') if args.partition_by_type else None
+    partition = zlib.crc32(json_data['RECORD_ID'].encode('utf-8')) % args.partition_count if args.partition_count > 1 else None
+    return (record_type, partition)
+
+#----------------------------------------
+def get_output_records(json_list):
+    #--the shard key, record id and json line of each mapped record
+    timer_start = time.perf_counter()
+    output_records = [(get_shard_key(json_data), json_data['RECORD_ID'], mapper.codec.encode_record(json_data)) for json_data in json_list]
+    mapper.stage_times.add('encode', time.perf_counter() - timer_start, len(output_records))
+    return output_records
+
+#=========================
+class sqlite_relation_store():
+    #--the rel pointers of one shard in a sqlite table clustered on src
+
+    #----------------------------------------
+    def __init__(self, shard_name, merge_join=False):
+        self.relation_dbo = sqlite3.connect(f'file:{shard_name}?mode=ro', uri=True)
+        self.relation_dbo.cursor().execute('PRAGMA query_only=ON')
+        self.merge_join = merge_join
+        self.reset()
+
+    #----------------------------------------
+    def close(self):
+        self.relation_dbo.close()
+
+    #----------------------------------------
+    def reset(self):
+        self.relation_cursor = None
+        self.next_relation_row = None
+        self.last_src = None
+
+    #----------------------------------------
+    def get_rel_pointers(self, src):
+        if not self.merge_join:
+            relation_row = self.relation_dbo.cursor().execute(relation_select_sql + ' where src = ?', (src,)).fetchone()
+            return relation_row[1] if relation_row else None
+
+        #--entities are expected in the same sort order as the relationships, anything that goes backwards forces a seek
+        if self.relation_cursor is None or src < self.last_src:
+            self.relation_cursor = self.relation_dbo.cursor().execute(relation_select_sql + ' where src >= ? order by src', (src,))
+            self.next_relation_row = next(self.relation_cursor, None)
+        self.last_src = src
+
+        while self.next_relation_row and self.next_relation_row[0] < src:
+            self.next_relation_row = next(self.relation_cursor, None)
+
+        if self.next_relation_row and self.next_relation_row[0] == src:
+            return self.next_relation_row[1]
+        return None
+
+    #----------------------------------------
+    def get_rel_pointers_list(self, src_list):
+        #--one query per 500 srcs rather than one per src
+        rel_pointer_data = {}
+        for i in range(0, len(src_list), 500):
+            src_chunk = src_list[i:i + 500]
+            sql = relation_select_sql + ' where src in (%s)' % ','.join(['?'] * len(src_chunk))
+            for relation_row in self.relation_dbo.cursor().execute(sql, src_chunk):
+                rel_pointer_data[relation_row[0]] = relation_row[1]
+        return rel_pointer_data
+
+#=========================
+class sqlite_relation_writer():
+    #--bulk loads the rel pointers of one shard, they must be added in src order
+
+    #----------------------------------------
+    def __init__(self, relation_dbo):
+        self.relation_dbo = relation_dbo
+        self.relation_dbo.cursor().execute('create table relationships (src text primary key, rel_pointers text) without rowid')
+        self.row_chunk = []
+
+    #----------------------------------------
+    def add(self, src, rel_pointers):
+        self.row_chunk.append((src, rel_pointers))
+        if len(self.row_chunk) >= 100000:
+            self.flush()
+
+    #----------------------------------------
+    def flush(self):
+        self.relation_dbo.cursor().executemany('insert into relationships values (?, ?)', self.row_chunk)
+        self.row_chunk = []
+
+    #----------------------------------------
+    def close(self):
+        self.flush()
+
+#=========================
+class mmap_relation_store():
+    #--the rel pointers of one shard in a pair of files that every process maps into memory, so they all share the os page cache
+    #--the .idx file is a header followed by fixed width entries sorted by src, each a null padded src and the offset and length
+    #--of its rel pointer json in the .dat file, a lookup is a binary search over the entries rather than a sql round trip
+
+    #----------------------------------------
+    def __init__(self, shard_name, merge_join=False):
+        root_name = os.path.splitext(shard_name)[0]
+        self.index_file_handle = open(root_name + '.idx', 'rb')
+        self.index_map = mmap.mmap(self.index_file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.key_width = mmap_index_header.unpack_from(self.index_map, 0)
+        if magic != mmap_index_magic:
+            raise Exception(f'{root_name}.idx is not a relationship index')
+        self.entry_struct = mmap_index_entry(self.key_width)
+        self.entry_count = (len(self.index_map) - mmap_index_header.size) // self.entry_struct.size
+
+        self.data_file_handle = open(root_name + '.dat', 'rb')
+        if os.fstat(self.data_file_handle.fileno()).st_size:
+            self.data_map = mmap.mmap(self.data_file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data_map = b'' #--empty files cannot be mapped
+
+        self.merge_join = merge_join
+        self.reset()
+
+    #----------------------------------------
+    def close(self):
+        self.index_map.close()
+        self.index_file_handle.close()
+        if self.data_map:
+            self.data_map.close()
+        self.data_file_handle.close()
+
+    #----------------------------------------
+    def reset(self):
+        self.last_key = None
+        self.next_position = 0
+
+    #----------------------------------------
+    def get_key(self, position):
+        entry_offset = mmap_index_header.size + position * self.entry_struct.size
+        return self.index_map[entry_offset: entry_offset + self.key_width]
+
+    #----------------------------------------
+    def get_rel_pointers(self, src):
+        key = src.encode('utf-8')
+        if len(key) > self.key_width:
+            return None
+        key = key.ljust(self.key_width, b'\0')
+
+        low_position, high_position = 0, self.entry_count
+        if self.merge_join and self.last_key is not None and key >= self.last_key:
+            #--sorted entities are near the last one found, so gallop forward from there before the binary search
+            low_position = self.next_position
+            step = 1
+            while low_position + step < self.entry_count and self.get_key(low_position + step) < key:
+                low_position += step
+                step *= 2
+            high_position = min(low_position + step + 1, self.entry_count)
+
+        while low_position < high_position:
+            middle_position = (low_position + high_position) // 2
+            if self.get_key(middle_position) < key:
+                low_position = middle_position + 1
+            else:
+                high_position = middle_position
+        self.last_key = key
+        self.next_position = low_position
+
+        if low_position < self.entry_count and self.get_key(low_position) == key:
+            entry_key, data_offset, data_length = self.entry_struct.unpack_from(self.index_map, mmap_index_header.size + low_position * self.entry_struct.size)
+            return self.data_map[data_offset: data_offset + data_length].decode('utf-8')
+        return None
+
+    #----------------------------------------
+    def get_rel_pointers_list(self, src_list):
+        rel_pointer_data = {}
+        for src in src_list:
+            rel_pointers = self.get_rel_pointers(src)
+            if rel_pointers:
+                rel_pointer_data[src] = rel_pointers
+        return rel_pointer_data
+
+#=========================
+class mmap_relation_writer():
+    #--bulk loads the rel pointers of one shard into its .idx and .dat files, they must be added in src order
+
+    #----------------------------------------
+    def __init__(self, shard_name, key_width):
+        root_name = os.path.splitext(shard_name)[0]
+        self.key_width = key_width
+        self.entry_struct = mmap_index_entry(key_width)
+        self.index_file_handle = open(root_name + '.idx', 'wb')
+        self.index_file_handle.write(mmap_index_header.pack(mmap_index_magic, key_width))
+        self.data_file_handle = open(root_name + '.dat', 'wb')
+        self.data_offset = 0
+
+    #----------------------------------------
+    def add(self, src, rel_pointers):
+        rel_pointer_bytes = rel_pointers.encode('utf-8')
+        self.data_file_handle.write(rel_pointer_bytes)
+        self.index_file_handle.write(self.entry_struct.pack(src.encode('utf-8'), self.data_offset, len(rel_pointer_bytes)))
+        self.data_offset += len(rel_pointer_bytes)
+
+    #----------------------------------------
+    def close(self):
+        self.index_file_handle.close()
+        self.data_file_handle.close()
+
+#----------------------------------------
+def mmap_index_entry(key_width):
+    #--struct pads the src with nulls, so the padded entries sort the same as the srcs themselves
+    return struct.Struct(f'<{key_width}sQI')
+
+#----------------------------------------
+@functools.lru_cache(maxsize=100000)
+def parse_date(raw_date):
+    #--sayari dates are almost all YYYY, YYYY-MM or YYYY-MM-DD and the same ones keep coming back,
+    #--so those are parsed directly and everything is cached, only unusual formats go to dateutil
+    #--missing months and days are the first of the period, unparseable dates are None
+    try:
+        if len(raw_date) == 4 and raw_date.isdigit():
+            return datetime(int(raw_date), 1, 1)
+        if len(raw_date) == 7 and raw_date[4] == '-' and raw_date[0:4].isdigit() and raw_date[5:7].isdigit():
+            return datetime(int(raw_date[0:4]), int(raw_date[5:7]), 1)
+        if len(raw_date) == 10 and raw_date[4] == '-' and raw_date[7] == '-' and raw_date[0:4].isdigit() and raw_date[5:7].isdigit() and raw_date[8:10].isdigit():
+            return datetime(int(raw_date[0:4]), int(raw_date[5:7]), int(raw_date[8:10]))
+    except (ValueError, OverflowError, TypeError):
+        return None
+    try: return dateparse(raw_date)
+    except: return None
+
+#----------------------------------------
+def map_rel_pointer(relation_row, as_of_date):
+    #--relation_row is src, dst, type, from_date, thru_date, shares
+    rel_pointer_data = {'REL_POINTER_DOMAIN': 'SAYARI',
+                        'REL_POINTER_KEY': relation_row[1],
+                        'REL_POINTER_ROLE': relation_row[2]
+                       }
+    if relation_row[3]: #--from_date
+        rel_pointer_data['REL_POINTER_FROM_DATE'] = relation_row[3]
+    if relation_row[4]: #--thru_date
+        rel_pointer_data['REL_POINTER_THRU_DATE'] = relation_row[4]
+        thru_date = parse_date(relation_row[4])
+        try:
+            if thru_date and thru_date < as_of_date:
+                rel_pointer_data['REL_POINTER_ROLE'] = '(former) ' + rel_pointer_data['REL_POINTER_ROLE']
+        except: pass #--timezone aware dates can't be compared
+    if relation_row[5]: #--shares
+        percentage = 0
+        try:
+            share_data = json.loads(relation_row[5])
+            for share_record in share_data:
+                if 'percentage' in share_record:
+                    percentage = share_record['percentage']
+                    break
+        except:
+            pass
+        if percentage:
+            rel_pointer_data['REL_POINTER_ROLE'] = str(percentage) + ' ' + rel_pointer_data['REL_POINTER_ROLE']
+    return rel_pointer_data
+
+#----------------------------------------
+def relation_shard_names(relationdb_name, shard_count):
+    #--relationships.db split 4 ways is relationships.db plus relationships-1-of-4.db thru relationships-4-of-4.db
+    if shard_count <= 1:
+        return [relationdb_name]
+    root_name, file_extension = os.path.splitext(relationdb_name)
+    return [f'{root_name}-{i + 1}-of-{shard_count}{file_extension}' for i in range(shard_count)]
+
+#----------------------------------------
+def relation_shard(src, shard_count):
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(src.encode('utf-8')) % shard_count
+
+#----------------------------------------
+def relation_store_file_names(relationdb_name, shard_count, backend):
+    #--the files that must all exist for a finished relation database to be usable
+    if backend == 'mmap':
+        return [os.path.splitext(shard_name)[0] + file_extension for shard_name in relation_shard_names(relationdb_name, shard_count) for file_extension in ('.idx', '.dat')]
+    return relation_shard_names(relationdb_name, shard_count)
+
+#----------------------------------------
+def get_relation_db_info(relationdb_name):
+    relation_dbo = sqlite3.connect(f'file:{relationdb_name}?mode=ro', uri=True)
+    try: shard_count, backend = relation_dbo.cursor().execute('select shard_count, backend from finished').fetchone()
+    except: shard_count, backend = 1, 'sqlite'
+    relation_dbo.close()
+    return shard_count, backend
+
+#----------------------------------------
+def read_relationship_file(relationship_file_name):
+    #--yields chunks of src, dst, type, from_date, thru_date, shares rows, the only columns the mapper uses
+    base_file_name, file_extension = os.path.splitext(relationship_file_name)
+    compressed_file = file_extension.upper() == '.GZ'
+    if compressed_file:
+        input_file_handle = io.TextIOWrapper(open_gzip_file(relationship_file_name), encoding='utf-8', newline='')
+    else:
+        input_file_handle = open(relationship_file_name, 'r', encoding='utf-8', newline='')
+    csv_reader = csv.reader(input_file_handle)
+
+    try: column_list = next(csv_reader) #--skip header row
+    except StopIteration: column_list = None
+
+    #--fixed size chunks so memory stays flat no matter the file size
+    row_count = 0
+    report_progress(relationship_file_name, get_file_position(input_file_handle), row_count)
+    while column_list:
+        row_chunk = []
+        for row in itertools.islice(csv_reader, 100000):
+            if len(row) < 9:
+                row = row + [''] * (9 - len(row))
+            row_chunk.append([row[i] if row[i] != '' else None for i in (0, 1, 2, 4, 5, 8)])
+        if not row_chunk:
+            break
+        row_count += len(row_chunk)
+        report_progress(relationship_file_name, get_file_position(input_file_handle), row_count)
+        yield row_chunk
+        if shut_down:
+            break
+    report_progress(relationship_file_name, None, row_count, finished=not shut_down)
+    input_file_handle.close()
+
+#----------------------------------------
+def create_relation_db(relationdb_name):
+    if os.path.exists(relationdb_name):
+        os.remove(relationdb_name)
+    relation_dbo = sqlite3.connect(relationdb_name, isolation_level=None)
+    relation_dbo.cursor().execute("PRAGMA journal_mode=wal")
+    relation_dbo.cursor().execute("PRAGMA synchronous=0")
+
+    #--the rowid of the staging table keeps the load order within each src
+    relation_dbo.cursor().execute('create table relationship_load (src text, dst text, type text, from_date text, thru_date text, shares text)')
+    return relation_dbo
+
+#----------------------------------------
+def stage_relationship_rows(relation_dbo, row_chunk):
+    relation_dbo.cursor().execute('begin')
+    relation_dbo.cursor().executemany('insert into relationship_load values (?, ?, ?, ?, ?, ?)', row_chunk)
+    relation_dbo.cursor().execute('commit')
+
+#----------------------------------------
+def finish_relation_db(relation_dbo, shard_name, as_of_date, shard_count, backend):
+    #--one entry per src in src order holding the finished rel pointer json, so mapping only has to splice it in
+    relation_dbo.cursor().execute('begin')
+    if backend == 'mmap':
+        key_width = relation_dbo.cursor().execute('select max(length(cast(src as blob))) from relationship_load').fetchone()[0]
+        store_writer = mmap_relation_writer(shard_name, key_width or 1)
+    else:
+        store_writer = sqlite_relation_writer(relation_dbo)
+    relation_cursor = relation_dbo.cursor().execute('select src, dst, type, from_date, thru_date, shares from relationship_load where src is not null order by src, rowid')
+    src_count = 0
+    last_src = None
+    rel_pointer_list = []
+    for relation_row in itertools.chain(relation_cursor, [(None,)]):
+        if relation_row[0] != last_src and rel_pointer_list:
+            store_writer.add(last_src, json.dumps(rel_pointer_list, separators=(',', ':')))
+            src_count += 1
+            rel_pointer_list = []
+        if relation_row[0] is None:
+            break
+        last_src = relation_row[0]
+        rel_pointer_list.append(map_rel_pointer(relation_row, as_of_date))
+    store_writer.close()
+    relation_dbo.cursor().execute('drop table relationship_load')
+    write_relation_db_info(relation_dbo, as_of_date, shard_count, backend)
+    relation_dbo.cursor().execute('commit')
+    relation_dbo.cursor().execute('vacuum')
+    return src_count
+
+#----------------------------------------
+def write_relation_db_info(relation_dbo, as_of_date, shard_count, backend):
+    relation_dbo.cursor().execute('create table finished (schema_version integer, as_of_date text, shard_count integer, backend text)')
+    relation_dbo.cursor().execute('insert into finished values (?, ?, ?, ?)', (relation_db_version, as_of_date.strftime('%Y-%m-%d'), shard_count, backend))
+
+#----------------------------------------
+def load_relationships(relationdb_name, relationship_file_list, as_of_date, shard_count=1, workers=1, backend='sqlite'):
+
+    #--clear out any shards, index files and spill files left from a prior build
+    root_name, file_extension = os.path.splitext(relationdb_name)
+    for file_name in glob.glob(f'{glob.escape(root_name)}-*-of-*') + [root_name + '.idx', root_name + '.dat', relationdb_name]:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+    if monitor:
+        monitor.start_phase('load_relationships', relationship_file_list)
+    if shard_count > 1:
+        load_relationship_shards(relationdb_name, relationship_file_list, as_of_date, shard_count, workers, backend)
+        return
+
+    print(f'\nLoading {len(relationship_file_list)} relationship files ...\n')
+    relation_dbo = create_relation_db(relationdb_name)
+    for relationship_file_name in relationship_file_list:
+        print(relationship_file_name, '...', end='', flush=True)
+        timer_start = time.time()
+        row_count = 0
+        for row_chunk in read_relationship_file(relationship_file_name):
+            stage_relationship_rows(relation_dbo, row_chunk)
+            row_count += len(row_chunk)
+
+        elapsed_secs = time.time() - timer_start
+        print(f' {row_count} rows completed in {round(elapsed_secs / 60, 1)} minutes, {int(row_count / elapsed_secs) if elapsed_secs else row_count} rows per second')
+
+        #display_process_stats(main_pid, 'after loading this file')
+        if shut_down:
+            break
+
+    if not shut_down:
+        print(f'\ncomputing relationships as of {as_of_date.strftime("%Y-%m-%d")} ...', end='', flush = True)
+        timer_start = time.time()
+        finish_relation_db(relation_dbo, relationdb_name, as_of_date, 1, backend)
+        print(f' completed in {round((time.time() - timer_start) / 60, 1)} minutes')
+
+    relation_dbo.close()
+
+#----------------------------------------
+def load_relationship_shards(relationdb_name, relationship_file_list, as_of_date, shard_count, workers, backend):
+    #--first every file is split by a hash of src into one spill file per shard, then every shard is built from its spill files,
+    #--both steps by a pool of processes so the load scales with cores rather than running one file at a time
+    shard_name_list = relation_shard_names(relationdb_name, shard_count)
+    process_pool = multiprocessing.get_context('fork').Pool(max(workers, 1))
+
+    print(f'\nSplitting {len(relationship_file_list)} relationship files into {shard_count} shards with {max(workers, 1)} worker processes ...\n')
+    split_task_list = [(relationship_file_name, file_number, shard_name_list) for file_number, relationship_file_name in enumerate(relationship_file_list)]
+    for split_results in process_pool.imap_unordered(split_relationship_file_worker, split_task_list):
+        row_count, elapsed_secs = split_results['row_count'], split_results['elapsed_secs']
+        print(f'{split_results["file_name"]} ... {row_count} rows completed in {round(elapsed_secs / 60, 1)} minutes, {int(row_count / elapsed_secs) if elapsed_secs else row_count} rows per second')
+
+    if not shut_down:
+        print(f'\ncomputing relationships as of {as_of_date.strftime("%Y-%m-%d")} ...\n')
+        if monitor:
+            monitor.start_phase('build_relationships', [f'{shard_name}.{file_number}.csv' for shard_name in shard_name_list for file_number in range(len(relationship_file_list))])
+        build_task_list = [(shard_name, len(relationship_file_list), as_of_date, shard_count, backend) for shard_name in shard_name_list]
+        for build_results in process_pool.imap_unordered(build_relation_shard_worker, build_task_list):
+            print(f'{build_results["shard_name"]} {build_results["src_count"]} entities completed in {round(build_results["elapsed_secs"] / 60, 1)} minutes')
+
+    process_pool.close()
+    process_pool.join()
+
+    #--the main database only records how it was built, it is written last so an interrupted build is never mistaken for a finished one
+    if not shut_down:
+        relation_dbo = sqlite3.connect(relationdb_name, isolation_level=None)
+        write_relation_db_info(relation_dbo, as_of_date, shard_count, backend)
+        relation_dbo.close()
+
+#----------------------------------------
+def split_relationship_file_worker(split_task):
+    relationship_file_name, file_number, shard_name_list = split_task
+    timer_start = time.time()
+    shard_count = len(shard_name_list)
+    spill_file_handles = [open(f'{shard_name}.{file_number}.csv', 'w', encoding='utf-8', newline='') for shard_name in shard_name_list]
+    spill_file_writers = [csv.writer(spill_file_handle) for spill_file_handle in spill_file_handles]
+    row_count = 0
+    for row_chunk in read_relationship_file(relationship_file_name):
+        shard_row_lists = [[] for i in range(shard_count)]
+        for row in row_chunk:
+            shard_row_lists[relation_shard(row[0] or '', shard_count)].append(row)
+        for spill_file_writer, shard_row_list in zip(spill_file_writers, shard_row_lists):
+            spill_file_writer.writerows(shard_row_list)
+        row_count += len(row_chunk)
+    for spill_file_handle in spill_file_handles:
+        spill_file_handle.close()
+    return {'file_name': relationship_file_name, 'row_count': row_count, 'elapsed_secs': time.time() - timer_start}
+
+#----------------------------------------
+def build_relation_shard_worker(build_task):
+    shard_name, file_count, as_of_date, shard_count, backend = build_task
+    timer_start = time.time()
+    relation_dbo = create_relation_db(shard_name)
+
+    #--spill files are staged in file order so each src keeps its edges in the same order as an unsharded load
+    for file_number in range(file_count):
+        spill_file_name = f'{shard_name}.{file_number}.csv'
+        with open(spill_file_name, 'r', encoding='utf-8', newline='') as spill_file_handle:
+            csv_reader = csv.reader(spill_file_handle)
+            row_count = 0
+            report_progress(spill_file_name, 0, row_count)
+            while True:
+                row_chunk = [[value if value != '' else None for value in row] for row in itertools.islice(csv_reader, 100000)]
+                if not row_chunk:
+                    break
+                stage_relationship_rows(relation_dbo, row_chunk)
+                row_count += len(row_chunk)
+                report_progress(spill_file_name, get_file_position(spill_file_handle), row_count)
+        report_progress(spill_file_name, None, row_count, finished=True)
+        os.remove(spill_file_name)
+        if shut_down:
+            break
+
+    src_count = 0
+    if not shut_down:
+        src_count = finish_relation_db(relation_dbo, shard_name, as_of_date, shard_count, backend)
+    relation_dbo.close()
+
+    #--the mmap index holds everything, the shard database was only needed to sort the edges
+    if backend == 'mmap':
+        for file_name in (shard_name, shard_name + '-wal', shard_name + '-shm'):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+    return {'shard_name': shard_name, 'src_count': src_count, 'elapsed_secs': time.time() - timer_start}
+
+
+# -----------------------------------
+def remove_json_nulls (d):
+    if isinstance(d, dict):
+        for k, v in list(d.items()):
+            if v is None:
+                del d[k]
+            elif type(v) == str and v.upper() == 'NULL':
+                del d[k]
+            else:
+                remove_json_nulls(v)
+    if isinstance(d, list):
+        for v in d:
+            remove_json_nulls(v)
+    return d
+
+# --------------------------------------
+def sql_exec(dbo, sql, parm_list=None):
+    try:
+        exec_cursor = dbo.cursor()
+        if parm_list:
+            if type(parm_list) not in (list, tuple):
+                parm_list = [parm_list]
+            exec_cursor.execute(sql, parm_list)
+        else:
+            exec_cursor.execute(sql)
+    except Exception as err:
+        print(f'\nSQL ERROR:\n{sql}\n{err}\n')
+        raise Exception(err)
+
+    cursor_data = {}
+    if exec_cursor:
+        cursor_data['SQL'] = sql
+        cursor_data['CURSOR'] = exec_cursor
+        cursor_data['ROWS_AFFECTED'] = exec_cursor.rowcount
+        if exec_cursor.description:
+            cursor_data['FIELD_LIST'] = [field_data[0] for field_data in exec_cursor.description]
+    return cursor_data
+
+# --------------------------------------
+def sql_fetch_next(cursor_data):
+    row = cursor_data['CURSOR'].fetchone()
+    if row:
+        type_fixed_row = tuple([el.decode('utf-8') if type(el) is bytearray else el for el in row])
+        return dict(list(zip(cursor_data['FIELD_LIST'], type_fixed_row)))
+
+# --------------------------------------
+def sql_fetch_all(cursor_data):
+    ''' fetch all the rows with column names '''
+    row_list = []
+    for row in cursor_data['CURSOR'].fetchall():
+        type_fixed_row = tuple([el.decode('utf-8') if type(el) is bytearray else el for el in row])
+        row_dict = dict(list(zip(cursor_data['FIELD_LIST'], type_fixed_row)))
+        row_list.append(row_dict)
+    return row_list
+
+#----------------------------------------
+def signal_handler(signal, frame):
+    print('USER INTERUPT! Shutting down ... (please wait)')
+    global shut_down
+    shut_down = True
+    return
+
+#----------------------------------------
+def display_process_stats(pid, note):
+    print(f'\n{note} memory used: {round(pid.memory_info().rss /1024 /1024 /1024.0,2)}gb\n')  # in bytes 
+
+#----------------------------------------
+def get_output_file_name(input_file_name):
+    #--entities-00000.csv.gz is mapped to entities-00000.json.gz on the output path
+    base_file_name, file_extension = os.path.splitext(input_file_name)
+    compressed_file = file_extension.upper() == '.GZ'
+    if compressed_file:
+        base_file_name, file_extension = os.path.splitext(base_file_name)
+    output_file_name = os.path.splitext(args.output_path + os.path.split(base_file_name)[1])[0] + '.json'
+    return output_file_name + '.gz' if compressed_file else output_file_name
+
+#----------------------------------------
+def read_checkpoint(output_file_name):
+    #--output is written to .partial files, every checkpoint records how far the input and each partial file got
+    try:
+        with open(output_file_name + '.checkpoint', 'r', encoding='utf-8') as f:
+            checkpoint_data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint_data.get('output_layout') != get_output_layout():
+        return None
+    for file_entry in checkpoint_data['output_files']:
+        if not os.path.exists(file_entry['file_name'] + '.partial') or os.path.getsize(file_entry['file_name'] + '.partial') < file_entry['byte_count']:
+            return None
+    return checkpoint_data
+
+#----------------------------------------
+def clear_output_files(output_file_name):
+    #--a file started over removes whatever an earlier run wrote for it, the shards it listed in its manifest or the one output file
+    manifest_file_name = get_manifest_file_name(output_file_name)
+    try:
+        with open(manifest_file_name, 'r', encoding='utf-8') as f:
+            old_file_list = [os.path.join(os.path.dirname(output_file_name), file_entry['file_name']) for file_entry in json.load(f)['output_files']]
+    except (OSError, ValueError, KeyError):
+        old_file_list = []
+    for old_file_name in old_file_list:
+        if os.path.exists(old_file_name):
+            os.remove(old_file_name)
+    if os.path.exists(manifest_file_name):
+        os.remove(manifest_file_name)
+    if mapper.entity_index:
+        for old_file_name in set(old_file_list + [output_file_name]):
+            mapper.entity_index.clear_file(old_file_name, 0)
+
+#----------------------------------------
+def output_file_completed(input_file_name):
+    #--a finished file has its output under its real name and no partial file left over, or its manifest when it is sharded
+    output_file_name = get_output_file_name(input_file_name)
+    if output_sharded():
+        return os.path.exists(get_manifest_file_name(output_file_name))
+    return os.path.exists(output_file_name) and not os.path.exists(output_file_name + '.partial')
+
+#----------------------------------------
+def open_entity_file(input_file_name):
+    if os.path.splitext(input_file_name)[1].upper() == '.GZ':
+        return io.TextIOWrapper(open_gzip_file(input_file_name), encoding='utf-8', errors='ignore')
+    return open(input_file_name, 'r')
+
+#----------------------------------------
+def process_entity_file(input_file_name, node_filter_list=None, chunk_pool=None):
+    print(f'\nProcessing {input_file_name} ...\n')
+    base_input_file_name = os.path.basename(input_file_name)
+    file_results = {'input_file_name': input_file_name, 'input_row_count': 0, 'output_row_count': 0, 'aborted': shut_down}
+    if shut_down: #--another worker may have been interrupted before this file was started
+        return file_results
+
+    base_file_name, file_extension = os.path.splitext(input_file_name)
+    compressed_file = file_extension.upper() == '.GZ'
+    if compressed_file:
+        base_file_name, file_extension = os.path.splitext(base_file_name)
+
+    #--with --remap the rows are read back from the row cache of the file if it is up to date
+    cache_reader = open_row_cache(input_file_name) if args.remap and not node_filter_list else None
+    if cache_reader:
+        print(f'{base_input_file_name} remapping from {cache_reader.cache_file_name}\n')
+        input_file_handle = cache_reader
+        csv_reader = None
+    else:
+        if args.remap and not node_filter_list:
+            print(f'{base_input_file_name} has no up to date row cache, reading the file\n')
+        input_file_handle = open_entity_file(input_file_name)
+        csv_reader = csv.DictReader(input_file_handle, dialect='excel')
+
+    checkpoint_data = None
+    if not node_filter_list:
+        output_file_name = get_output_file_name(input_file_name)
+        if args.resume:
+            checkpoint_data = read_checkpoint(output_file_name)
+        if checkpoint_data:
+            print(f'{base_input_file_name} resuming after {checkpoint_data["output_row_count"]} rows written, {checkpoint_data["input_row_count"]} rows processed\n')
+            #--checkpoints are only taken between entities so the next row starts a new one, the row cache skips them itself
+            if csv_reader:
+                for input_row in itertools.islice(csv_reader, checkpoint_data['input_row_count']):
+                    pass
+        if checkpoint_data:
+            for file_entry in checkpoint_data['output_files']:
+                if mapper.entity_index:
+                    mapper.entity_index.clear_file(file_entry['file_name'], file_entry['byte_count'])
+        else:
+            clear_output_files(output_file_name)
+
+    mapper.reset_relation_position()
+
+    #display_process_stats(main_pid, 'this file')
+
+    file_start_time = time.time()
+    csv_output_file_writer = None
+    if node_filter_list:
+        output_file_name = 'filtered_nodes.json'
+        output_file_handle = open(output_file_name, 'ab')
+
+        csv_output_file_name = 'filtered_nodes.csv'
+        csv_output_file_existed = os.path.exists(csv_output_file_name)
+        csv_output_file_handle = open(csv_output_file_name, 'a', encoding='utf-8')
+        csv_output_file_writer = csv.DictWriter(csv_output_file_handle, csv_reader.fieldnames or [])
+        if not csv_output_file_existed:
+            csv_output_file_writer.writeheader()
+        output_writer = block_writer(output_file_handle, output_block_size)
+    else:
+        #--anything past the last checkpoint is thrown away, a gzip file can be made of many members so a resumed one just adds more,
+        #--every block is a whole gzip member so the blocks can be compressed in parallel and read back on their own, small ones when they are indexed
+        output_writer = sharded_output_writer(output_file_name, entity_index_block_size if mapper.entity_index else output_block_size, args.compress_level if compressed_file else None,
+                                              args.io_threads, checkpoint_data['output_files'] if checkpoint_data else None)
+
+    #--the rows are read and grouped into entities a few batches ahead on a thread of their own, then mapped here and streamed
+    #--to the writer, when splitting the file each batch is a chunk mapped by the pool and written back in input order
+    input_row_count = checkpoint_data['input_row_count'] if checkpoint_data else 0
+    output_row_count = checkpoint_data['output_row_count'] if checkpoint_data else 0
+    batch_size = args.chunk_size if chunk_pool else args.relation_batch_size
+    row_cache = None
+    if cache_reader:
+        entity_batches = read_cached_entity_batches(cache_reader, input_row_count, batch_size)
+    else:
+        #--the rows of a whole file are kept for a later --remap as they are read
+        if args.row_cache and not node_filter_list and not checkpoint_data:
+            row_cache = row_cache_writer(get_row_cache_file_name(input_file_name), input_file_name, csv_reader.fieldnames or [])
+        entity_batches = read_entity_batches(csv_reader, input_row_count, batch_size, node_filter_list, csv_output_file_writer, row_cache)
+    if args.io_threads > 0:
+        entity_batches = background_iterator(entity_batches)
+    pending_chunks = collections.deque()
+
+    batch_start_time = time.time()
+    written_input_row_count = input_row_count #--input rows whose entities have been mapped and sent to the writer
+    reported_row_count = output_row_count
+    report_progress(input_file_name, get_file_position(input_file_handle), written_input_row_count, output_row_count)
+    progress_time = time.time()
+    file_finished = False
+    while not file_finished:
+        timer_start = time.perf_counter()
+        entity_list, input_row_count = next(entity_batches, (None, input_row_count))
+        mapper.stage_times.add('read_wait', time.perf_counter() - timer_start)
+        file_finished = entity_list is None
+
+        if entity_list and chunk_pool:
+            pending_chunks.append((chunk_pool.apply_async(map_entity_chunk_worker, (entity_list,)), input_row_count))
+        elif entity_list:
+            output_records = get_output_records(mapper.map_batch(entity_list))
+            timer_start = time.perf_counter()
+            output_writer.add_records(output_records)
+            mapper.stage_times.add('write', time.perf_counter() - timer_start, len(output_records))
+            output_row_count += len(output_records)
+        if not pending_chunks:
+            written_input_row_count = input_row_count
+
+        while pending_chunks and (len(pending_chunks) > args.workers * 2 or pending_chunks[0][0].ready() or file_finished or shut_down):
+            chunk_result, written_input_row_count = pending_chunks.popleft()
+            output_records, worker_results, entity_hash_updates = chunk_result.get()
+            mapper.merge_worker_results(worker_results)
+            mapper.entity_hash_updates.extend(entity_hash_updates)
+            timer_start = time.perf_counter()
+            output_writer.add_records(output_records)
+            mapper.stage_times.add('write', time.perf_counter() - timer_start, len(output_records))
+            output_row_count += len(output_records)
+
+        if monitor and time.time() - progress_time >= progress_report_secs:
+            report_progress(input_file_name, get_file_position(input_file_handle), written_input_row_count, output_row_count)
+            progress_time = time.time()
+
+        if output_row_count - reported_row_count >= 100000 or file_finished or shut_down:
+            timer_start = time.perf_counter()
+            if node_filter_list:
+                output_writer.flush()
+
+            elif not file_finished:
+                #--record where the next run would pick up once everything before it is on disk, blocks indexed past a checkpoint
+                #--are cleared when the file is resumed, the hashes are saved first so no entity a resume skips goes unseen in this
+                #--snapshot, saving them early hides nothing as changes are found against the base hashes of the last completed one
+                for written_file_name, written_block_list in output_writer.flush():
+                    if mapper.entity_index:
+                        mapper.entity_index.save_blocks(written_file_name, written_block_list)
+                mapper.save_entity_hashes()
+                checkpoint_data = {'input_file_name': input_file_name,
+                                   'input_row_count': written_input_row_count,
+                                   'output_row_count': output_row_count,
+                                   'output_layout': get_output_layout(),
+                                   'output_files': output_writer.get_checkpoint_files()}
+                replace_file(output_file_name + '.checkpoint', json.dumps(checkpoint_data))
+            mapper.stage_times.add('checkpoint', time.perf_counter() - timer_start)
+
+            if mapper.new_code_indexes:
+                extra_info = f'\tWARNING: {mapper.unmapped_code_count} unmapped sayari codes!'
+            else:
+                extra_info = ''
+
+            elapsed_mins = round((time.time() - batch_start_time) / 60, 1)
+            print(f'{base_input_file_name} {output_row_count} rows written, {input_row_count} rows processed in {elapsed_mins} minutes {mapper.stage_times.get_progress_text()} {extra_info}')
+
+            batch_start_time = time.time()
+            reported_row_count = output_row_count
+
+        if shut_down:
+            break
+
+    if args.io_threads > 0:
+        entity_batches.close()
+    input_file_handle.close()
+    if row_cache:
+        row_cache.close(file_finished)
+    written_file_blocks = output_writer.close()
+    if node_filter_list:
+        output_file_handle.close()
+        csv_output_file_handle.close()
+
+    #--only a finished file gets its real name, an interrupted one keeps its partial files and checkpoint for --resume
+    elif file_finished:
+        for written_file_name, written_block_list in written_file_blocks:
+            if mapper.entity_index:
+                mapper.entity_index.save_blocks(written_file_name, written_block_list)
+        mapper.save_entity_hashes()
+        output_writer.finish()
+        if os.path.exists(output_file_name + '.checkpoint'):
+            os.remove(output_file_name + '.checkpoint')
+    report_progress(input_file_name, None, written_input_row_count, output_row_count, file_finished)
+
+    file_results['input_row_count'] = input_row_count
+    file_results['output_row_count'] = output_row_count
+    file_results['elapsed_mins'] = round((time.time() - file_start_time) / 60, 1)
+    file_results['aborted'] = shut_down
+    return file_results
+
+#----------------------------------------
+def read_entity_batches(csv_reader, input_row_count, batch_size, node_filter_list=None, csv_output_file_writer=None, row_cache=None):
+    #--groups the rows of each entity and yields them in batches, each with the number of input rows read up to the end of it
+    entity_list = []
+    input_rows = []
+    timer_start = time.perf_counter()
+    batch_start_row_count = input_row_count
+    for input_row in itertools.chain(csv_reader, [None]):
+        if input_rows and (input_row is None or input_row['entity_id'] != input_rows[0]['entity_id']):
+            if row_cache:
+                row_cache.add_entity(input_rows)
+            if node_filter_list and input_rows[0]['entity_id'] not in node_filter_list:
+                pass
+            else:
+                if node_filter_list: #--just special code to capture a list of the raw records 
+                    for temp_row in input_rows:
+                        csv_output_file_writer.writerow(temp_row)
+                entity_list.append(input_rows)
+            input_rows = []
+            if len(entity_list) >= batch_size:
+                mapper.stage_times.add('read', time.perf_counter() - timer_start, input_row_count - batch_start_row_count)
+                yield entity_list, input_row_count
+                entity_list = []
+                timer_start = time.perf_counter()
+                batch_start_row_count = input_row_count
+        if input_row is None:
+            break
+
+        #--there can be multiple rows for the same entity
+        input_row_count += 1
+        input_rows.append(input_row)
+        if args.debug:
+            print()
+            print(json.dumps(input_row, indent=4))
+
+    mapper.stage_times.add('read', time.perf_counter() - timer_start, input_row_count - batch_start_row_count)
+    yield entity_list, input_row_count
+
+#----------------------------------------
+def read_cached_entity_batches(cache_reader, input_row_count, batch_size):
+    #--the same batches from a row cache, the entities before a checkpoint are skipped
+    entity_list = []
+    cached_row_count = 0
+    timer_start = time.perf_counter()
+    batch_start_row_count = input_row_count
+    for input_rows in cache_reader.read_entities():
+        cached_row_count += len(input_rows)
+        if cached_row_count <= input_row_count:
+            continue
+        entity_list.append(input_rows)
+        if len(entity_list) >= batch_size:
+            mapper.stage_times.add('read', time.perf_counter() - timer_start, cached_row_count - batch_start_row_count)
+            yield entity_list, cached_row_count
+            entity_list = []
+            timer_start = time.perf_counter()
+            batch_start_row_count = cached_row_count
+    input_row_count = max(cached_row_count, input_row_count)
+    mapper.stage_times.add('read', time.perf_counter() - timer_start, input_row_count - batch_start_row_count)
+    yield entity_list, input_row_count
+
+#----------------------------------------
+def group_entity_files(entity_file_list, sort_path, sort_mb, workers):
+    #--every row of an entity must be next to the others or it is mapped as more than one partial record, the sayari files are normally
+    #--sorted by entity_id so they are only checked, but if any are not or an entity is split across files they are all sorted into new
+    #--files of whole entities on the sort path, each file is sorted in runs that fit in memory by the pool and the runs are merged
+    grouping_file_name = os.path.join(sort_path, 'grouping.json')
+    grouping_signature = [[os.path.abspath(input_file_name), os.path.getsize(input_file_name), int(os.path.getmtime(input_file_name))] for input_file_name in entity_file_list]
+    try:
+        with open(grouping_file_name, 'r', encoding='utf-8') as f:
+            grouping_data = json.load(f)
+        if grouping_data['input_files'] == grouping_signature and all(os.path.exists(file_name) for file_name in grouping_data['entity_files']):
+            print(f'\nThe entity files were already {"checked" if grouping_data["grouped"] else "sorted"} by an earlier run')
+            return grouping_data['entity_files']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if not os.path.isdir(sort_path):
+        os.makedirs(sort_path)
+    timer_start = time.time()
+    process_pool = multiprocessing.get_context('fork').Pool(max(workers, 1))
+    print(f'\nChecking that the rows of each entity are together in {len(entity_file_list)} entity files with {max(workers, 1)} worker processes ...\n')
+    scan_results_list = []
+    for scan_results in process_pool.imap(scan_entity_file_worker, entity_file_list):
+        print(f'{os.path.basename(scan_results["file_name"])} {scan_results["row_count"]} rows, {scan_results["out_of_order_count"]} out of order')
+        scan_results_list.append(scan_results)
+
+    #--files that are each in order can still split an entity or overlap with each other
+    scan_results_list = sorted([scan_results for scan_results in scan_results_list if scan_results['row_count']], key=lambda scan_results: scan_results['first_entity_id'])
+    out_of_order_count = sum(scan_results['out_of_order_count'] for scan_results in scan_results_list)
+    overlap_count = sum(1 for prior_results, scan_results in zip(scan_results_list, scan_results_list[1:]) if scan_results['first_entity_id'] <= prior_results['last_entity_id'])
+    grouped_file_list = entity_file_list
+    if not out_of_order_count and not overlap_count:
+        print(f'\nThe rows of every entity are together, checked in {round((time.time() - timer_start) / 60, 1)} minutes')
+
+    elif not shut_down:
+        print(f'\n{out_of_order_count} rows are out of order and {overlap_count} files overlap the next, sorting them into {sort_path} ...\n')
+        for file_name in glob.glob(os.path.join(glob.escape(sort_path), 'run-*.csv.gz')):
+            os.remove(file_name)
+
+        #--the runs are kept in input order so the rows of an entity stay in the order they were read
+        sort_task_list = [(input_file_name, file_number, sort_path, sort_mb * 1048576 // max(workers, 1)) for file_number, input_file_name in enumerate(entity_file_list)]
+        sort_results_list = []
+        for sort_results in process_pool.imap(sort_entity_file_worker, sort_task_list):
+            print(f'{os.path.basename(sort_results["file_name"])} {sort_results["row_count"]} rows sorted into {len(sort_results["run_file_list"])} runs')
+            sort_results_list.append(sort_results)
+        run_file_list = [run_file_name for sort_results in sort_results_list for run_file_name in sort_results['run_file_list']]
+        field_name_list = list(dict.fromkeys(field_name for sort_results in sort_results_list for field_name in sort_results['field_name_list']))
+
+        if not shut_down:
+            grouped_file_list = [os.path.join(sort_path, os.path.basename(input_file_name)) for input_file_name in entity_file_list]
+            merge_sorted_runs(run_file_list, field_name_list, grouped_file_list, [sort_results['row_count'] for sort_results in sort_results_list])
+        if not shut_down:
+            print(f'\n{len(grouped_file_list)} sorted entity files written in {round((time.time() - timer_start) / 60, 1)} minutes')
+
+    process_pool.close()
+    process_pool.join()
+    if shut_down:
+        return None
+
+    grouping_data = {'input_files': grouping_signature, 'grouped': grouped_file_list is entity_file_list, 'entity_files': grouped_file_list}
+    replace_file(grouping_file_name, json.dumps(grouping_data, indent=4))
+    return grouped_file_list
+
+#----------------------------------------
+def scan_entity_file_worker(input_file_name):
+    #--only the entity ids are looked at, they are in order if none of them goes backwards
+    input_file_handle = open_entity_file(input_file_name)
+    csv_reader = csv.reader(input_file_handle)
+    scan_results = {'file_name': input_file_name, 'row_count': 0, 'out_of_order_count': 0, 'first_entity_id': None, 'last_entity_id': None}
+    entity_id_index = next(csv_reader, ['entity_id']).index('entity_id')
+    last_entity_id = None
+    for row in csv_reader:
+        entity_id = row[entity_id_index]
+        if last_entity_id is None:
+            scan_results['first_entity_id'] = scan_results['last_entity_id'] = entity_id
+        elif entity_id < last_entity_id:
+            scan_results['out_of_order_count'] += 1
+        scan_results['first_entity_id'] = min(scan_results['first_entity_id'], entity_id)
+        scan_results['last_entity_id'] = max(scan_results['last_entity_id'], entity_id)
+        last_entity_id = entity_id
+        scan_results['row_count'] += 1
+        if shut_down:
+            break
+    input_file_handle.close()
+    return scan_results
+
+#----------------------------------------
+def sort_entity_file_worker(sort_task):
+    #--rows are held until they reach this worker's share of the sort memory, then sorted by entity_id and i and spilled to a run file
+    input_file_name, file_number, sort_path, memory_bytes = sort_task
+    input_file_handle = open_entity_file(input_file_name)
+    csv_reader = csv.reader(input_file_handle)
+    field_name_list = next(csv_reader, [])
+    sort_key = get_row_sort_key(field_name_list)
+    sort_results = {'file_name': input_file_name, 'row_count': 0, 'field_name_list': field_name_list, 'run_file_list': []}
+    row_list = []
+    row_bytes = 0
+    for row in itertools.chain(csv_reader, [None]):
+        if row is not None:
+            row_list.append(row)
+            row_bytes += sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+            sort_results['row_count'] += 1
+        if row_list and (row is None or row_bytes >= memory_bytes):
+            row_list.sort(key=sort_key) #--the rows of each entity in sayari's order, the zero row first as it carries the type and degree
+            run_file_name = os.path.join(sort_path, f'run-{file_number:05d}-{len(sort_results["run_file_list"]):05d}.csv.gz')
+            write_sorted_run(run_file_name, field_name_list, row_list)
+            sort_results['run_file_list'].append(run_file_name)
+            row_list = []
+            row_bytes = 0
+        if shut_down:
+            break
+    input_file_handle.close()
+    return sort_results
+
+#----------------------------------------
+def get_row_sort_key(field_name_list):
+    #--entity_id then the row number i, so every entity comes back in sayari's row order however its rows arrived
+    entity_id_index = field_name_list.index('entity_id') if 'entity_id' in field_name_list else 0
+    i_index = field_name_list.index('i') if 'i' in field_name_list else None
+    if i_index is None:
+        return lambda row: (row[entity_id_index], 0, 0, '')
+
+    #--an i that is not a number is kept and sorted as text after the numbered rows of its entity
+    def row_sort_key(row):
+        try: return (row[entity_id_index], 0, int(row[i_index] or 0), '')
+        except ValueError:
+            return (row[entity_id_index], 1, 0, row[i_index])
+    return row_sort_key
+
+#----------------------------------------
+def write_sorted_run(run_file_name, field_name_list, row_iterator):
+    #--runs are only read back once so they are compressed for speed
+    with gzip.open(run_file_name, 'wt', compresslevel=1, encoding='utf-8', newline='') as run_file_handle:
+        csv_writer = csv.writer(run_file_handle)
+        csv_writer.writerow(field_name_list)
+        csv_writer.writerows(row_iterator)
+
+#----------------------------------------
+def read_sorted_run(run_file_name, field_name_list):
+    #--rows come back in the columns of the merged files, whatever the columns of the file they were sorted from
+    with gzip.open(run_file_name, 'rt', encoding='utf-8', newline='') as run_file_handle:
+        csv_reader = csv.reader(run_file_handle)
+        run_field_name_list = next(csv_reader, None)
+        if run_field_name_list is None: #--an empty or truncated run has no rows to give
+            pass
+        elif run_field_name_list == field_name_list:
+            yield from csv_reader
+        else:
+            column_list = [run_field_name_list.index(field_name) if field_name in run_field_name_list else None for field_name in field_name_list]
+            for row in csv_reader:
+                yield [row[i] if i is not None and i < len(row) else '' for i in column_list]
+    os.remove(run_file_name)
+
+#----------------------------------------
+def merge_sorted_runs(run_file_list, field_name_list, grouped_file_list, row_count_list):
+    #--only so many runs are merged at once to bound the open files and read buffers, each merge keeps the runs in entity_id and i
+    #--order, then the last merge is cut into files of about as many rows as each input file had, at an entity boundary
+    entity_id_index = field_name_list.index('entity_id')
+    sort_key = get_row_sort_key(field_name_list)
+    merge_pass = 0
+    while len(run_file_list) > sort_merge_width and not shut_down:
+        merge_pass += 1
+        merged_run_file_list = []
+        for i in range(0, len(run_file_list), sort_merge_width):
+            merged_run_file_name = os.path.join(os.path.dirname(run_file_list[0]), f'run-m{merge_pass:02d}-{len(merged_run_file_list):05d}.csv.gz')
+            row_iterator = heapq.merge(*[read_sorted_run(run_file_name, field_name_list) for run_file_name in run_file_list[i: i + sort_merge_width]], key=sort_key)
+            write_sorted_run(merged_run_file_name, field_name_list, row_iterator)
+            merged_run_file_list.append(merged_run_file_name)
+        print(f'{len(run_file_list)} runs merged into {len(merged_run_file_list)}')
+        run_file_list = merged_run_file_list
+
+    row_iterator = heapq.merge(*[read_sorted_run(run_file_name, field_name_list) for run_file_name in run_file_list], key=sort_key)
+    row_iterator = itertools.chain(row_iterator, [None])
+    for file_number, grouped_file_name in enumerate(grouped_file_list):
+        if grouped_file_name.upper().endswith('.GZ'):
+            grouped_file_handle = gzip.open(grouped_file_name + '.partial', 'wt', compresslevel=1, encoding='utf-8', newline='')
+        else:
+            grouped_file_handle = open(grouped_file_name + '.partial', 'w', encoding='utf-8', newline='')
+        csv_writer = csv.writer(grouped_file_handle)
+        csv_writer.writerow(field_name_list)
+        row_count = 0
+        last_file = file_number == len(grouped_file_list) - 1
+        for row in row_iterator:
+            if row is None or shut_down:
+                break
+            csv_writer.writerow(row)
+            row_count += 1
+            last_entity_id = row[entity_id_index]
+            if row_count >= row_count_list[file_number] and not last_file:
+                #--the rest of this entity goes in too
+                row = next(row_iterator)
+                while row is not None and row[entity_id_index] == last_entity_id:
+                    csv_writer.writerow(row)
+                    row_count += 1
+                    row = next(row_iterator)
+                row_iterator = itertools.chain([row], row_iterator)
+                break
+        grouped_file_handle.close()
+        print(f'{os.path.basename(grouped_file_name)} {row_count} rows written')
+    if not shut_down:
+        for grouped_file_name in grouped_file_list:
+            os.replace(grouped_file_name + '.partial', grouped_file_name)
+
+#----------------------------------------
+def save_deleted_entities(output_file_name, snapshot_file_list):
+    #--entities in the last snapshot that are not in this one get a delete record, then this snapshot becomes the one to compare to
+    deleted_count = 0
+    with open(output_file_name + '.partial', 'wb') as output_file_handle:
+        for entity_id in mapper.hash_index.get_deleted_entity_ids():
+            output_file_handle.write(mapper.codec.encode_record({'DATA_SOURCE': 'SAYARI', 'RECORD_ID': entity_id, 'DSRC_ACTION': 'D'}) + b'\n')
+            deleted_count += 1
+    if deleted_count:
+        os.replace(output_file_name + '.partial', output_file_name)
+    else:
+        os.remove(output_file_name + '.partial')
+    mapper.hash_index.complete_snapshot(snapshot_file_list)
+    return deleted_count
+
+#----------------------------------------
+def extract_indexed_entities(entity_index_name, node_filter_list):
+    #--only the blocks holding the requested entities are read and decompressed rather than every entity file end to end
+    timer_start = time.time()
+    entity_index = entity_locator_index(entity_index_name)
+    entity_blocks = entity_index.get_blocks(sorted(node_filter_list))
+    entity_index.close()
+    print(f'\nExtracting {len(node_filter_list)} nodes from {len(entity_blocks)} blocks in {len(set(block_key[0] for block_key in entity_blocks))} files ...\n')
+
+    codec = json_codec()
+    found_count = 0
+    with open('filtered_nodes.json', 'ab') as output_file_handle:
+        for file_name, block_key_list in itertools.groupby(sorted(entity_blocks), key=lambda block_key: block_key[0]):
+            try: input_file_handle = open(file_name, 'rb')
+            except OSError as err:
+                print(f'WARNING: {err}')
+                continue
+            for block_key in block_key_list:
+                input_file_handle.seek(block_key[1])
+                block_data = input_file_handle.read(block_key[2])
+                if file_name.upper().endswith('.GZ'):
+                    block_data = gzip.decompress(block_data)
+                for output_line in block_data.splitlines():
+                    if codec.decode(output_line)['RECORD_ID'] in entity_blocks[block_key]:
+                        output_file_handle.write(output_line + b'\n')
+                        found_count += 1
+            input_file_handle.close()
+
+    print(f'{found_count} nodes written to filtered_nodes.json in {round(time.time() - timer_start, 1)} seconds')
+    if found_count < len(node_filter_list):
+        print(f'{len(node_filter_list) - found_count} nodes were not found in {entity_index_name}')
+    print()
+    return 0
+
+#----------------------------------------
+def init_entity_worker(relationdb_name, hash_db_name, entity_index_name):
+    #--each worker gets its own read-only connection, sqlite handles must not cross a fork
+    mapper.open_relation_db(relationdb_name)
+    mapper.open_hash_index(hash_db_name)
+    mapper.open_entity_index(entity_index_name)
+
+#----------------------------------------
+def map_entity_chunk_worker(entity_chunk):
+    #--a worker keeps one profiler for all the chunks it maps, saved after each one as there is no telling which is its last
+    if args.profile:
+        if not worker_profiler:
+            worker_profiler.append(cProfile.Profile())
+        worker_profiler[0].enable()
+    try:
+        mapper.reset_relation_position()
+        output_records = get_output_records(mapper.map_batch(entity_chunk))
+    finally:
+        if args.profile:
+            worker_profiler[0].disable()
+            worker_profiler[0].dump_stats(get_profile_file_name(f'worker-{os.getpid()}'))
+    entity_hash_updates = mapper.entity_hash_updates
+    mapper.entity_hash_updates = []
+    return output_records, mapper.collect_worker_results(), entity_hash_updates
+
+#----------------------------------------
+def map_entity_file_worker(input_file_name):
+    try: 
+        file_results = run_profiled(input_file_name, process_entity_file, input_file_name)
+    except Exception as err:
+        print(f'\nERROR: {input_file_name} failed\n{traceback.format_exc()}')
+        file_results = {'input_file_name': input_file_name, 'input_row_count': 0, 'output_row_count': 0, 'aborted': True, 'error': str(err)}
+    file_results.update(mapper.collect_worker_results())
+    return file_results
+
+#----------------------------------------
+def get_profile_file_name(profile_name):
+    return os.path.join(args.output_path, 'profiles', os.path.basename(profile_name) + '.prof')
+
+#----------------------------------------
+def run_profiled(profile_name, function, *function_args):
+    #--with --profile the call is run under cProfile and its stats saved even if it fails, for pstats or snakeviz to read
+    if not args.profile:
+        return function(*function_args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *function_args)
+    finally:
+        profiler.dump_stats(get_profile_file_name(profile_name))
+
+#----------------------------------------
+def get_argument_parser():
+    #--also used to set up the mapper's arguments outside of a run, such as by sayari_benchmark.py
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input_path', help='the directory that contains the Sayari files')
+    parser.add_argument('-o', '--output_path', help='the directory to write the mapped json files to')
+    parser.add_argument('-r', '--relationdb_name', help='the relationship db file to build or use')
+    parser.add_argument('-l', '--log_file', help='optional name of the statistics log file')
+    parser.add_argument('-x', '--extended_format', action='store_true', default=False, help='map all the fields including finances and other information')
+    parser.add_argument('-D', '--debug', action='store_true', default=False, help='run in debug mode')
+    parser.add_argument('-U', '--unattended', action='store_true', default=False, help='dont ask questions')
+    parser.add_argument('-f', '--filter_file', help='optional name of a file containing a list of nodes')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes to map the entity files with, defaults to 1')
+    parser.add_argument('-S', '--split_files', action='store_true', default=False, help='split each entity file into chunks that all the workers map together')
+    parser.add_argument('--chunk_size', type=int, default=10000, help='number of entities per chunk when splitting files, defaults to 10000')
+    parser.add_argument('--relation_batch_size', type=int, default=1000, help='number of entities to look up relationships for at once, defaults to 1000')
+    parser.add_argument('-a', '--as_of_date', help='date the relationship thru dates are compared to when loading relationships, defaults to today (YYYY-MM-DD)')
+    parser.add_argument('-j', '--merge_join', action='store_true', default=False, help='attach relationships by merging sorted entity files with relationships sorted by src')
+    parser.add_argument('--relation_shards', type=int, help='number of relationship databases to split the relationships into and build in parallel, defaults to 1')
+    parser.add_argument('--delta_path', help='write the new codes and statistics to a delta file on this directory instead of sayari_codes.csv and the log file')
+    parser.add_argument('--merge_deltas', metavar='DELTA_PATH', help='merge the delta files on this directory into sayari_codes.csv and the log file, then exit')
+    parser.add_argument('--stats', choices=['off', 'basic', 'full'], help='statistics to collect, basic is counts only and full adds examples, defaults to full with a log file and off without')
+    parser.add_argument('--raw_utf8', action='store_true', default=False, help='write compact json with non-latin characters as utf-8 rather than \\u escapes')
+    parser.add_argument('--relation_backend', choices=relation_backend_list, help='how the relationships are stored, a sqlite database or a memory mapped sorted index, defaults to sqlite')
+    parser.add_argument('--resume', action='store_true', default=False, help='skip the entity files already mapped and continue interrupted ones from their last checkpoint')
+    parser.add_argument('--compress_level', type=int, default=9, choices=range(10), metavar='{0-9}', help='gzip compression level of the output files, 1 is fastest and 9 is smallest, defaults to 9')
+    parser.add_argument('--io_threads', type=int, default=2, help='threads per process to compress output blocks in parallel, more read and write alongside the mapping, 0 does it all on the main thread, defaults to 2')
+    parser.add_argument('--partition_count', type=int, default=1, help='split the records of each entity file into this many output files by a hash of their record id, defaults to 1')
+    parser.add_argument('--partition_by_type', action='store_true', default=False, help='split the records of each entity file into an output file per record type')
+    parser.add_argument('--roll_records', type=int, help='start a new output file after this many records')
+    parser.add_argument('--roll_mb', type=float, help='start a new output file after about this many megabytes')
+    parser.add_argument('--group_entities', action='store_true', default=False, help='check that the rows of every entity are together first and sort the entity files by entity_id if they are not')
+    parser.add_argument('--sort_path', help='directory to sort the entity files into with --group_entities, defaults to a grouped_entities directory on the output path')
+    parser.add_argument('--sort_mb', type=int, default=1024, help='megabytes of rows to sort at once with --group_entities, split among the workers, defaults to 1024')
+    parser.add_argument('--entity_index', help='database of the output block each entity is written to, built while mapping and used by -f to read just those blocks')
+    parser.add_argument('--hash_db', help='database of entity hashes from the last snapshot, only new and changed entities are written along with delete records for the ones that are gone')
+    parser.add_argument('--snapshot_files_changed', action='store_true', default=False, help='complete the snapshot and write its deletes with --hash_db even though its entity files are not the ones the last snapshot was made of')
+    parser.add_argument('--profile', action='store_true', default=False, help='run each entity file, or each worker when splitting files, under cProfile and save the stats to a profiles directory on the output path')
+    parser.add_argument('--metrics_file', help='file to keep the progress, rates, memory and eta of the run in for monitoring, in the prometheus text format if it ends in .prom and json otherwise')
+    parser.add_argument('--metrics_interval', type=int, default=30, help='seconds between updates of the metrics file, defaults to 30')
+    parser.add_argument('--row_cache', metavar='ROW_CACHE_PATH', help='directory to keep the parsed rows of each entity file in so they can be remapped quickly with --remap')
+    parser.add_argument('--remap', action='store_true', default=False, help='map the entity files from their row caches rather than reading them again, such as after sayari_codes.csv is changed')
+    return parser
+
+#----------------------------------------
+if __name__ == "__main__":
+    shut_down = False   
+    signal.signal(signal.SIGINT, signal_handler)
+    main_pid = psutil.Process(os.getpid())
+
+    args = get_argument_parser().parse_args()
+
+    if args.merge_deltas:
+        if not os.path.isdir(args.merge_deltas):
+            print('\nThe delta path is not a valid directory\n')
+            sys.exit(1)
+        args.stats = args.stats or 'full'
+        sys.exit(merge_delta_files(args.merge_deltas, 'sayari_codes.csv', args.log_file))
+
+    #--entities already mapped with an entity index are read straight from their output blocks, no input files are needed
+    indexed_extract = bool(args.filter_file and args.entity_index and os.path.exists(args.entity_index))
+    if not args.input_path and not indexed_extract:
+        print('\nPlease supply a valid input file path on the command line\n')
+        sys.exit(1)
+    if not args.output_path and not indexed_extract:
+        print('\nPlease supply a valid output file path on the command line\n') 
+        sys.exit(1)
+    if not args.relationdb_name and not indexed_extract:
+        print('\nPlease supply a valid relationship database file name on the command line\n')
+        sys.exit(1)
+    if args.as_of_date:
+        try: as_of_date = datetime.strptime(args.as_of_date, '%Y-%m-%d')
+        except ValueError:
+            print('\nPlease supply the as of date as YYYY-MM-DD\n')
+            sys.exit(1)
+    else:
+        as_of_date = datetime.combine(datetime.now().date(), datetime.min.time())
+    if args.delta_path and not os.path.isdir(args.delta_path):
+        print('\nThe delta path is not a valid directory\n')
+        sys.exit(1)
+    if not args.stats:
+        args.stats = 'full' if args.log_file or args.delta_path else 'off'
+    if args.relation_shards is not None and args.relation_shards < 1:
+        print('\nThe number of relation shards must be at least 1\n')
+        sys.exit(1)
+
+    node_filter_list = None
+    if args.filter_file:
+        try:
+            with open(args.filter_file, 'r') as f:
+                node_filter_list = {l[0:-1].strip() for l in f.readlines() if len(l) > 5}
+        except Exception as err:
+            print(f'\nfilter file error: {err}\n')
+            sys.exit(1)
+        print(f'\nFiltering for {len(node_filter_list)} nodes:\n')
+        print(json.dumps(sorted(node_filter_list), indent=4))
+        print()
+        if not args.unattended:
+            response = input('OK to proceed? (y/n) ')
+            if not response.upper().startswith('Y'):
+                print(f'\nProcess aborted!')
+                sys.exit(1)
+        if indexed_extract:
+            sys.exit(extract_indexed_entities(args.entity_index, node_filter_list))
+
+    #--validate output directory
+    if not os.path.isdir(args.output_path):
+        print('\nOutput file path is not a valid directory\n') 
+        sys.exit(1)
+    if args.output_path[-1] != os.path.sep:
+        args.output_path = args.output_path + os.path.sep
+    if args.profile:
+        os.makedirs(args.output_path + 'profiles', exist_ok=True)
+    if args.remap and not args.row_cache:
+        print('\nPlease supply the --row_cache directory to remap from\n')
+        sys.exit(1)
+    if args.remap and args.hash_db:
+        print('\nThe hash database is of the rows as read from the entity files, --hash_db cannot be used with --remap\n')
+        sys.exit(1)
+    if args.row_cache:
+        os.makedirs(args.row_cache, exist_ok=True)
+    
+    # get list of files, ajusting file spec for directory
+    if os.path.isdir(args.input_path): 
+        if args.input_path[-1] == os.path.sep:
+            input_file_list = glob.glob(args.input_path + '*')
+        else:
+            input_file_list = glob.glob(args.input_path + os.path.sep + '*')
+    else:
+        input_file_list = glob.glob(args.input_path)
+
+    # count files and confirm to proceed
+    print('\nQualifying files ...\n')
+    entity_file_list = []
+    relationship_file_list = []
+    for input_file_name in sorted(input_file_list):
+        if not os.path.splitext(input_file_name)[1].upper() in ('.CSV', '.GZ'):
+            continue
+        if 'relationships' in input_file_name:
+            print('relationship ->', input_file_name)
+            relationship_file_list.append(input_file_name)
+        elif 'entities' in input_file_name or not os.path.isdir(args.input_path):
+            print('entity ->',input_file_name)
+            entity_file_list.append(input_file_name)
+    print(f'\n{len(entity_file_list)} entity files and {len(relationship_file_list)} relationship files found\n')
+    if not entity_file_list and not relationship_file_list:
+        print(f'\nNo Sayari files found at {args.input_path}\n')
+        print('\tSayari files must end with .csv or .gz ... parquet files are not currenty supported.')
+        print('\tSayari entity files must have "entities" somewhere in the file name.')
+        print('\tSayari relationship files must have "relationships" somewhere in the file name.\n')
+        sys.exit(1)
+    if not args.unattended:
+        response = input('OK to proceed? (y/n) ')
+        if not response.upper().startswith('Y'):
+            print(f'\nProcess aborted!')
+            sys.exit(1)
+
+    #--create the mapper and warn if unmapped codes
+    mapper = mapper('sayari_codes.csv')
+    if mapper.unmapped_code_count > 0 and entity_file_list and not args.unattended:
+        print(f'\nWARNING: there are {mapper.unmapped_code_count} unmapped codes in sayari_codes.csv!!\n')
+        response = input('Do you wish to continue anyway? (y/n) ')
+        if not response.upper().startswith('Y'):
+            print('\nProcess aborted!\n')
+            sys.exit(1)
+
+    #--started before the relationships are loaded so the whole run is watched, workers forked from here on report to it
+    if args.metrics_file:
+        monitor = progress_monitor(args.metrics_file, args.metrics_interval)
+
+    #--determine if relationships need to be loaded
     load_relationships_files = True
     if os.path.exists(args.relationdb_name):
         relation_dbo = sqlite3.connect(args.relationdb_name, isolation_level=None)
         was_finished = relation_dbo.cursor().execute("select name from sqlite_master where type='table' and name='finished'").fetchone()
+        if was_finished:
+            try: schema_version, relation_as_of_date, relation_shard_count, relation_backend = relation_dbo.cursor().execute('select schema_version, as_of_date, shard_count, backend from finished').fetchone()
+            except sqlite3.OperationalError: schema_version, relation_as_of_date, relation_shard_count, relation_backend = None, None, None, None
+            if schema_version != relation_db_version:
+                print('\nThe relation database was built by an older version of this mapper and must be rebuilt')
+                was_finished = None
+            elif args.as_of_date and args.as_of_date != relation_as_of_date:
+                print(f'\nThe relation database was built as of {relation_as_of_date} and must be rebuilt as of {args.as_of_date}')
+                was_finished = None
+            elif args.relation_shards and args.relation_shards != relation_shard_count:
+                print(f'\nThe relation database was built with {relation_shard_count} shards and must be rebuilt with {args.relation_shards}')
+                was_finished = None
+            elif args.relation_backend and args.relation_backend != relation_backend:
+                print(f'\nThe relation database was built for {relation_backend} and must be rebuilt for {args.relation_backend}')
+                was_finished = None
+            elif not all(os.path.exists(file_name) for file_name in relation_store_file_names(args.relationdb_name, relation_shard_count, relation_backend)):
+                print('\nThe relation database is missing some of its files and must be rebuilt')
+                was_finished = None
+            else:
+                print(f'\nRelationships are as of {relation_as_of_date}, stored in {relation_backend}' + (f' in {relation_shard_count} shards' if relation_shard_count > 1 else ''))
         relation_dbo.close()
         if was_finished: 
             load_relationships_files = False
@@ -1044,141 +3509,144 @@ if __name__ == "__main__":
                         sys.exit(1)
 
         if args.relationdb_name:
-            load_relationships(args.relationdb_name, relationship_file_list)
+            load_relationships(args.relationdb_name, relationship_file_list, as_of_date, args.relation_shards or 1, args.workers, args.relation_backend or 'sqlite')
             if shut_down:
+                if monitor:
+                    monitor.close('aborted')
                 print(f'\nProcess aborted!')
                 sys.exit(1)
 
+    #--before any databases are opened as the grouping forks a pool of its own
+    if args.group_entities and entity_file_list:
+        entity_file_list = group_entity_files(entity_file_list, args.sort_path or args.output_path + 'grouped_entities', args.sort_mb, args.workers)
+        if shut_down:
+            if monitor:
+                monitor.close('aborted')
+            print(f'\nProcess aborted!')
+            sys.exit(1)
+
     mapper.open_relation_db(args.relationdb_name)
+    if node_filter_list:
+        args.hash_db = None
+        args.entity_index = None
+    mapper.open_hash_index(args.hash_db)
+    mapper.open_entity_index(args.entity_index)
+    if args.hash_db and mapper.hash_index.snapshot > 1:
+        print(f'\nOnly entities that changed since snapshot {mapper.hash_index.snapshot - 1} will be written')
+    elif args.hash_db:
+        print(f'\nNo earlier snapshot in {args.hash_db}, every entity will be written')
+
+    #--the whole snapshot, whatever this run skips or groups, by file name so it can be moved
+    snapshot_file_list = sorted(os.path.basename(input_file_name) for input_file_name in entity_file_list)
+
+    if args.resume and not node_filter_list:
+        completed_file_list = [input_file_name for input_file_name in entity_file_list if output_file_completed(input_file_name)]
+        if completed_file_list:
+            print(f'\nSkipping {len(completed_file_list)} entity files already mapped')
+            entity_file_list = [input_file_name for input_file_name in entity_file_list if input_file_name not in completed_file_list]
 
     proc_start_time = time.time()
     input_file_count = 0
-    for input_file_name in entity_file_list:
-        print(f'\nProcessing {input_file_name} ...\n')
-        input_file_count += 1
-        base_input_file_name = os.path.basename(input_file_name)
-
-        timer_start = time.time()
-        base_file_name, file_extension = os.path.splitext(input_file_name)
-        compressed_file = file_extension.upper() == '.GZ'
-        if compressed_file:
-            base_file_name, file_extension = os.path.splitext(base_file_name)
-
-        if compressed_file:
-            input_file_handle = gzip.open(input_file_name, 'r')
-            csv_reader = csv.DictReader(io.TextIOWrapper(io.BufferedReader(input_file_handle), encoding='utf-8', errors='ignore'))
-        else:
-            input_file_handle = open(input_file_name, 'r')
-            csv_reader = csv.DictReader(input_file_handle, dialect='excel')
-
-        #try: input_row = next(csv_reader) #--skip header row
-        #except: input_row = None
-        try: input_row = next(csv_reader) #--get first row
-        except: input_row = None
-
-        #display_process_stats(main_pid, 'this file')
-
-        file_start_time = time.time()
-        if node_filter_list:
-            output_file_name = 'filtered_nodes.json'
-            output_file_handle = open(output_file_name, 'a', encoding='utf-8')
-
-            csv_output_file_name = 'filtered_nodes.csv'
-            csv_output_file_existed = os.path.exists(csv_output_file_name)
-            csv_output_file_handle = open(csv_output_file_name, 'a', encoding='utf-8')
-            csv_output_file_writer = csv.DictWriter(csv_output_file_handle, csv_reader.fieldnames)
-            if not csv_output_file_existed:
-                csv_output_file_writer.writeheader()
-        else:
-            output_file_name = os.path.splitext(args.output_path + os.path.split(base_file_name)[1])[0] + '.json'
-            if compressed_file:
-                output_file_handle = gzip.open(output_file_name + '.gz', 'wb')
-            else:
-                output_file_handle = open(output_file_name, 'w', encoding='utf-8')
-
-        batch_start_time = time.time()
-        batch_input_list = []
-        batch_output_list = []
-
-        input_row_count = 0
-        output_row_count = 0
-        while input_row:
-
-            #--there can be multiple rows for the same entity
-            last_entity_id = input_row['entity_id']
-            input_rows = []
-            while input_row and input_row['entity_id'] == last_entity_id:
-                input_row_count += 1
-                input_rows.append(input_row)
-                if args.debug:
-                    print()
-                    print(json.dumps(input_row, indent=4))
-                try: input_row = next(csv_reader)
-                except: input_row = None
-
-            if node_filter_list and last_entity_id not in node_filter_list:
-                pass
-            else:
-                if node_filter_list: #--just special code to capture a list of the raw records 
-                    for temp_row in input_rows:
-                        csv_output_file_writer.writerow(temp_row)
-
-                batch_output_list.append(mapper.map(input_rows))
-                output_row_count += 1
-
-            if output_row_count % 100000 == 0 or not input_row:
-                if batch_output_list:
-                    if compressed_file and not node_filter_list:
-                        output_file_handle.write(('\n'.join([json.dumps(json_data) for json_data in batch_output_list]) + '\n').encode('utf-8'))
-                    else:
-                        output_file_handle.write('\n'.join([json.dumps(json_data) for json_data in batch_output_list]) + '\n')
-
-                if mapper.new_code_records:
-                    extra_info = f'\tWARNING: {mapper.unmapped_code_count} unmapped sayari codes!'
-                else:
-                    extra_info = ''
-
-                elapsed_mins = round((time.time() - batch_start_time) / 60, 1)
-                print(f'{base_input_file_name} {output_row_count} rows written, {input_row_count} rows processed in {elapsed_mins} minutes {extra_info}')
+    error_count = 0
+    total_input_rows = 0
+    total_output_rows = 0
+    process_pool = None
+    if monitor:
+        monitor.start_phase('map_entities', entity_file_list)
+    if args.workers > 1 and not node_filter_list and (args.split_files or len(entity_file_list) > 1):
+        pool_size = args.workers if args.split_files else min(args.workers, len(entity_file_list))
+        print(f'\nMapping {len(entity_file_list)} entity files with {pool_size} worker processes ...')
+        mapper.close_relation_db()
+        mapper.close_hash_index()
+        mapper.close_entity_index()
+        process_pool = multiprocessing.get_context('fork').Pool(pool_size, init_entity_worker, (args.relationdb_name, args.hash_db, args.entity_index))
+        mapper.open_hash_index(args.hash_db)
+        mapper.open_entity_index(args.entity_index)
+
+    if process_pool and not args.split_files:
+        #--hand out the biggest files first so the last ones to finish are the small ones
+        file_results_iterator = process_pool.imap_unordered(map_entity_file_worker, sorted(entity_file_list, key=os.path.getsize, reverse=True))
+    else:
+        file_results_iterator = (run_profiled(input_file_name, process_entity_file, input_file_name, node_filter_list, process_pool) for input_file_name in entity_file_list)
 
-                batch_start_time = time.time()
-                batch_input_list = []
-                batch_output_list = []
+    for file_results in file_results_iterator:
+        input_file_count += 1
+        total_input_rows += file_results['input_row_count']
+        total_output_rows += file_results['output_row_count']
+        if process_pool and not args.split_files:
+            mapper.merge_worker_results(file_results)
+        if 'error' in file_results:
+            error_count += 1
+            continue
 
-            if shut_down:
-                break
+        if file_results['aborted']:
+            if process_pool and not args.split_files: #--let the other workers wind down
+                continue
+            break
 
-        output_file_handle.close()
-        if node_filter_list:
-            csv_output_file_handle.close()
+        run_status = 'completed in %s minutes' % file_results['elapsed_mins']
+        print('\n%s %s rows written, %s rows processed, %s' % (os.path.basename(file_results['input_file_name']), file_results['output_row_count'], file_results['input_row_count'], run_status))
+        elapsed_mins = round((time.time() - proc_start_time) / 60, 1)
+        print('%s of %s files read, %s rows written, %s rows processed in %s minutes\n' % (input_file_count, len(entity_file_list), total_output_rows, total_input_rows, elapsed_mins))
+
+    if process_pool:
+        process_pool.close()
+        process_pool.join()
+
+    #--entities can only be known to be gone once the whole snapshot has been mapped, a run given other files than the last
+    #--snapshot was made of would delete every entity in the ones it was not given, so it leaves the snapshot open instead
+    if args.hash_db and not shut_down and error_count == 0:
+        base_file_names = mapper.hash_index.get_snapshot_file_names()
+        if base_file_names and base_file_names != set(snapshot_file_list) and not args.snapshot_files_changed:
+            missing_count = len(base_file_names - set(snapshot_file_list))
+            new_count = len(set(snapshot_file_list) - base_file_names)
+            print(f'WARNING: the last snapshot was made of {len(base_file_names)} entity files, this run was given {len(snapshot_file_list)}, {missing_count} missing and {new_count} new')
+            print(f'No deletes were written and snapshot {mapper.hash_index.snapshot} was left open, map every file of the snapshot or add --snapshot_files_changed if its files did change\n')
+        else:
+            deleted_count = save_deleted_entities(args.output_path + 'deleted_entities.json', snapshot_file_list)
+            if deleted_count:
+                print(f'{deleted_count} deleted entities written to {args.output_path}deleted_entities.json')
+            print(f'Snapshot {mapper.hash_index.snapshot - 1} completed in {args.hash_db}\n')
 
-        if shut_down:
-            break
+    if input_file_count and args.delta_path:
 
-        elapsed_mins = round((time.time() - file_start_time) / 60, 1)
-        run_status = ('completed in' if not shut_down else 'aborted after') + ' %s minutes' % elapsed_mins
-        print('\n%s files read, %s rows written, %s rows processed, %s\n' % (input_file_count, output_row_count, input_row_count, run_status))
+        #--leave the new codes and statistics for a later merge
+        print('New codes and mapping stats written to %s\n' % mapper.save_delta_file(args.delta_path))
 
-    if input_file_count:
+    elif input_file_count:
 
         #--append any new codes to the sayari_codes.csv
         mapper.save_codes_file()
 
         #--write statistics file
         if args.log_file: 
-            with open(args.log_file, 'w') as outfile:
-                json.dump(mapper.stat_pack, outfile, indent=4, sort_keys = True)
+            replace_file(args.log_file, json.dumps(mapper.get_stat_pack(), indent=4, sort_keys = True))
             print('Mapping stats written to %s\n' % args.log_file)
 
+    if mapper.stage_times.stage_data:
+        print(f'{"stage":<15} {"seconds":>10} {"count":>12} {"per second":>12}')
+        stage_pack = mapper.stage_times.get_stat_pack()
+        for stage in mapper.stage_times.get_stages():
+            stage_data = stage_pack[stage]
+            print(f'{stage:<15} {stage_data["seconds"]:>10} {stage_data["count"]:>12} {stage_data["per_second"]:>12}')
+        if args.profile:
+            print(f'\nProfiles written to {os.path.join(args.output_path, "profiles")}')
+
+    if monitor:
+        monitor.close('completed' if shut_down == 0 and error_count == 0 else 'failed' if shut_down == 0 else 'aborted')
+        print(f'\nProgress metrics written to {args.metrics_file}')
+
     print('')
     elapsed_mins = round((time.time() - proc_start_time) / 60, 1)
-    if shut_down == 0:
+    if shut_down == 0 and error_count == 0:
         print('Process completed successfully in %s minutes' % elapsed_mins)
+    elif shut_down == 0:
+        print('Process completed with %s failed files in %s minutes!' % (error_count, elapsed_mins))
     else:
         print('Process aborted after %s minutes!' % elapsed_mins)
     print('')
 
     #display_process_stats(main_pid, 'final')
 
-    sys.exit(0)
+    sys.exit(0 if shut_down == 0 and error_count == 0 else 1)
 